@@ -5,20 +5,58 @@ Control Plane Development Kit (CPDK) Daemon
 """
 import zmq
 import sys
+import time
+import errno
+import threading
+import collections
 import signal
 import logging
 import settings
 import argparse
-from cpdk_db import import_user_models
+import os
+import json
+from contextlib import contextmanager
+from cpdk_db import import_user_models, create_cpdk_engine, describe_engine
+from cpdk_settings import apply_defaults
+from cpdk_cache import ObjectCache
+from cpdk_changelog import ChangeLog
+from cpdk_conflate import Conflator
+from cpdk_metrics import Metrics
+from cpdk_profile import ProcessProfiler, RequestProfiler
+from cpdk_codec import JSONCodec, get_codec, sniff_codec, pubsub_topic, field_id
 
-from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.inspection import inspect as sql_inspect
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session, load_only
 
 # Global flag to indicate if the daemon should keep processing in its main loop
 is_running = True
 Session = None
 user_models = None
+object_cache = None
+changelog = None
+conflator = None
+metrics = None
+worker_pool = None
+request_profiler = None
+
+# Encoding of the messages published on the PUB-SUB channel. Requests are answered in whatever encoding they came in.
+pubsub_codec = JSONCodec
+
+# Message types which never write to the database. These are processed by the worker threads.
+READ_ONLY_TYPES = ('get', 'list', 'cache_stats', 'changes_since', 'conflate_stats', 'stats')
+
+# Every message type. Metrics of anything else are counted under 'other'.
+MESSAGE_TYPES = READ_ONLY_TYPES + ('get_or_create', 'create', 'modify', 'delete', 'delete_all', 'add_ref', 'del_ref',
+                                   'batch', 'profile', 'reload')
+
+# Options of the 'list' message type which select what to return
+LIST_OPTIONS = ('limit', 'cursor', 'fields', 'include_refs', 'filter')
+
+# Socket the worker threads receive requests on
+WORKER_ENDPOINT = 'inproc://cpdkd-workers'
+WORKER_READY = 'READY'
 
 # Command IDs for the PUB-SUB channel
 CMD_ID_CREATE = 1
@@ -27,6 +65,7 @@ CMD_ID_MODIFY = 3
 CMD_ID_ADDREF = 4
 CMD_ID_DELREF = 5
 CMD_ID_DELETE_ALL = 6
+CMD_ID_RELOAD = 7
 
 
 def signal_handler(sig, frame):
@@ -48,7 +87,7 @@ def setup_pubsub_zmq():
     Create a Zero Message Queue publisher
     :return: The zmq socket object
     """
-    context = zmq.Context()
+    context = zmq.Context.instance()
     zmq_socket = context.socket(zmq.PUB)
     zmq_listen_addr = "tcp://*:" + str(settings.ZMQ_PUBSUB_PORT)
     logging.info('Starting ZMQ PubSub server on %s' % zmq_listen_addr)
@@ -58,11 +97,12 @@ def setup_pubsub_zmq():
 
 def setup_daemon_zmq():
     """
-    Create a Zero Message Queue socket that daemons can interact with
+    Create a Zero Message Queue socket that daemons can interact with.
+    It's a ROUTER socket, so daemons using REQ sockets can talk to it and replies can be sent in any order.
     :return: The zmq socket object
     """
-    context = zmq.Context()
-    zmq_socket = context.socket(zmq.REP)
+    context = zmq.Context.instance()
+    zmq_socket = context.socket(zmq.ROUTER)
     zmq_listen_addr = "tcp://*:" + str(settings.ZMQ_CLIENT_SERVER_PORT)
     logging.info('Starting ZMQ conf pull server on %s' % zmq_listen_addr)
     zmq_socket.bind(zmq_listen_addr)
@@ -71,11 +111,12 @@ def setup_daemon_zmq():
 
 def setup_cli_zmq():
     """
-    Create a Zero Message Queue server and start listening on the designated port
+    Create a Zero Message Queue server and start listening on the designated port.
+    It's a ROUTER socket, so clients using REQ sockets can talk to it and replies can be sent in any order.
     :return: The zmq socket object
     """
-    context = zmq.Context()
-    zmq_socket = context.socket(zmq.REP)
+    context = zmq.Context.instance()
+    zmq_socket = context.socket(zmq.ROUTER)
     zmq_listen_addr = "tcp://*:" + str(settings.ZMQ_SHELL_PORT)
 
     logging.info('Starting ZMQ CLI server on %s' % zmq_listen_addr)
@@ -83,6 +124,157 @@ def setup_cli_zmq():
     return zmq_socket
 
 
+def drain_requests(zmq_socket):
+    """
+    Generator which yields every message currently queued on a ROUTER socket without blocking
+    :param zmq_socket: The ROUTER socket to read from
+    :return: Tuples of (envelope, payload). The envelope is the list of routing frames to send the reply back with.
+    """
+    while is_running:
+        try:
+            frames = zmq_socket.recv_multipart(flags=zmq.NOBLOCK)
+        except zmq.ZMQError, e:
+            if e.errno == zmq.EAGAIN:
+                return
+            raise
+
+        yield frames[:-1], frames[-1]
+
+
+def is_read_only(msg):
+    """
+    Check if a message only reads from the database, meaning it can be processed by any worker thread
+    :param msg: The decoded message
+    :return: True if the message never writes
+    """
+    if msg.get('t') == 'batch':
+        # Malformed batches are answered by process_batch_msg(), on the main thread
+        return is_op_list(msg.get('ops', [])) and all(is_read_only(op) for op in msg.get('ops', []))
+
+    return msg.get('t') in READ_ONLY_TYPES
+
+
+def is_op_list(ops):
+    """
+    Check the operations of a batch message
+    :param ops: The 'ops' member of the message
+    :return: True if it's a list of messages
+    """
+    return isinstance(ops, list) and all(isinstance(op, dict) for op in ops)
+
+
+class WorkerPool(object):
+    """
+    Pool of threads processing read-only messages.
+    Requests are handed to idle workers through an inproc ROUTER socket. When all workers are busy, requests are queued
+    until one of them is done, so a slow request never holds up requests waiting behind it.
+    """
+
+    def __init__(self, size):
+        """
+        Constructor. Binds the worker socket and starts the threads.
+        :param size: The number of worker threads
+        """
+        self.zmq_socket = zmq.Context.instance().socket(zmq.ROUTER)
+        self.zmq_socket.bind(WORKER_ENDPOINT)
+        self.idle_workers = collections.deque()
+        self.pending = collections.deque()
+        self.threads = []
+
+        for x in range(size):
+            thread = threading.Thread(target=worker_main, name='cpdkd-worker-%d' % x)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+        logging.info('Started %d worker threads' % size)
+
+    def dispatch(self, frontend_name, envelope, payload):
+        """
+        Hand a request to an idle worker, or queue it until one becomes available
+        :param frontend_name: Name of the front end socket the reply has to be sent on
+        :param envelope: Routing frames of the request
+        :param payload: The encoded request
+        :return: None
+        """
+        frames = [frontend_name] + envelope + [payload]
+        if self.idle_workers:
+            self.zmq_socket.send_multipart([self.idle_workers.popleft(), ''] + frames)
+        else:
+            self.pending.append(frames)
+
+    def drain_replies(self):
+        """
+        Generator which yields every reply the workers have finished, and hands queued requests to the workers
+        that became idle
+        :return: Tuples of (front end name, envelope, reply)
+        """
+        for envelope, payload in drain_requests(self.zmq_socket):
+            worker = envelope[0]
+
+            if self.pending:
+                self.zmq_socket.send_multipart([worker, ''] + self.pending.popleft())
+            else:
+                self.idle_workers.append(worker)
+
+            # The first message from every worker only says that it's ready
+            if payload != WORKER_READY:
+                yield envelope[2], envelope[3:], payload
+
+    def join(self):
+        """
+        Wait for the worker threads to notice CPDKd is shutting down
+        :return: None
+        """
+        for thread in self.threads:
+            thread.join(settings.CPDKD_POLL_TIMEOUT * 2 / 1000.0)
+
+        # Closing only releases the endpoint later on, in ZMQ's own thread
+        self.zmq_socket.unbind(WORKER_ENDPOINT)
+        self.zmq_socket.close(linger=0)
+
+
+def worker_main():
+    """
+    Main loop of a worker thread. Processes the read-only messages handed out by the WorkerPool.
+    :return: None
+    """
+    zmq_socket = zmq.Context.instance().socket(zmq.REQ)
+    zmq_socket.connect(WORKER_ENDPOINT)
+    zmq_socket.send(WORKER_READY)
+
+    while is_running:
+        if not zmq_socket.poll(settings.CPDKD_POLL_TIMEOUT):
+            continue
+
+        frames = zmq_socket.recv_multipart()
+        codec = sniff_codec(frames[-1])
+        try:
+            reply = codec.encode(handle_config_msg(codec.decode(frames[-1]), None))
+        except Exception, e:
+            # A worker that dies leaves its client waiting forever, so always answer
+            logging.exception('Worker failed to process %r' % frames[-1])
+            reply = codec.encode({'status': 'error', 'message': 'internal error: %s' % e})
+        zmq_socket.send_multipart(frames[:-1] + [reply])
+
+    zmq_socket.close(linger=0)
+
+
+@contextmanager
+def session_scope():
+    """
+    Provide the database session for a single request.
+    The session object is reused from one request to the next (one per thread) and is always closed once the request
+    is done, which rolls back anything left uncommitted and hands its connection back to the pool.
+    :return: The session
+    """
+    session = Session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
 def process_client_msg(msg):
     """
     Process a unicast client request message
@@ -93,8 +285,8 @@ def process_client_msg(msg):
     response = {}
 
     model = user_models[msg['object']]
-    session = Session()
-    q_result = session.query(model.__class__).all()
+    with session_scope() as session:
+        q_result = session.query(model.__class__).all()
 
     for r in q_result:
         entry = {}
@@ -111,9 +303,578 @@ def process_client_msg(msg):
     return response
 
 
+def publish_event(zmq_pub_socket, model_name, event):
+    """
+    Send a single event out on the PUB-SUB channel, as a topic frame followed by the encoded event
+    :param zmq_pub_socket: The ZMQ socket to be used for PUBLISH messages
+    :param model_name: Name of the model the event is for. Used, along with the object name, as the topic.
+    :param event: Dictionary describing the event (type, obj, field, value)
+    :return: None
+    """
+    frames = [pubsub_topic(model_name, event.get('obj')), pubsub_codec.encode(event)]
+    zmq_pub_socket.send_multipart(frames)
+
+    if metrics is not None:
+        metrics.published(model_name, len(frames[0]) + len(frames[1]))
+
+
+def handle_config_msg(msg, zmq_pub_socket):
+    """
+    Process a configuration message, recording its metrics, and profiling it if it's sampled
+    :param msg: The message, as received from the ZMQ socket. See process_config_msg().
+    :param zmq_pub_socket: The ZMQ socket to be used for PUBLISH messages. None for read-only messages.
+    :return: The response to be sent to the client
+    """
+    msg_type = msg.get('t') if msg.get('t') in MESSAGE_TYPES else 'other'
+    if metrics is None:
+        return profile_config_msg(msg_type, msg, zmq_pub_socket)
+
+    started = metrics.start_request()
+    try:
+        response = profile_config_msg(msg_type, msg, zmq_pub_socket)
+    except Exception:
+        metrics.end_request(msg_type, started, False)
+        raise
+
+    metrics.end_request(msg_type, started, response.get('status') == 'ok')
+    return response
+
+
+def profile_config_msg(msg_type, msg, zmq_pub_socket):
+    """
+    Process a configuration message, profiling it if request profiling is on and the message is sampled
+    :return: The response to be sent to the client
+    """
+    profiler = request_profiler
+    if profiler is None or msg_type == 'profile':
+        return process_config_msg(msg, zmq_pub_socket)
+
+    return profiler.call(msg_type, process_config_msg, msg, zmq_pub_socket)
+
+
+def process_profile_msg(msg):
+    """
+    Turn request profiling on or off
+    :param msg: The message. 'action' is one of:
+        start - Start profiling one in every 'sample' requests (CPDKD_PROFILE_SAMPLE if it's left out)
+        stop - Stop profiling, and write the profiles to PROFILE_DIR
+        status - Return the sampling counters
+    :return: The response to be sent to the client
+    """
+    global request_profiler
+
+    action = msg.get('action', 'status')
+    if action == 'start':
+        if request_profiler is not None:
+            return {'status': 'error', 'message': 'requests are already being profiled'}
+
+        try:
+            profiler = RequestProfiler('cpdkd', settings.PROFILE_DIR, msg.get('sample', settings.CPDKD_PROFILE_SAMPLE))
+        except (TypeError, ValueError):
+            return {'status': 'error', 'message': 'invalid sample %s' % msg.get('sample')}
+        profiler.start()
+        request_profiler = profiler
+        return {'status': 'ok', 'result': profiler.status()}
+
+    elif action == 'stop':
+        if request_profiler is None:
+            return {'status': 'error', 'message': 'requests are not being profiled'}
+
+        profiler = request_profiler
+        request_profiler = None
+        try:
+            files = profiler.stop()
+        except (IOError, OSError), e:
+            return {'status': 'error', 'message': 'failed to write the profiles: %s' % e}
+        return {'status': 'ok', 'result': profiler.status(), 'files': files}
+
+    elif action == 'status':
+        return {'status': 'ok', 'result': request_profiler.status() if request_profiler is not None else None}
+
+    return {'status': 'error', 'message': 'unknown profile action %s' % action}
+
+
 def process_config_msg(msg, zmq_pub_socket):
     """
-    Process a configuration message.
+    Process a configuration message. Every message runs in its own transaction, and the PUB-SUB events it generates
+    are only sent once that transaction has been committed.
+    :param msg: The message, as received from the ZMQ socket. See process_config_op() for the format.
+        A message of type 'batch' carries a list of such messages in 'ops'. See process_batch_msg().
+    :param zmq_pub_socket: The ZMQ socket to be used for PUBLISH messages. None for read-only messages.
+    :return: The response to be sent to the client
+    """
+    logging.debug("Received request: %s " % str(msg))
+
+    if msg['t'] == 'cache_stats':
+        return {'status': 'ok', 'result': object_cache.stats() if object_cache else None}
+
+    if msg['t'] == 'conflate_stats':
+        return {'status': 'ok', 'result': conflator.stats() if conflator else None}
+
+    if msg['t'] == 'stats':
+        return {'status': 'ok', 'result': collect_stats()}
+
+    if msg['t'] == 'profile':
+        return process_profile_msg(msg)
+
+    if msg['t'] == 'modify' and is_conflated(msg):
+        error = check_conflated(msg)
+        if error is not None:
+            return error
+
+        conflator.accept(msg['o'], msg['on'], msg['f'], msg['fv'])
+        return {'status': 'ok', 'conflated': True}
+
+    # Anything read from here on is at least as new as this revision
+    revision = changelog.revision if changelog is not None else None
+
+    with session_scope() as session:
+        events = []
+
+        if msg['t'] == 'changes_since':
+            return process_changes_since_msg(msg, session)
+
+        # Remember what the cache looked like before this request reads anything from the database
+        if object_cache is not None:
+            session.info['cache_version'] = object_cache.version
+
+        conflated = []
+        if msg['t'] == 'batch':
+            response = process_batch_msg(msg, session, events, conflated)
+        else:
+            try:
+                response = process_config_op(msg, session, events)
+            except (KeyError, AttributeError, TypeError, SQLAlchemyError), e:
+                response = {'status': 'error', 'message': error_message(e)}
+
+        if response['status'] != 'ok':
+            session.rollback()
+            return response
+
+        try:
+            commit_changes(session, events, zmq_pub_socket)
+        except SQLAlchemyError, e:
+            return {'status': 'error', 'message': 'commit failed: %s' % error_message(e)}
+
+        # Conflated updates in a batch only count once the rest of it has been committed
+        for op in conflated:
+            conflator.accept(op['o'], op['on'], op['f'], op['fv'])
+
+        if changelog is not None and events:
+            revision = changelog.revision
+
+        if revision is not None:
+            response['revision'] = revision
+            response['epoch'] = changelog.epoch
+
+        return response
+
+
+def error_message(e):
+    """
+    Describe an exception raised while running an operation, for its error response
+    :param e: The exception
+    :return: The message. Database errors are described by the driver's error alone: SQLAlchemy can fail to format
+        the parameters of the statement.
+    """
+    return '%s: %s' % (e.__class__.__name__, getattr(e, 'orig', None) or e)
+
+
+def commit_changes(session, events, zmq_pub_socket):
+    """
+    Commit the current transaction, then bring the object cache, the change log and the subscribers up to date
+    :param session: The database session holding the transaction
+    :param events: List of (model name, event) tuples queued up by the transaction
+    :param zmq_pub_socket: The ZMQ socket to be used for PUBLISH messages
+    :return: None
+    :raises SQLAlchemyError: If the commit failed. The transaction has been rolled back.
+    """
+    # Daemons dispatch on the ID of the field, rather than comparing its name against each of theirs
+    for model_name, event in events:
+        if 'field' in event:
+            event['fid'] = field_id(event['field'])
+
+    model_revisions = None
+    try:
+        if changelog is not None and events:
+            model_revisions = changelog.stamp(session, events)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+
+    # The cache has to be up to date before the new revision is handed out, otherwise a reader could get
+    # the new revision along with old objects from the cache
+    if object_cache is not None:
+        update_cache(session, events)
+
+    if conflator is not None:
+        discard_conflated(events)
+
+    if model_revisions is not None:
+        changelog.advance(model_revisions)
+
+    for model_name, event in events:
+        publish_event(zmq_pub_socket, model_name, event)
+
+
+def is_conflated(msg):
+    """
+    Check if a modify message is for a field whose updates are conflated
+    :param msg: The modify message
+    :return: True if the update should be handed to the conflator rather than committed
+    """
+    if conflator is None or not isinstance(msg.get('o'), basestring) or msg['o'] not in user_models:
+        return False
+
+    if 'on' not in msg or 'fv' not in msg:
+        return False
+
+    return user_models[msg['o']].__class__.is_conflated(msg.get('f'))
+
+
+def check_conflated(msg):
+    """
+    Check a conflated update before it's held back. Its value is only checked by the database, when it's written out.
+    :param msg: The modify message
+    :return: The error response to be sent to the client, or None if the update can be conflated
+    """
+    if not isinstance(msg['on'], basestring):
+        return {'status': 'error', 'message': 'invalid %s name %r' % (msg['o'], msg['on'])}
+
+    return None
+
+
+def discard_conflated(events):
+    """
+    Throw away the pending conflated updates which committed changes have made obsolete: updates to deleted objects,
+    and updates to fields which have just been written directly.
+    :param events: List of (model name, event) tuples which have been committed
+    :return: None
+    """
+    for model_name, event in events:
+        if event['type'] == CMD_ID_DELETE:
+            conflator.discard(model_name, event['obj'])
+        elif event['type'] == CMD_ID_DELETE_ALL or event['type'] == CMD_ID_RELOAD:
+            conflator.discard(model_name)
+        elif event['type'] == CMD_ID_MODIFY:
+            conflator.discard(model_name, event['obj'], event['field'])
+
+
+def flush_conflated(zmq_pub_socket):
+    """
+    Commit and publish the latest value of every pending conflated update, all in one transaction.
+    Updates to objects which no longer exist, and values the database rejects, are dropped. Each update is made in its
+    own savepoint, so a bad value only loses that update.
+    :param zmq_pub_socket: The ZMQ socket to be used for PUBLISH messages
+    :return: None
+    """
+    updates = conflator.take()
+    if not updates:
+        return
+
+    started = metrics.start_request() if metrics is not None else None
+    dropped = 0
+    with session_scope() as session:
+        events = []
+        for (model_name, name, field), value in updates:
+            update_events = []
+            try:
+                with session.begin_nested():
+                    response = process_config_op({'t': 'modify', 'o': model_name, 'on': name, 'f': field,
+                                                  'fv': value}, session, update_events)
+            except (AttributeError, TypeError, SQLAlchemyError), e:
+                response = {'status': 'error', 'message': error_message(e)}
+
+            if response['status'] == 'ok':
+                events.extend(update_events)
+
+            if response['status'] != 'ok':
+                logging.warning('Dropped conflated update of %s %s %s: %s' %
+                                (model_name, name, field, response['message']))
+                dropped += 1
+
+        try:
+            commit_changes(session, events, zmq_pub_socket)
+        except SQLAlchemyError, e:
+            logging.error('Dropped %d conflated updates, commit failed: %s' % (len(updates), error_message(e)))
+            conflator.count(0, len(updates))
+            if metrics is not None:
+                metrics.end_request('conflate_flush', started, False)
+            return
+
+    conflator.count(len(updates) - dropped, dropped)
+    if metrics is not None:
+        metrics.end_request('conflate_flush', started, True)
+
+
+def collect_stats():
+    """
+    Gather the metrics, along with the counters of the object cache, conflation and worker pool
+    :return: Dictionary of counters, or None if metrics are disabled
+    """
+    if metrics is None:
+        return None
+
+    result = metrics.stats()
+    result['revision'] = changelog.revision if changelog is not None else None
+    result['cache'] = object_cache.stats() if object_cache is not None else None
+    result['conflation'] = conflator.stats() if conflator is not None else None
+    if worker_pool is not None:
+        result['workers'] = {'threads': len(worker_pool.threads),
+                             'idle': len(worker_pool.idle_workers),
+                             'queued': len(worker_pool.pending)}
+    return result
+
+
+def dump_stats(path):
+    """
+    Write the output of collect_stats() to a file. The file is replaced in one go, so readers never see half of it.
+    :param path: Name of the file
+    :return: None
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(collect_stats(), f, indent=2, sort_keys=True)
+        os.rename(tmp_path, path)
+    except (IOError, OSError), e:
+        logging.error('Failed to write stats to %s: %s' % (path, e))
+
+
+def process_changes_since_msg(msg, session):
+    """
+    Fetch the changes committed after a given revision
+    :param msg: The message. 'rev' is the last revision the caller has seen, 'o' optionally limits the changes to
+        a single model.
+    :param session: The database session to read from
+    :return: The response to be sent to the client
+    """
+    if changelog is None:
+        return {'status': 'error', 'message': 'the change log is disabled'}
+
+    try:
+        revision = int(msg['rev'])
+    except (KeyError, TypeError, ValueError):
+        return {'status': 'error', 'message': 'changes_since needs a revision (rev)'}
+
+    if 'o' in msg and msg['o'] not in user_models:
+        return {'status': 'error', 'message': 'unknown object type %s' % msg['o']}
+
+    changes, current = changelog.changes_since(session, revision, msg.get('o'))
+    if changes is None:
+        return {'status': 'ok', 'resync': True, 'revision': current, 'epoch': changelog.epoch}
+
+    return {'status': 'ok', 'changes': changes, 'revision': current, 'epoch': changelog.epoch}
+
+
+def can_use_cache(events):
+    """
+    Check if the object cache can be used by the current transaction.
+    The cache only holds committed state, so it's bypassed once the transaction has made any changes.
+    :param events: The PUB-SUB events queued up by the current transaction so far
+    :return: True if the cache can be read from and filled
+    """
+    return object_cache is not None and not events
+
+
+def cached_object(model_name, name, events):
+    """
+    Fetch an object from the object cache
+    :param model_name: Name of the model class
+    :param name: Name of the object
+    :param events: The PUB-SUB events queued up by the current transaction so far
+    :return: The serialized object, or None if it has to be fetched from the database
+    """
+    if not can_use_cache(events):
+        return None
+
+    return object_cache.get(model_name, name)
+
+
+def refresh_cached_object(session, model_name, name):
+    """
+    Re-read an object from the database, if the object cache needs to hold it
+    :return: None
+    """
+    if not object_cache.contains(model_name, name):
+        return
+
+    obj = user_models[model_name].__class__.query_by_name(session, name).first()
+    if obj is None:
+        object_cache.pop(model_name, name)
+    else:
+        object_cache.put(model_name, name, obj.serialize())
+
+
+def update_cache(session, events):
+    """
+    Apply committed changes to the object cache. Called with the same events that are published on the PUB-SUB channel.
+    :param session: The database session the changes were committed in
+    :param events: List of (model name, event) tuples
+    :return: None
+    """
+    for model_name, event in events:
+        if event['type'] == CMD_ID_MODIFY:
+            if event['field'] == 'name':
+                # The object is cached under its old name, and other models refer to it by that name
+                object_cache.pop(model_name, event['obj'])
+                for other_name, other_model in user_models.iteritems():
+                    for key, rel in sql_inspect(other_model).mapper.relationships.items():
+                        if rel.mapper.class_.__name__ == model_name:
+                            object_cache.pop_model(other_name)
+                refresh_cached_object(session, model_name, event['value'])
+            else:
+                # The event holds the value as the client sent it, the database may have converted it
+                refresh_cached_object(session, model_name, event['obj'])
+
+        elif event['type'] == CMD_ID_CREATE:
+            refresh_cached_object(session, model_name, event['obj'])
+
+        elif event['type'] == CMD_ID_ADDREF or event['type'] == CMD_ID_DELREF:
+            # Both ends of the relationship may have changed
+            refresh_cached_object(session, model_name, event['obj'])
+            refresh_cached_object(session, event['field'], event['value'])
+
+        elif event['type'] == CMD_ID_DELETE or event['type'] == CMD_ID_DELETE_ALL:
+            if event['type'] == CMD_ID_DELETE:
+                object_cache.pop(model_name, event['obj'])
+            else:
+                object_cache.clear_model(model_name)
+
+            # Drop the deleted objects from the relationships of any other models pointing at them
+            for other_name, other_model in user_models.iteritems():
+                for key, rel in sql_inspect(other_model).mapper.relationships.items():
+                    if rel.mapper.class_.__name__ == model_name:
+                        object_cache.remove_reference(other_name, key, event.get('obj'))
+
+        elif event['type'] == CMD_ID_RELOAD:
+            # The relationships of other models may have been reloaded too, so start over
+            object_cache.clear()
+
+
+def preload_cache():
+    """
+    Load every object of every model into the object cache
+    :return: None
+    """
+    with session_scope() as session:
+        for model_name, model in user_models.iteritems():
+            objects = model.__class__.query_all(session).all()
+            object_cache.put_model(model_name, [obj.serialize() for obj in objects])
+    logging.info('Object cache preloaded: %s' % object_cache.stats())
+
+
+def list_objects(session, model, msg):
+    """
+    Fetch a page of objects for a list message
+    :param session: The database session to run the query in
+    :param model: The model class to list
+    :param msg: The list message. The following members are optional:
+        limit - Maximum number of objects to return (capped by CPDKD_LIST_MAX_PAGE_SIZE)
+        cursor - Cursor returned with the previous page
+        fields - Names of the columns and relationships to return. The object name is always returned.
+        include_refs - Set to false to leave out relationships
+        filter - Dictionary of column names and values the objects have to match. Only indexed columns can be used.
+    :return: Tuple of (list of serialized objects, cursor for the next page or None if this was the last page)
+    :raises ValueError: If any of the options are invalid
+    """
+    mapper = sql_inspect(model)
+    columns = [column.name for column in model.__table__.columns]
+    relationships = mapper.relationships.keys() if msg.get('include_refs', True) else []
+
+    if 'fields' in msg:
+        unknown = [f for f in msg['fields'] if f not in columns and f not in mapper.relationships]
+        if unknown:
+            raise ValueError('unknown fields %s' % ', '.join(unknown))
+
+        columns = [c for c in columns if c in msg['fields'] or c == 'id' or c == 'name']
+        relationships = [r for r in relationships if r in msg['fields']]
+
+    query = model.query_all(session, relationships)
+    if 'fields' in msg:
+        query = query.options(load_only(*columns))
+
+    for column, value in msg.get('filter', {}).iteritems():
+        if not model.is_filterable(column):
+            raise ValueError('%s.%s is not indexed and can not be filtered on' % (model.__name__, column))
+        query = query.filter(getattr(model, column) == value)
+
+    # Pages are ordered by id, and the cursor is the id of the last object handed out
+    if msg.get('cursor'):
+        try:
+            query = query.filter(model.id > int(msg['cursor']))
+        except ValueError:
+            raise ValueError('invalid cursor %s' % msg['cursor'])
+    query = query.order_by(model.id)
+
+    limit = msg.get('limit')
+    if limit is not None:
+        limit = min(int(limit), settings.CPDKD_LIST_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError('invalid limit %s' % msg['limit'])
+
+        # Fetch one extra object to find out if there's another page
+        query = query.limit(limit + 1)
+
+    objects = query.all()
+    cursor = None
+    if limit is not None and len(objects) > limit:
+        objects = objects[:limit]
+        cursor = str(objects[-1].id)
+
+    return [obj.serialize(columns, relationships) for obj in objects], cursor
+
+
+def process_batch_msg(msg, session, events, conflated):
+    """
+    Run an ordered list of operations in a single transaction. Either all of them are applied, or none are.
+    Processing stops at the first operation which fails.
+    :param msg: The batch message. Expected format is a JSON object with the following members:
+        t - 'batch'
+        ops - List of messages, in the same format accepted by process_config_op(), or 'changes_since' messages
+    :param session: The database session to run the operations in
+    :param events: List that PUB-SUB events are appended to, as (model name, event) tuples
+    :param conflated: List that updates of conflated fields are appended to, rather than being run. The caller hands
+        them to the conflator once the transaction has been committed.
+    :return: The response to be sent to the client. 'results' holds the response of each operation that was run.
+    """
+    if not is_op_list(msg.get('ops', [])):
+        return {'status': 'error', 'message': 'ops has to be a list of messages'}
+
+    response = {'status': 'ok', 'results': []}
+
+    for x, op in enumerate(msg.get('ops', [])):
+        if op.get('t') == 'batch':
+            result = {'status': 'error', 'message': 'batch messages can not be nested'}
+        elif op.get('t') == 'modify' and is_conflated(op):
+            # Checked now, so nothing can go wrong handing it over once the batch has been committed
+            result = check_conflated(op)
+            if result is None:
+                conflated.append(op)
+                result = {'status': 'ok', 'conflated': True}
+        elif op.get('t') == 'changes_since':
+            result = process_changes_since_msg(op, session)
+        else:
+            try:
+                result = process_config_op(op, session, events)
+            except (KeyError, AttributeError, TypeError, SQLAlchemyError), e:
+                result = {'status': 'error', 'message': error_message(e)}
+
+        response['results'].append(result)
+
+        if result['status'] != 'ok':
+            response['status'] = 'error'
+            response['message'] = 'operation %d failed: %s' % (x, result['message'])
+            response['index'] = x
+            break
+
+    return response
+
+
+def process_config_op(msg, session, events):
+    """
+    Process a single configuration operation. Nothing is committed here; that's up to the caller.
     :param msg: The message, as received from the ZMQ socket
     Expected format is a JSON object with the following members:
         t - The type of message (get_or_create | get | create | modify | delete | delete_all | list | add_ref | del_ref)
@@ -121,86 +882,114 @@ def process_config_msg(msg, zmq_pub_socket):
         on - The name of the object instance being worked on (optional for list commands only)
         (optional) f - Name of the field for the object
         (optional) fv - Value for the field
-    :param zmq_pub_socket: The ZMQ socket to be used for PUBLISH messages
+    :param session: The database session to run the operation in
+    :param events: List that PUB-SUB events are appended to, as (model name, event) tuples
     :return: The response to be sent to the client
     """
     response = {'status': 'ok'}
-    logging.debug("Received request: %s " % str(msg))
-    model = user_models[msg['o']]
-    session = Session()
 
+    if msg.get('o') not in user_models:
+        return {'status': 'error', 'message': 'unknown object type %s' % msg.get('o')}
+
+    model = user_models[msg['o']]
     if msg['t'] == 'get_or_create':     # Get an object, create it if it doesn't exist
+        entry = cached_object(msg['o'], msg['on'], events)
         try:
-            q_result = session.query(model.__class__).filter(model.__class__.name == msg['on']).one()
+            if entry is None:
+                q_result = model.__class__.query_by_name(session, msg['on']).one()
+                if can_use_cache(events):
+                    object_cache.fill(msg['o'], q_result.name, q_result.serialize(), session.info['cache_version'])
+                entry = {'id': q_result.id}
             response['result'] = 'exists'
-            response['id'] = q_result.id
+            response['id'] = entry['id']
         except NoResultFound:
             new_model = model.__class__()
             new_model.name = msg['on']
             session.add(new_model)
-            session.commit()
+            session.flush()
             response['result'] = 'created'
             response['id'] = new_model.id
 
-            # Send out the PUB-SUB message
-            zmq_pub_socket.send_json([model.__class__.__name__, {'type': CMD_ID_CREATE, 'obj': msg['on']}])
+            # Queue up the PUB-SUB message
+            events.append((model.__class__.__name__, {'type': CMD_ID_CREATE, 'obj': msg['on']}))
 
     elif msg['t'] == 'get':     # Query for the existence of an object
+        entry = cached_object(msg['o'], msg['on'], events)
         try:
-            q_result = session.query(model.__class__).filter(model.__class__.name == msg['on']).one()
-            response['id'] = q_result.id
+            if entry is None:
+                q_result = model.__class__.query_by_name(session, msg['on']).one()
+                if can_use_cache(events):
+                    object_cache.fill(msg['o'], q_result.name, q_result.serialize(), session.info['cache_version'])
+                entry = {'id': q_result.id}
+            response['id'] = entry['id']
         except NoResultFound:
             response['status'] = 'error'
             response['message'] = '%s %s not found' % (model.__class__.__name__, msg['on'])
 
     elif msg['t'] == 'create':  # Create a new object
-        new_model = model.__class__()
-        new_model.name = msg['on']
-        session.add(new_model)
-        session.commit()
-        response['id'] = new_model.id
+        if model.__class__.query_by_name(session, msg['on']).first() is not None:
+            response['status'] = 'error'
+            response['message'] = '%s %s already exists' % (model.__class__.__name__, msg['on'])
+        else:
+            new_model = model.__class__()
+            new_model.name = msg['on']
+            session.add(new_model)
+            session.flush()
+            response['id'] = new_model.id
 
-        # Send out the PUB-SUB message
-        zmq_pub_socket.send_json([model.__class__.__name__, {'type': CMD_ID_CREATE, 'obj': msg['on']}])
-        pass
-    elif msg['t'] == 'delete':  # Delete a field or object
-        try:
-            q_result = session.query(model.__class__).filter(model.__class__.name == msg['on'])
-            if q_result.count() is 0:
-                response['status'] = 'error'
-                response['message'] = '%s %s not found' % (model.__class__.__name__, msg['on'])
-            else:
-                q_result.delete()
-                session.commit()
-                # Send out the PUB-SUB message
-                zmq_pub_socket.send_json([model.__class__.__name__, {'type': CMD_ID_DELETE, 'obj': msg['on']}])
+            # Queue up the PUB-SUB message
+            events.append((model.__class__.__name__, {'type': CMD_ID_CREATE, 'obj': msg['on']}))
 
-        except NoResultFound:
+    elif msg['t'] == 'delete':  # Delete a field or object
+        q_result = model.__class__.query_by_name(session, msg['on']).first()
+        if q_result is None:
             response['status'] = 'error'
             response['message'] = '%s %s not found' % (model.__class__.__name__, msg['on'])
+        else:
+            session.delete(q_result)
+
+            # Queue up the PUB-SUB message
+            events.append((model.__class__.__name__, {'type': CMD_ID_DELETE, 'obj': msg['on']}))
 
     elif msg['t'] == 'delete_all':
         q_result = session.query(model.__class__)
         q_result.delete()
-        session.commit()
 
-        # Send out a notification to all deamons to delete their local copies
-        zmq_pub_socket.send_json([model.__class__.__name__, {'type': CMD_ID_DELETE_ALL}])
+        # Queue up a notification to all deamons to delete their local copies
+        events.append((model.__class__.__name__, {'type': CMD_ID_DELETE_ALL}))
 
     elif msg['t'] == 'list':    # List model's fields
         try:
             if 'on' in msg:
-                q_result = session.query(model.__class__).filter(model.__class__.name == msg['on']).all()
-                if len(q_result) is 0:
+                entry = cached_object(msg['o'], msg['on'], events)
+                if entry is not None:
+                    response['result'] = [entry]
+                else:
+                    q_result = model.__class__.query_by_name(session, msg['on']).all()
+                    if len(q_result) is 0:
+                        response['status'] = 'error'
+                        response['message'] = '%s %s not found' % (model.__class__.__name__, msg['on'])
+
+                    response['result'] = [obj.serialize() for obj in q_result]
+                    if can_use_cache(events):
+                        for entry in response['result']:
+                            object_cache.fill(msg['o'], entry['name'], entry, session.info['cache_version'])
+            elif any(option in msg for option in LIST_OPTIONS):
+                try:
+                    response['result'], cursor = list_objects(session, model.__class__, msg)
+                    if cursor is not None:
+                        response['cursor'] = cursor
+                except ValueError, e:
                     response['status'] = 'error'
-                    response['message'] = '%s %s not found' % (model.__class__.__name__, msg['on'])
+                    response['message'] = str(e)
             else:
-                q_result = session.query(model.__class__).all()
-
-            response['result'] = []
-
-            for obj in q_result:
-                response['result'].append(obj.serialize())
+                entries = object_cache.list(msg['o']) if can_use_cache(events) else None
+                if entries is not None:
+                    response['result'] = entries
+                else:
+                    response['result'] = [obj.serialize() for obj in model.__class__.query_all(session).all()]
+                    if can_use_cache(events):
+                        object_cache.fill_model(msg['o'], response['result'], session.info['cache_version'])
 
         except NoResultFound:
             response['status'] = 'error'
@@ -209,15 +998,14 @@ def process_config_msg(msg, zmq_pub_socket):
     elif msg['t'] == 'modify':  # Modify a field
 
         try:
-            q_result = session.query(model.__class__).filter(model.__class__.name == msg['on']).one()
+            q_result = model.__class__.query_by_name(session, msg['on']).one()
             setattr(q_result, msg['f'], msg['fv'])
-            session.commit()
 
-            # Send out the PUB-SUB message
-            zmq_pub_socket.send_json([model.__class__.__name__, {'type': CMD_ID_MODIFY,
-                                                                 'obj': msg['on'],
-                                                                 'field': msg['f'],
-                                                                 'value': getattr(q_result, msg['f'])}])
+            # Queue up the PUB-SUB message
+            events.append((model.__class__.__name__, {'type': CMD_ID_MODIFY,
+                                                      'obj': msg['on'],
+                                                      'field': msg['f'],
+                                                      'value': getattr(q_result, msg['f'])}))
 
         except NoResultFound:
             response['status'] = 'error'
@@ -226,21 +1014,20 @@ def process_config_msg(msg, zmq_pub_socket):
     elif msg['t'] == 'add_ref':     # Add a reference to another object
         try:
             # First, lookup the object we're going to add the reference TO
-            q_result = session.query(model.__class__).filter(model.__class__.name == msg['on']).one()
+            q_result = model.__class__.query_by_name(session, msg['on']).one()
 
             # Next, lookup the object to be ADDED to the base
             ref_model = user_models[msg['f']]
             try:
-                q_ref_obj = session.query(ref_model.__class__).filter(ref_model.__class__.name == msg['fv']).one()
+                q_ref_obj = ref_model.__class__.query_by_name(session, msg['fv']).one()
 
                 getattr(q_result, msg['rv']).append(q_ref_obj)
-                session.commit()
 
-                # Send out PUBSUB message that the relationship was added
-                zmq_pub_socket.send_json([model.__class__.__name__, {'type': CMD_ID_ADDREF,
-                                                                     'obj': msg['on'],
-                                                                     'field': msg['f'],
-                                                                     'value': msg['fv']}])
+                # Queue up the PUBSUB message that the relationship was added
+                events.append((model.__class__.__name__, {'type': CMD_ID_ADDREF,
+                                                          'obj': msg['on'],
+                                                          'field': msg['f'],
+                                                          'value': msg['fv']}))
             except NoResultFound:
                 response['status'] = 'error'
                 response['message'] = '%s %s not found' % (ref_model.__class__.__name__, msg['fv'])
@@ -251,21 +1038,20 @@ def process_config_msg(msg, zmq_pub_socket):
     elif msg['t'] == 'del_ref':     # Delete an object reference
         try:
             # First, lookup the object we're going to add the reference TO
-            q_result = session.query(model.__class__).filter(model.__class__.name == msg['on']).one()
+            q_result = model.__class__.query_by_name(session, msg['on']).one()
 
             # Next, lookup the object to be ADDED to the base
             ref_model = user_models[msg['f']]
             try:
-                q_ref_obj = session.query(ref_model.__class__).filter(ref_model.__class__.name == msg['fv']).one()
+                q_ref_obj = ref_model.__class__.query_by_name(session, msg['fv']).one()
                 try:
                     getattr(q_result, msg['rv']).remove(q_ref_obj)
-                    session.commit()
 
-                    # Send out PUBSUB message that the relationship was added
-                    zmq_pub_socket.send_json([model.__class__.__name__, {'type': CMD_ID_DELREF,
-                                                                         'obj': msg['on'],
-                                                                         'field': msg['f'],
-                                                                         'value': msg['fv']}])
+                    # Queue up the PUBSUB message that the relationship was added
+                    events.append((model.__class__.__name__, {'type': CMD_ID_DELREF,
+                                                              'obj': msg['on'],
+                                                              'field': msg['f'],
+                                                              'value': msg['fv']}))
                 except ValueError:
                     response['status'] = 'error'
                     response['message'] = '%s is not associated with this object' % msg['fv']
@@ -276,12 +1062,66 @@ def process_config_msg(msg, zmq_pub_socket):
         except NoResultFound:
             response['status'] = 'error'
             response['message'] = '%s %s not found' % (model.__class__, model.__class__.name)
+    elif msg['t'] == 'reload':  # The model's objects were replaced in the database, by cpdk-util.py --load
+        if changelog is not None:
+            # The load gave the database a new epoch
+            changelog.refresh_epoch(session)
+
+        if msg.get('notice', True):
+            # Daemons fetch all of the objects again, a page at a time
+            events.append((model.__class__.__name__, {'type': CMD_ID_RELOAD}))
+        else:
+            # Only for daemons which predate reload events: every object is read, stamped and published in one go
+            events.append((model.__class__.__name__, {'type': CMD_ID_DELETE_ALL}))
+            events.extend(object_events(session, model.__class__))
+
     else:
-        response = {'status': 'error', 'message': 'unknown type %s' % msg['msg']}
+        response = {'status': 'error', 'message': 'unknown type %s' % msg['t']}
 
     return response
 
 
+def object_events(session, model):
+    """
+    Build the PUB-SUB events which would have been published if every object of a model had been created one at a time
+    :param session: The database session to read the objects from
+    :param model: The model class
+    :return: List of (model name, event) tuples
+    """
+    model_name = model.__name__
+    columns = [c.name for c in model.__table__.columns if c.name != 'id' and c.name != 'name']
+    relationships = sql_inspect(model).mapper.relationships
+
+    events = []
+    for obj in model.query_all(session).order_by(model.id):
+        entry = obj.serialize()
+        events.append((model_name, {'type': CMD_ID_CREATE, 'obj': obj.name}))
+
+        for column in columns:
+            if entry[column] is not None:
+                events.append((model_name, {'type': CMD_ID_MODIFY, 'obj': obj.name, 'field': column,
+                                            'value': entry[column]}))
+
+        for key, rel in relationships.items():
+            for ref_name in entry[key]:
+                events.append((model_name, {'type': CMD_ID_ADDREF, 'obj': obj.name,
+                                            'field': rel.mapper.class_.__name__, 'value': ref_name}))
+
+    return events
+
+
+def poll_timeout():
+    """
+    Work out how long the main loop can wait for requests
+    :return: Timeout in milliseconds. Shorter than CPDKD_POLL_TIMEOUT if conflated updates are due before then.
+    """
+    due_in = conflator.due_in() if conflator is not None else None
+    if due_in is None:
+        return settings.CPDKD_POLL_TIMEOUT
+
+    return min(settings.CPDKD_POLL_TIMEOUT, int(due_in * 1000) + 1)
+
+
 def main():
     """
     Main entry point for the daemon
@@ -295,6 +1135,9 @@ def main():
 
     parser = argparse.ArgumentParser(description='Control Plane Development Kit Daemon)')
     parser.add_argument('--settings', help='python path to settings file', dest='settings')
+    parser.add_argument('--profile', help='profile the main thread until CPDKd exits', action='store_true')
+    parser.add_argument('--profile-requests', help='profile one in every N requests until CPDKd exits', type=int,
+                        metavar='N', dest='profile_requests')
 
     args = vars(parser.parse_args())
 
@@ -303,45 +1146,156 @@ def main():
         settings = __import__(args['settings'], globals(), locals(), ['DB_NAME', 'DEBUG'], -1)
     else:
         import settings
+    apply_defaults(settings)
+
+    # Profile the main thread, and sample requests, until CPDKd exits
+    profiler = None
+    if args['profile']:
+        profiler = ProcessProfiler('cpdkd', settings.PROFILE_DIR)
+        profiler.start()
+
+    global request_profiler
+    if args['profile_requests']:
+        request_profiler = RequestProfiler('cpdkd', settings.PROFILE_DIR, args['profile_requests'])
+        request_profiler.start()
 
     global Session
-    engine = create_engine('sqlite:///' + settings.DB_NAME, echo=settings.DEBUG)
-    Session = sessionmaker(bind=engine)
+    engine = create_cpdk_engine(settings.DB_NAME, settings.DEBUG,
+                                pool_size=settings.DB_POOL_SIZE,
+                                max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+                                journal_mode=settings.DB_JOURNAL_MODE,
+                                synchronous=settings.DB_SYNCHRONOUS,
+                                cache_size=settings.DB_CACHE_SIZE)
+    logging.info('Database settings: %s' % describe_engine(engine))
+
+    # Start counting requests and SQL statements
+    global metrics
+    if settings.CPDKD_METRICS:
+        metrics = Metrics()
+        metrics.instrument_engine(engine)
+    Session = scoped_session(sessionmaker(bind=engine))
 
     # Import the database schema
     user_models = import_user_models(settings.MODELS_DIR)
 
+    # Pick up where the change log left off
+    global changelog
+    changelog = ChangeLog(settings.CPDKD_CHANGELOG_SIZE)
+    changelog.load(engine)
+    logging.info('Change log at revision %d' % changelog.revision)
+
+    # Setup the object cache
+    global object_cache
+    if settings.CPDKD_CACHE_SIZE:
+        object_cache = ObjectCache(settings.CPDKD_CACHE_SIZE)
+        if settings.CPDKD_CACHE_PRELOAD:
+            preload_cache()
+
+    # Setup conflation of high rate field updates
+    global conflator
+    if settings.CPDKD_CONFLATE_INTERVAL:
+        conflator = Conflator(settings.CPDKD_CONFLATE_INTERVAL)
+
     # Setup the ZeroMQ socket for the CLI daemon
     zmq_cli_socket = setup_cli_zmq()
 
     # Setup the socket to be used for PUB-SUB channels
+    global pubsub_codec
+    pubsub_codec = get_codec(settings.ZMQ_PUBSUB_ENCODING)
     zmq_pub_socket = setup_pubsub_zmq()
 
     # Setup the socket to be used for
     zmq_daemon_socket = setup_daemon_zmq()
 
+    # Start the threads which process read-only requests
+    global worker_pool
+    if settings.CPDKD_WORKER_THREADS:
+        worker_pool = WorkerPool(settings.CPDKD_WORKER_THREADS)
+
+    frontends = collections.OrderedDict([('cli', zmq_cli_socket), ('daemon', zmq_daemon_socket)])
+
+    # Wake up only when one of the sockets has something to read. The poll timeout bounds how long it takes
+    # to notice that a signal has cleared is_running.
+    poller = zmq.Poller()
+    for frontend in frontends.itervalues():
+        poller.register(frontend, zmq.POLLIN)
+    if worker_pool is not None:
+        poller.register(worker_pool.zmq_socket, zmq.POLLIN)
+
+    # Stats are written out every CPDKD_STATS_INTERVAL seconds, if a file is set
+    stats_file = settings.CPDKD_STATS_FILE if metrics is not None else None
+    next_stats_dump = time.time() + settings.CPDKD_STATS_INTERVAL
+
     # Start the message loop
     while is_running:
         try:
-            # Process CLI events
-            msg = zmq_cli_socket.recv_json(flags=zmq.NOBLOCK)
-            logging.info('CLI request: %s' % msg)
-            zmq_cli_socket.send_json(process_config_msg(msg, zmq_pub_socket))
+            ready = dict(poller.poll(poll_timeout()))
         except zmq.ZMQError, e:
-            if e.errno == zmq.EAGAIN:
-                pass
+            if e.errno == errno.EINTR:
+                continue
+            raise
 
-        try:
-            # Process any direct client requests
-            msg = zmq_daemon_socket.recv_json(flags=zmq.NOBLOCK)
-            # zmq_daemon_socket.send_json(process_client_msg(msg))
-            zmq_daemon_socket.send_json(process_config_msg(msg, zmq_pub_socket))
+        for frontend_name, frontend in frontends.iteritems():
+            if frontend not in ready:
+                continue
 
-        except zmq.ZMQError, e:
-            if e.errno == zmq.EAGAIN:
-                pass
+            for envelope, payload in drain_requests(frontend):
+                codec = sniff_codec(payload)
+                try:
+                    msg = codec.decode(payload)
+                    if not isinstance(msg, dict):
+                        raise ValueError('expected a message object, got %s' % type(msg).__name__)
+                except Exception, e:
+                    frontend.send_multipart(envelope + [codec.encode({'status': 'error', 'message': str(e)})])
+                    continue
+
+                if frontend_name == 'cli':
+                    logging.info('CLI request: %s' % msg)
+
+                try:
+                    if worker_pool is not None and is_read_only(msg):
+                        worker_pool.dispatch(frontend_name, envelope, payload)
+                        continue
+
+                    # Everything that writes is processed right here, one message at a time, to keep the order
+                    reply = codec.encode(handle_config_msg(msg, zmq_pub_socket))
+                except Exception, e:
+                    # Just like in worker_main(), a bad request must never take CPDKd down or go unanswered
+                    logging.exception('Failed to process %r' % payload)
+                    reply = codec.encode({'status': 'error', 'message': 'internal error: %s' % e})
+                frontend.send_multipart(envelope + [reply])
+
+        if worker_pool is not None and worker_pool.zmq_socket in ready:
+            for frontend_name, envelope, reply in worker_pool.drain_replies():
+                frontends[frontend_name].send_multipart(envelope + [reply])
+
+        if conflator is not None and conflator.due_in() == 0:
+            flush_conflated(zmq_pub_socket)
+
+        if stats_file and time.time() >= next_stats_dump:
+            dump_stats(stats_file)
+            next_stats_dump = time.time() + settings.CPDKD_STATS_INTERVAL
+
+    # Don't lose the updates that are still being held back
+    if conflator is not None:
+        flush_conflated(zmq_pub_socket)
+        logging.info('Conflation: %s' % conflator.stats())
+
+    if worker_pool is not None:
+        worker_pool.join()
+
+    if object_cache is not None:
+        logging.info('Object cache: %s' % object_cache.stats())
+
+    if stats_file:
+        dump_stats(stats_file)
+
+    if request_profiler is not None:
+        request_profiler.stop()
+
+    if profiler is not None:
+        profiler.stop()
 
-        # TODO: Sleep a little bit here to save the poor CPU?
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,48 @@
+"""
+Compare the size of typical CPDKd messages, and how long they take to encode and decode, for each wire encoding.
+Run from the top of the repository:
+
+    python -m benchmarks.bench_codec --objects 1000
+"""
+import timeit
+import argparse
+from cpdk_codec import codecs, get_codec
+
+
+def payloads(objects):
+    """
+    Build the messages to measure
+    :param objects: Number of objects in the list reply
+    :return: List of (description, message) tuples
+    """
+    servers = [{'id': i, 'name': 'server%d' % i, 'address': '10.0.%d.%d' % (i / 256 % 256, i % 256), 'port': 8080,
+                'enabled': True, 'virtual_servers': ['vip%d' % (i % 10)]} for i in xrange(objects)]
+
+    return [('modify request', {'t': 'modify', 'o': 'Server', 'on': 'server42', 'f': 'port', 'fv': 8080}),
+            ('modify event', ['Server', {'type': 3, 'obj': 'server42', 'field': 'port', 'value': 8080,
+                                         'rev': 123456, 'prev': 123450}]),
+            ('list reply (%d objects)' % objects, {'status': 'ok', 'result': servers, 'revision': 123456})]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the wire encodings')
+    parser.add_argument('--objects', help='objects in the list reply', type=int, default=1000)
+    parser.add_argument('--time', help='seconds to spend measuring each operation', type=float, default=0.5)
+    args = parser.parse_args()
+
+    print '%-28s %-8s %10s %12s %12s' % ('message', 'encoding', 'bytes', 'encode(us)', 'decode(us)')
+    for description, msg in payloads(args.objects):
+        for name in sorted(codecs):
+            codec = get_codec(name)
+            data = codec.encode(msg)
+
+            # Size the number of runs so every measurement takes about the same time
+            runs = max(1, int(args.time / max(timeit.timeit(lambda: codec.encode(msg), number=1), 1e-6)))
+            encode = timeit.timeit(lambda: codec.encode(msg), number=runs) / runs
+            decode = timeit.timeit(lambda: codec.decode(data), number=runs) / runs
+
+            print '%-28s %-8s %10d %12.1f %12.1f' % (description, name, len(data), encode * 1e6, decode * 1e6)
+
+
+if __name__ == '__main__':
+    main()
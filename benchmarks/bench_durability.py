@@ -0,0 +1,72 @@
+"""
+Measure sustained 'modify' throughput for each SQLite journal mode and synchronous level.
+
+Requests are fed straight into CPDKd.process_config_msg(), using the examples/basic models and a temporary SQLite
+database for every combination. Run from the top of the repository:
+
+    python -m benchmarks.bench_durability --requests 5000
+"""
+import os
+import zmq
+import time
+import shutil
+import argparse
+import tempfile
+import CPDKd
+from cpdk_db import CPDKModel, import_user_models, create_cpdk_engine, describe_engine
+
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+MODELS_DIR = 'examples/basic/models'
+OBJECTS = 1000
+
+
+def run(db_name, journal_mode, synchronous, requests, zmq_pub_socket):
+    """
+    Run the modify requests against a fresh database
+    :return: Tuple of (effective engine settings, requests per second)
+    """
+    engine = create_cpdk_engine(db_name, False, journal_mode=journal_mode, synchronous=synchronous)
+    CPDKModel.metadata.create_all(bind=engine)
+    engine.execute(CPDKd.user_models['Server'].__table__.insert(),
+                   [{'name': 'server%d' % i, 'port': 0} for i in xrange(OBJECTS)])
+    CPDKd.Session = scoped_session(sessionmaker(bind=engine))
+
+    start = time.time()
+    for x in xrange(requests):
+        msg = {'t': 'modify', 'o': 'Server', 'on': 'server%d' % (x % OBJECTS), 'f': 'port', 'fv': x}
+        assert CPDKd.process_config_msg(msg, zmq_pub_socket)['status'] == 'ok'
+    elapsed = time.time() - start
+
+    effective = describe_engine(engine)
+    engine.dispose()
+    return effective, requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark modify throughput for each durability level')
+    parser.add_argument('--requests', help='modify requests per combination', type=int, default=5000)
+    parser.add_argument('--journal-modes', help='comma separated journal modes', default='DELETE,WAL')
+    parser.add_argument('--synchronous', help='comma separated synchronous levels', default='OFF,NORMAL,FULL')
+    args = parser.parse_args()
+
+    CPDKd.user_models = import_user_models(MODELS_DIR)
+    zmq_pub_socket = zmq.Context.instance().socket(zmq.PUB)
+    zmq_pub_socket.bind('inproc://bench_durability')
+
+    print '%-12s %-12s %12s' % ('journal', 'synchronous', 'modify/s')
+    for journal_mode in args.journal_modes.split(','):
+        for synchronous in args.synchronous.split(','):
+            tmp_dir = tempfile.mkdtemp()
+            try:
+                effective, rate = run(os.path.join(tmp_dir, 'bench.db'), journal_mode, synchronous, args.requests,
+                                      zmq_pub_socket)
+            finally:
+                shutil.rmtree(tmp_dir)
+            print '%-12s %-12s %12.0f' % (effective['journal_mode'], synchronous, rate)
+
+    zmq_pub_socket.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Measure how quickly a generated C++ manager applies a burst of PUB-SUB events.
+
+The Server header is generated from the examples/basic models into a temporary directory, and compiled into a small
+daemon which counts the on_port() calls its objects get. This script stands in for CPDKd: it answers the daemon's
+startup snapshot and 'changes_since' requests, and publishes a burst of --events modify events for a single server.
+The daemon only starts applying them once the whole burst is queued, so the time measured is the daemon's alone.
+Events its queue drops are fetched by its resync, as they would be from CPDKd.
+
+Each --budgets value is run twice: with the daemon calling ProcessMessageQueue() in a tight loop, and with --tick-us of
+other work (a sleep) between calls, like a daemon that polls once per main loop tick. Run from the top of the
+repository:
+
+    python -m benchmarks.bench_events --events 50000 --budgets 1,100,1000,0 --ldflags=-lzmq
+"""
+import os
+import sys
+import zmq
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = '''from settings import *
+
+MODELS_DIR = 'examples/basic/models'
+C_SRC_DIR = %(c_src_dir)r
+C_TEMPLATE_FILE = 'template.h'
+ZMQ_PUBSUB_PORT = %(pubsub_port)d
+ZMQ_CLIENT_SERVER_PORT = %(client_port)d
+ZMQ_CLIENT_SERVER_ENCODING = 'json'
+'''
+
+DAEMON = r'''
+#include "Server.h"
+#include <chrono>
+#include <iostream>
+#include <stdlib.h>
+#include <unistd.h>
+
+static uint64_t applied = 0;
+
+class BenchServer : public Server {
+public:
+    BenchServer(std::string name) : Server(name) {}
+    virtual void on_port(int val) { applied++; }
+};
+
+Server * CreateCallback(std::string name, void *pData) { return new BenchServer(name); }
+void DeleteCallback(Server *pServer, void *pData) { delete pServer; }
+
+int main(int argc, char **argv) {
+    uint64_t events = strtoull(argv[1], NULL, 10);
+    int budget = atoi(argv[2]);
+    int tick_us = atoi(argv[3]);
+
+    ServerMgr &mgr = ServerMgr::GetInstance();
+    mgr.Init(CreateCallback, DeleteCallback, NULL);
+    applied = 0;
+    std::cout << "ready" << std::endl;
+
+    // Wait for the whole burst to be published
+    std::string line;
+    std::getline(std::cin, line);
+
+    auto start = std::chrono::steady_clock::now();
+    uint64_t calls = 0;
+    while(applied < events) {
+        mgr.ProcessMessageQueue(budget);
+        calls++;
+        if(tick_us)
+            usleep(tick_us);
+    }
+    std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+
+    std::cout << "{\"applied\": " << applied << ", \"seconds\": " << elapsed.count() << ", \"calls\": " << calls
+              << "}" << std::endl;
+    mgr.Cleanup();
+    return 0;
+}
+'''
+
+
+def free_port():
+    """
+    Find a TCP port nothing is listening on
+    :return: The port number
+    """
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def build_daemon(tmp_dir, pubsub_port, client_port, cxx, ldflags):
+    """
+    Generate the headers and compile the benchmark daemon
+    :return: Path of the executable
+    """
+    c_src_dir = os.path.join(tmp_dir, 'c_src')
+    os.makedirs(c_src_dir)
+    with open(os.path.join(tmp_dir, 'bench_settings.py'), 'w') as fh:
+        fh.write(SETTINGS % {'c_src_dir': c_src_dir, 'pubsub_port': pubsub_port, 'client_port': client_port})
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([tmp_dir, ROOT_DIR]))
+    subprocess.check_call([sys.executable, 'cpdk-util.py', '--settings', 'bench_settings', '--exportcpp'],
+                          cwd=ROOT_DIR, env=env, stdout=open(os.devnull, 'w'))
+
+    with open(os.path.join(c_src_dir, 'bench.cpp'), 'w') as fh:
+        fh.write(DAEMON)
+
+    executable = os.path.join(tmp_dir, 'bench_events')
+    include_dir = os.path.join(ROOT_DIR, 'examples', 'basic', 'c_src')
+    subprocess.check_call([cxx, '-std=c++11', '-O2', '-I' + c_src_dir, '-I' + include_dir,
+                           os.path.join(c_src_dir, 'bench.cpp'), '-o', executable] + ldflags.split())
+    return executable
+
+
+class FakeCPDKd(object):
+    """
+    Answers the daemon's requests, and publishes events, the way CPDKd would
+    """
+
+    def __init__(self, context, pubsub_port, client_port):
+        self.pub = context.socket(zmq.PUB)
+        self.pub.setsockopt(zmq.SNDHWM, 0)
+        self.pub.bind('tcp://127.0.0.1:%d' % pubsub_port)
+
+        self.rep = context.socket(zmq.REP)
+        self.rep.bind('tcp://127.0.0.1:%d' % client_port)
+
+        self.events = []
+        self.lock = threading.Lock()
+        self.resyncs = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.start()
+
+    def serve(self):
+        poller = zmq.Poller()
+        poller.register(self.rep, zmq.POLLIN)
+        while self.running:
+            if not poller.poll(100):
+                continue
+
+            msg = json.loads(self.rep.recv())
+            with self.lock:
+                revision = len(self.events)
+                if msg['t'] == 'batch':
+                    # The daemon's startup snapshot. It only registers the Server manager.
+                    reply = {'status': 'ok', 'revision': revision,
+                             'results': [{'status': 'ok',
+                                          'result': [{'id': 1, 'name': 'server', 'port': 0, 'address': None,
+                                                      'enabled': None, 'virtual_servers': []}]}]}
+                else:
+                    self.resyncs += 1
+                    reply = {'status': 'ok', 'revision': revision,
+                             'changes': [[event['rev'], event] for event in self.events[msg['rev']:]]}
+            self.rep.send(json.dumps(reply))
+
+    def publish(self, count):
+        """
+        Publish a burst of modify events
+        :param count: Number of events
+        :return: None
+        """
+        topic = 'Server\0server\0'
+        for x in xrange(count):
+            with self.lock:
+                event = {'type': 3, 'obj': 'server', 'field': 'port', 'value': x, 'rev': len(self.events) + 1,
+                         'prev': len(self.events)}
+                self.events.append(event)
+            self.pub.send_multipart([topic, json.dumps(event)])
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.pub.close()
+        self.rep.close()
+
+
+def run(executable, args, budget, tick_us, pubsub_port, client_port):
+    """
+    Run the daemon once against a fresh stand in for CPDKd
+    :return: Dictionary of results
+    """
+    context = zmq.Context()
+    cpdkd = FakeCPDKd(context, pubsub_port, client_port)
+    try:
+        daemon = subprocess.Popen([executable, str(args.events), str(budget), str(tick_us)], stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE)
+        assert daemon.stdout.readline().strip() == 'ready'
+
+        # Give the subscription time to reach the publisher
+        time.sleep(0.5)
+        start = time.time()
+        cpdkd.publish(args.events)
+        published = time.time() - start
+        daemon.stdin.write('go\n')
+        daemon.stdin.flush()
+
+        result = json.loads(daemon.stdout.readline())
+        daemon.wait()
+        result.update({'budget': budget, 'tick_us': tick_us, 'resyncs': cpdkd.resyncs,
+                       'publish_seconds': published, 'events_per_second': result['applied'] / result['seconds']})
+        return result
+    finally:
+        cpdkd.stop()
+        context.term()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the rate generated C++ managers apply events at')
+    parser.add_argument('--events', help='events in the burst', type=int, default=50000)
+    parser.add_argument('--budgets', help='comma separated ProcessMessageQueue() budgets', default='1,100,1000,0')
+    parser.add_argument('--tick-us', help='other work between calls, in microseconds', type=int, default=1000,
+                        dest='tick_us')
+    parser.add_argument('--cxx', help='C++ compiler', default=os.environ.get('CXX', 'g++'))
+    parser.add_argument('--ldflags', help='linker flags for libzmq', default='-lzmq')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        pubsub_port, client_port = free_port(), free_port()
+        executable = build_daemon(tmp_dir, pubsub_port, client_port, args.cxx, args.ldflags)
+
+        results = []
+        print '%8s %8s %10s %12s %10s %8s' % ('budget', 'tick_us', 'seconds', 'events/s', 'calls', 'resyncs')
+        for budget in [int(x) for x in args.budgets.split(',')]:
+            for tick_us in (0, args.tick_us):
+                result = run(executable, args, budget, tick_us, pubsub_port, client_port)
+                results.append(result)
+                print '%8d %8d %10.3f %12.0f %10d %8d' % (budget, tick_us, result['seconds'],
+                                                           result['events_per_second'], result['calls'],
+                                                           result['resyncs'])
+
+        if args.output:
+            with open(args.output, 'w') as fh:
+                json.dump(results, fh, indent=2)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
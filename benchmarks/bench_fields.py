@@ -0,0 +1,173 @@
+"""
+Measure how quickly a generated C++ manager matches fields to their handlers, on a model with many columns.
+
+A model with --columns integer columns is written to a temporary directory, its header is generated, and it's compiled
+into a small daemon along with a handler for every column. The daemon hands the manager a snapshot of --objects
+objects, each with every column set, and then --events modify events spread evenly over the columns, timing both. The
+messages are built up front, so neither CPDKd nor decoding is part of the times. Run from the top of the repository:
+
+    python -m benchmarks.bench_fields --columns 60 --ldflags=-lzmq
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+from benchmarks.bench_events import free_port
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = '''from settings import *
+
+MODELS_DIR = 'bench_models'
+C_SRC_DIR = %(c_src_dir)r
+C_TEMPLATE_FILE = %(template)r
+ZMQ_PUBSUB_PORT = %(pubsub_port)d
+ZMQ_CLIENT_SERVER_PORT = %(client_port)d
+'''
+
+DAEMON = r'''
+#include "Wide.h"
+#include <chrono>
+#include <vector>
+#include <iostream>
+#include <stdlib.h>
+
+static uint64_t applied = 0;
+
+class BenchWide : public Wide {
+public:
+    BenchWide(std::string name) : Wide(name) {}
+%(handlers)s
+};
+
+Wide * CreateCallback(std::string name, void *pData) { return new BenchWide(name); }
+void DeleteCallback(Wide *pObj, void *pData) { delete pObj; }
+
+static const char *columns[] = {%(columns)s};
+
+int main(int argc, char **argv) {
+    int objects = atoi(argv[1]);
+    int events = atoi(argv[2]);
+    int count = sizeof(columns) / sizeof(columns[0]);
+
+    WideMgr::GetInstance().Register(CreateCallback, DeleteCallback, NULL);
+    cpdk::Subscriber &manager = WideMgr::GetInstance();
+
+    json page;
+    page["result"] = json::array();
+    for(int x = 0; x < objects; x++) {
+        json obj;
+        obj["id"] = x + 1;
+        obj["name"] = "obj" + std::to_string(x);
+        for(int c = 0; c < count; c++)
+            obj[columns[c]] = c;
+        page["result"].push_back(obj);
+    }
+
+    std::vector<json> messages;
+    for(int x = 0; x < events; x++) {
+        json event;
+        event["type"] = MSG_TYPE_MODIFY;
+        event["obj"] = "obj0";
+        event["field"] = columns[x %% count];
+        event["fid"] = cpdk::FieldId(columns[x %% count]);
+        event["value"] = x;
+        event["rev"] = x + 1;
+        event["prev"] = x;
+        messages.push_back(event);
+    }
+
+    auto start = std::chrono::steady_clock::now();
+    manager.LoadSnapshot(page, 0);
+    std::chrono::duration<double> load = std::chrono::steady_clock::now() - start;
+
+    start = std::chrono::steady_clock::now();
+    for(auto &event : messages)
+        manager.OnEvent(event);
+    std::chrono::duration<double> apply = std::chrono::steady_clock::now() - start;
+
+    std::cout << "{\"applied\": " << applied << ", \"load_seconds\": " << load.count()
+              << ", \"apply_seconds\": " << apply.count() << "}" << std::endl;
+    WideMgr::GetInstance().Cleanup();
+    return 0;
+}
+'''
+
+
+def column_names(count):
+    """
+    :return: Names of the synthetic columns
+    """
+    return ['field_%02d' % x for x in xrange(count)]
+
+
+def build_daemon(tmp_dir, columns, cxx, ldflags):
+    """
+    Write the model, generate its header and compile the benchmark daemon
+    :return: Path of the executable
+    """
+    models_dir = os.path.join(tmp_dir, 'bench_models')
+    os.makedirs(models_dir)
+    open(os.path.join(models_dir, '__init__.py'), 'w').close()
+    with open(os.path.join(models_dir, 'wide.py'), 'w') as fh:
+        fh.write('from cpdk_db import CPDKModel\nfrom sqlalchemy import Integer, Column\n\n\n')
+        fh.write('class Wide(CPDKModel):\n')
+        for column in columns:
+            fh.write('    %s = Column(Integer)\n' % column)
+
+    c_src_dir = os.path.join(tmp_dir, 'c_src')
+    os.makedirs(c_src_dir)
+    with open(os.path.join(tmp_dir, 'bench_settings.py'), 'w') as fh:
+        fh.write(SETTINGS % {'c_src_dir': c_src_dir, 'template': os.path.join(ROOT_DIR, 'template.h'),
+                             'pubsub_port': free_port(), 'client_port': free_port()})
+
+    # The models are imported by their path, relative to the current directory
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([tmp_dir, ROOT_DIR]))
+    subprocess.check_call([sys.executable, os.path.join(ROOT_DIR, 'cpdk-util.py'), '--settings', 'bench_settings',
+                           '--exportcpp'], cwd=tmp_dir, env=env, stdout=open(os.devnull, 'w'))
+
+    handlers = '\n'.join('    virtual void on_%s(int val) { applied++; }' % column for column in columns)
+    with open(os.path.join(c_src_dir, 'bench.cpp'), 'w') as fh:
+        fh.write(DAEMON % {'handlers': handlers, 'columns': ', '.join('"%s"' % column for column in columns)})
+
+    executable = os.path.join(tmp_dir, 'bench_fields')
+    include_dir = os.path.join(ROOT_DIR, 'examples', 'basic', 'c_src')
+    subprocess.check_call([cxx, '-std=c++11', '-O2', '-I' + c_src_dir, '-I' + include_dir,
+                           os.path.join(c_src_dir, 'bench.cpp'), '-o', executable] + ldflags.split())
+    return executable
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark field dispatch in generated C++ managers')
+    parser.add_argument('--columns', help='integer columns of the model', type=int, default=60)
+    parser.add_argument('--objects', help='objects in the snapshot', type=int, default=2000)
+    parser.add_argument('--events', help='modify events applied', type=int, default=500000)
+    parser.add_argument('--runs', help='times the daemon is run', type=int, default=5)
+    parser.add_argument('--cxx', help='C++ compiler', default=os.environ.get('CXX', 'g++'))
+    parser.add_argument('--ldflags', help='linker flags for libzmq', default='-lzmq')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        executable = build_daemon(tmp_dir, column_names(args.columns), args.cxx, args.ldflags)
+
+        results = [json.loads(subprocess.check_output([executable, str(args.objects), str(args.events)]))
+                   for _ in xrange(args.runs)]
+        fields = args.objects * (args.columns + 2)
+        load = sorted(result['load_seconds'] for result in results)[len(results) / 2]
+        apply_events = sorted(result['apply_seconds'] for result in results)[len(results) / 2]
+
+        print '%-28s %10d' % ('columns', args.columns)
+        print '%-28s %10.1f' % ('snapshot, median (ms)', load * 1e3)
+        print '%-28s %10.1f' % ('snapshot (ns/field)', load / fields * 1e9)
+        print '%-28s %10.1f' % ('events, median (ms)', apply_events * 1e3)
+        print '%-28s %10.1f' % ('events (ns/event)', apply_events / args.events * 1e9)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+"""
+Drive a running CPDKd with a mix of requests from many clients, and report throughput and latency.
+
+CPDKd is started on a temporary SQLite database, with either the examples/basic models or a synthetic schema, and
+seeded with objects. --clients REQ client processes then send requests picked at random from --mix for --duration
+seconds, while --subscribers SUB processes count the PUB-SUB events and how long they took to arrive.
+
+Each client works on its own objects, so requests never fail because of another client:
+
+    create         Create a new object
+    get_or_create  Fetch one of the client's objects
+    get            Fetch a random seeded object
+    list           List a random seeded object
+    list_page      List a page of --page-size objects
+    modify         Set the numeric field of one of the client's objects
+    add_ref        Link one of the client's objects to a referenced object
+    del_ref        Unlink a pair linked by add_ref (falls back to add_ref if there is none)
+    delete         Delete an object made by create (falls back to create if there is none)
+    batch          Modify --batch-size of the client's objects in one transaction
+    changes_since  Fetch the changes committed since the last revision the client saw
+
+The value a modify sets is the time it was sent, in microseconds, so subscribers can tell how long it took from the
+request being sent to the event arriving (event_delay). Results are printed as a table, and written as JSON with
+--output to compare runs. Run from the top of the repository:
+
+    python -m benchmarks.bench_load --clients 4 --subscribers 2 --duration 10 --output load.json
+"""
+import os
+import sys
+import zmq
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from cpdk_codec import get_codec, sniff_codec
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OPS = ('create', 'get_or_create', 'get', 'list', 'list_page', 'modify', 'add_ref', 'del_ref', 'delete', 'batch',
+       'changes_since')
+DEFAULT_MIX = 'create=1,get=4,list=2,list_page=1,modify=8,add_ref=1,del_ref=1,delete=1,batch=1,changes_since=1'
+
+# The model requests are sent for, its numeric field, and the model and relationship add_ref links it with
+SCHEMAS = {
+    'basic': {'model': 'Server', 'field': 'port', 'ref_model': 'VirtualServer', 'ref_key': 'virtual_servers'},
+    'synthetic': {'model': 'Node', 'field': 'value', 'ref_model': 'Peer', 'ref_key': 'peers'},
+}
+
+SYNTHETIC_MODELS = '''from cpdk_db import CPDKModel
+from sqlalchemy.orm import relationship
+from sqlalchemy import Integer, Column, String, BigInteger, Table, ForeignKey
+
+Node_Peer_Map = Table('Node_Peer_Map',
+                      CPDKModel.metadata,
+                      Column('node_id', Integer, ForeignKey('node.id')),
+                      Column('peer_id', Integer, ForeignKey('peer.id')))
+
+
+class Node(CPDKModel):
+    value = Column(BigInteger, default=0)
+%(columns)s
+    peers = relationship('Peer', secondary=Node_Peer_Map)
+
+
+class Peer(CPDKModel):
+    nodes = relationship('Node', secondary=Node_Peer_Map)
+'''
+
+SETTINGS = '''from settings import *
+
+DEBUG = False
+DB_NAME = %(db_name)r
+MODELS_DIR = 'bench_models'
+ZMQ_SHELL_PORT = %(shell_port)d
+ZMQ_PUBSUB_PORT = %(pubsub_port)d
+ZMQ_CLIENT_SERVER_PORT = %(client_port)d
+'''
+
+
+def free_port():
+    """
+    Find a TCP port nothing is listening on
+    """
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def parse_mix(mix):
+    """
+    Parse a mix such as 'get=4,modify=1' into a list of (op, weight) tuples
+    """
+    weights = []
+    for item in mix.split(','):
+        op, weight = item.split('=')
+        if op not in OPS:
+            raise ValueError('unknown op %s, expected one of %s' % (op, ', '.join(OPS)))
+        weights.append((op, float(weight)))
+    return weights
+
+
+def percentiles(samples):
+    """
+    Summarize latencies (in seconds) as milliseconds
+    """
+    if not samples:
+        return {}
+
+    samples = sorted(samples)
+
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1e3, 3)
+
+    return {'p50_ms': pick(0.5), 'p90_ms': pick(0.9), 'p99_ms': pick(0.99), 'max_ms': round(samples[-1] * 1e3, 3)}
+
+
+def setup_cpdkd(tmp_dir, schema, columns):
+    """
+    Write the models and settings for a CPDKd running out of tmp_dir, and create its database
+    :return: Tuple of (settings module name, environment to run CPDKd with, ports)
+    """
+    models_dir = os.path.join(tmp_dir, 'bench_models')
+    os.mkdir(models_dir)
+    open(os.path.join(models_dir, '__init__.py'), 'w').close()
+    if schema == 'basic':
+        shutil.copy(os.path.join(ROOT_DIR, 'examples', 'basic', 'models', 'model.py'), models_dir)
+    else:
+        with open(os.path.join(models_dir, 'model.py'), 'w') as f:
+            f.write(SYNTHETIC_MODELS % {'columns': '\n'.join('    col%d = Column(String)' % x for x in range(columns))})
+
+    ports = {'shell_port': free_port(), 'pubsub_port': free_port(), 'client_port': free_port()}
+    with open(os.path.join(tmp_dir, 'bench_settings.py'), 'w') as f:
+        f.write(SETTINGS % dict(ports, db_name=os.path.join(tmp_dir, 'cpdk.db')))
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([tmp_dir, ROOT_DIR]))
+    subprocess.check_call([sys.executable, os.path.join(ROOT_DIR, 'cpdk-util.py'), '--settings', 'bench_settings',
+                           '--syncdb'], cwd=tmp_dir, env=env, stdout=open(os.devnull, 'w'))
+    return 'bench_settings', env, ports
+
+
+def connect(context, port, timeout=5000):
+    """
+    Open a REQ socket to CPDKd
+    """
+    req_socket = context.socket(zmq.REQ)
+    req_socket.setsockopt(zmq.RCVTIMEO, timeout)
+    req_socket.setsockopt(zmq.LINGER, 0)
+    req_socket.connect('tcp://127.0.0.1:%d' % port)
+    return req_socket
+
+
+def wait_for_cpdkd(process, port):
+    """
+    Wait until CPDKd answers requests
+    """
+    context = zmq.Context()
+    try:
+        for attempt in range(60):
+            if process.poll() is not None:
+                raise RuntimeError('CPDKd exited with %d' % process.returncode)
+
+            req_socket = connect(context, port, 500)
+            req_socket.send_json({'t': 'cache_stats'})
+            try:
+                req_socket.recv_json()
+                return
+            except zmq.Again:
+                pass
+            finally:
+                req_socket.close()
+        raise RuntimeError('CPDKd did not start')
+    finally:
+        context.term()
+
+
+def seed(port, schema, clients, objects, refs):
+    """
+    Create the objects the clients work on: `objects` of the model for each client, and `refs` of the ref model
+    """
+    context = zmq.Context()
+    req_socket = connect(context, port, 60000)
+
+    ops = [{'t': 'create', 'o': schema['ref_model'], 'on': 'ref%d' % x} for x in range(refs)]
+    for client in range(clients):
+        ops += [{'t': 'create', 'o': schema['model'], 'on': 'c%d-o%d' % (client, x)} for x in range(objects)]
+
+    for x in range(0, len(ops), 1000):
+        req_socket.send_json({'t': 'batch', 'ops': ops[x:x + 1000]})
+        reply = req_socket.recv_json()
+        if reply['status'] != 'ok':
+            raise RuntimeError('seeding failed: %s' % reply['message'])
+
+    req_socket.close()
+    context.term()
+
+
+class LoadClient(object):
+    """
+    Sends a random mix of requests to CPDKd from its own process
+    """
+
+    def __init__(self, client_id, args, schema, mix):
+        self.client_id = client_id
+        self.args = args
+        self.schema = schema
+        self.ops = [op for op, weight in mix]
+        self.cum_weights = []
+        total = 0
+        for op, weight in mix:
+            total += weight
+            self.cum_weights.append(total)
+
+        self.random = random.Random(args.seed + client_id)
+        self.codec = get_codec(args.encoding)
+        self.created = []
+        self.linked = set()
+        self.counter = 0
+        self.revision = 0
+
+    def own_object(self):
+        return 'c%d-o%d' % (self.client_id, self.random.randrange(self.args.objects))
+
+    def any_object(self):
+        return 'c%d-o%d' % (self.random.randrange(self.args.clients), self.random.randrange(self.args.objects))
+
+    def pick_op(self):
+        r = self.random.random() * self.cum_weights[-1]
+        for op, cum_weight in zip(self.ops, self.cum_weights):
+            if r < cum_weight:
+                return op
+        return self.ops[-1]
+
+    def modify(self, name):
+        return {'t': 'modify', 'o': self.schema['model'], 'on': name, 'f': self.schema['field'],
+                'fv': int(time.time() * 1e6)}
+
+    def ref(self, t, name, ref_name):
+        return {'t': t, 'o': self.schema['model'], 'on': name, 'f': self.schema['ref_model'], 'fv': ref_name,
+                'rv': self.schema['ref_key']}
+
+    def build(self, op):
+        """
+        Build the message for an op
+        :return: Tuple of (op actually sent, message)
+        """
+        model = self.schema['model']
+
+        if op == 'delete' and not self.created:
+            op = 'create'
+        if op == 'del_ref' and not self.linked:
+            op = 'add_ref'
+
+        if op == 'create':
+            self.counter += 1
+            name = 'c%d-n%d' % (self.client_id, self.counter)
+            self.created.append(name)
+            return op, {'t': 'create', 'o': model, 'on': name}
+        elif op == 'delete':
+            return op, {'t': 'delete', 'o': model, 'on': self.created.pop()}
+        elif op == 'get_or_create':
+            return op, {'t': 'get_or_create', 'o': model, 'on': self.own_object()}
+        elif op == 'get':
+            return op, {'t': 'get', 'o': model, 'on': self.any_object()}
+        elif op == 'list':
+            return op, {'t': 'list', 'o': model, 'on': self.any_object()}
+        elif op == 'list_page':
+            return op, {'t': 'list', 'o': model, 'limit': self.args.page_size}
+        elif op == 'modify':
+            return op, self.modify(self.own_object())
+        elif op == 'add_ref':
+            pair = (self.own_object(), 'ref%d' % self.random.randrange(self.args.refs))
+            if pair in self.linked:
+                # Linking the same pair twice would add a duplicate row
+                return 'del_ref', self.ref('del_ref', *self.unlink(pair))
+            self.linked.add(pair)
+            return op, self.ref('add_ref', *pair)
+        elif op == 'del_ref':
+            return op, self.ref('del_ref', *self.unlink(self.random.choice(list(self.linked))))
+        elif op == 'batch':
+            return op, {'t': 'batch', 'ops': [self.modify(self.own_object()) for x in range(self.args.batch_size)]}
+        elif op == 'changes_since':
+            return op, {'t': 'changes_since', 'o': model, 'rev': self.revision}
+
+    def unlink(self, pair):
+        self.linked.discard(pair)
+        return pair
+
+    def run(self, port, start, deadline):
+        """
+        Send requests until the deadline
+        :return: Dictionary of op name to (list of latencies in seconds, error count)
+        """
+        context = zmq.Context()
+        req_socket = connect(context, port, 30000)
+        results = dict((op, ([], 0)) for op in OPS)
+
+        while time.time() < start:
+            time.sleep(0.001)
+
+        while time.time() < deadline:
+            op, msg = self.build(self.pick_op())
+            payload = self.codec.encode(msg)
+
+            sent = time.time()
+            req_socket.send(payload)
+            reply = req_socket.recv()
+            latency = time.time() - sent
+
+            reply = sniff_codec(reply).decode(reply)
+            latencies, errors = results[op]
+            latencies.append(latency)
+            if reply.get('status') != 'ok':
+                results[op] = (latencies, errors + 1)
+            if 'revision' in reply:
+                self.revision = max(self.revision, reply['revision'])
+
+        req_socket.close()
+        context.term()
+        return results
+
+
+def client_main(client_id, args, schema, mix, port, start, deadline, queue):
+    queue.put(LoadClient(client_id, args, schema, mix).run(port, start, deadline))
+
+
+def subscriber_main(port, field, stop, ready, queue):
+    """
+    Count events until told to stop, and time how long modifies took to arrive
+    """
+    context = zmq.Context()
+    sub_socket = context.socket(zmq.SUB)
+    sub_socket.setsockopt(zmq.RCVHWM, 0)
+    sub_socket.setsockopt(zmq.RCVTIMEO, 100)
+    sub_socket.setsockopt(zmq.SUBSCRIBE, '')
+    sub_socket.connect('tcp://127.0.0.1:%d' % port)
+    ready.set()
+
+    events = 0
+    delays = []
+    while not stop.is_set():
+        try:
+            topic, payload = sub_socket.recv_multipart()
+        except zmq.Again:
+            continue
+
+        received = time.time()
+        event = sniff_codec(payload).decode(payload)
+        events += 1
+        if event.get('type') == 3 and event.get('field') == field:
+            delays.append(received - event['value'] / 1e6)
+
+    sub_socket.close()
+    context.term()
+    queue.put((events, delays))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CPDKd with a mix of requests from concurrent clients')
+    parser.add_argument('--schema', help='models to load', choices=sorted(SCHEMAS.keys()), default='basic')
+    parser.add_argument('--columns', help='extra string columns of the synthetic model', type=int, default=8)
+    parser.add_argument('--clients', help='concurrent REQ clients', type=int, default=4)
+    parser.add_argument('--subscribers', help='concurrent PUB-SUB subscribers', type=int, default=1)
+    parser.add_argument('--duration', help='seconds to send requests for', type=float, default=10)
+    parser.add_argument('--mix', help='comma separated op=weight list', default=DEFAULT_MIX)
+    parser.add_argument('--objects', help='objects seeded for each client', type=int, default=200)
+    parser.add_argument('--refs', help='objects seeded to link to', type=int, default=20)
+    parser.add_argument('--page-size', help='limit of list_page requests', type=int, default=100)
+    parser.add_argument('--batch-size', help='modifies in each batch', type=int, default=10)
+    parser.add_argument('--encoding', help='encoding the clients send with', choices=['json', 'msgpack'],
+                        default='json')
+    parser.add_argument('--seed', help='random seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--keep', help='keep the temporary directory', action='store_true')
+    args = parser.parse_args()
+
+    schema = SCHEMAS[args.schema]
+    mix = parse_mix(args.mix)
+    tmp_dir = tempfile.mkdtemp(prefix='bench_load')
+    cpdkd = None
+    try:
+        settings_module, env, ports = setup_cpdkd(tmp_dir, args.schema, args.columns)
+        cpdkd = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'CPDKd.py'), '--settings', settings_module],
+                                 cwd=tmp_dir, env=env, stdout=open(os.devnull, 'w'),
+                                 stderr=open(os.path.join(tmp_dir, 'cpdkd.log'), 'w'))
+        wait_for_cpdkd(cpdkd, ports['client_port'])
+        seed(ports['client_port'], schema, args.clients, args.objects, args.refs)
+
+        queue = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        subscribers = []
+        for x in range(args.subscribers):
+            ready = multiprocessing.Event()
+            process = multiprocessing.Process(target=subscriber_main,
+                                              args=(ports['pubsub_port'], schema['field'], stop, ready, queue))
+            process.start()
+            ready.wait()
+            subscribers.append(process)
+
+        # Give the subscriptions time to reach CPDKd, and every client time to connect
+        start = time.time() + 1
+        deadline = start + args.duration
+        clients = [multiprocessing.Process(target=client_main,
+                                           args=(x, args, schema, mix, ports['client_port'], start, deadline, queue))
+                   for x in range(args.clients)]
+        for process in clients:
+            process.start()
+
+        client_results = [queue.get() for process in clients]
+        for process in clients:
+            process.join()
+
+        # Let the last events arrive
+        time.sleep(1)
+        stop.set()
+        subscriber_results = [queue.get() for process in subscribers]
+        for process in subscribers:
+            process.join()
+    finally:
+        if cpdkd is not None and cpdkd.poll() is None:
+            cpdkd.send_signal(signal.SIGINT)
+            cpdkd.wait()
+        if args.keep:
+            print 'Kept %s' % tmp_dir
+        else:
+            shutil.rmtree(tmp_dir)
+
+    results = {'config': dict(vars(args), mix=dict(mix)), 'ops': {}}
+    try:
+        results['commit'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR,
+                                                    stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        results['commit'] = None
+
+    all_latencies = []
+    total_errors = 0
+    for op in OPS:
+        latencies = sum([r[op][0] for r in client_results], [])
+        errors = sum(r[op][1] for r in client_results)
+        if not latencies:
+            continue
+        all_latencies += latencies
+        total_errors += errors
+        results['ops'][op] = dict(percentiles(latencies), count=len(latencies), errors=errors,
+                                  per_second=round(len(latencies) / args.duration, 1))
+    results['total'] = dict(percentiles(all_latencies), count=len(all_latencies), errors=total_errors,
+                            per_second=round(len(all_latencies) / args.duration, 1))
+
+    delays = sum([r[1] for r in subscriber_results], [])
+    results['events'] = {'received': [r[0] for r in subscriber_results], 'event_delay': percentiles(delays)}
+
+    print '%-14s %9s %7s %10s %9s %9s %9s %9s' % ('op', 'count', 'errors', 'per sec', 'p50 ms', 'p90 ms', 'p99 ms',
+                                                  'max ms')
+    for op, r in sorted(results['ops'].items()) + [('total', results['total'])]:
+        print '%-14s %9d %7d %10.1f %9.3f %9.3f %9.3f %9.3f' % (op, r['count'], r['errors'], r['per_second'],
+                                                                r['p50_ms'], r['p90_ms'], r['p99_ms'], r['max_ms'])
+    print 'events received per subscriber: %s' % results['events']['received']
+    if delays:
+        print 'event delay ms: %s' % ' '.join('%s %s' % (k[:-3], v)
+                                             for k, v in sorted(results['events']['event_delay'].items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Measure how the latency of 'modify' requests changes as a table grows.
+
+Requests are fed straight into CPDKd.process_config_msg(), using the examples/basic models and a temporary SQLite
+database. Run from the top of the repository:
+
+    python -m benchmarks.bench_name_lookup --sizes 1000,10000,100000,1000000
+"""
+import os
+import zmq
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import CPDKd
+from cpdk_db import CPDKModel, import_user_models
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+MODELS_DIR = 'examples/basic/models'
+INSERT_CHUNK = 50000
+
+
+def grow_table(engine, table, start, end):
+    """
+    Bulk insert servers until the table holds 'end' rows
+    :param engine: The SQLAlchemy engine
+    :param table: The Table object to insert into
+    :param start: Number of rows already in the table
+    :param end: Number of rows the table should hold afterwards
+    :return: None
+    """
+    for chunk_start in xrange(start, end, INSERT_CHUNK):
+        rows = [{'name': 'server%d' % i, 'port': 0} for i in xrange(chunk_start, min(chunk_start + INSERT_CHUNK, end))]
+        engine.execute(table.insert(), rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark modify latency against table size')
+    parser.add_argument('--sizes', help='comma separated table sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--requests', help='modify requests per table size', type=int, default=2000)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        engine = create_engine('sqlite:///' + os.path.join(tmp_dir, 'bench.db'))
+        CPDKd.user_models = import_user_models(MODELS_DIR)
+        CPDKModel.metadata.create_all(bind=engine)
+        CPDKd.Session = sessionmaker(bind=engine)
+
+        zmq_pub_socket = zmq.Context.instance().socket(zmq.PUB)
+        zmq_pub_socket.bind('inproc://bench_name_lookup')
+
+        table = CPDKd.user_models['Server'].__table__
+        rows = 0
+        print '%10s %10s %10s %10s' % ('rows', 'mean(us)', 'p50(us)', 'p99(us)')
+        for size in [int(x) for x in args.sizes.split(',')]:
+            grow_table(engine, table, rows, size)
+            rows = size
+
+            latencies = []
+            for x in xrange(args.requests):
+                msg = {'t': 'modify', 'o': 'Server', 'on': 'server%d' % random.randrange(rows), 'f': 'port', 'fv': x}
+                start = time.time()
+                response = CPDKd.process_config_msg(msg, zmq_pub_socket)
+                latencies.append(time.time() - start)
+                assert response['status'] == 'ok'
+
+            latencies.sort()
+            print '%10d %10.0f %10.0f %10.0f' % (rows,
+                                                 sum(latencies) / len(latencies) * 1e6,
+                                                 latencies[len(latencies) / 2] * 1e6,
+                                                 latencies[int(len(latencies) * 0.99)] * 1e6)
+
+        zmq_pub_socket.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
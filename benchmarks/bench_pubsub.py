@@ -0,0 +1,126 @@
+"""
+Measure the CPU a PUB-SUB subscriber spends on events, when it only cares about one model out of many.
+
+A publisher sends events round robin over --models models, and a subscriber process listening for one of them reports
+the CPU time it used (including ZeroMQ's I/O thread). Each layout is measured separately:
+
+    legacy-all     One JSON frame per event. The subscriber gets everything and decodes it to find the model.
+    legacy-prefix  One JSON frame per event. The subscriber filters on the '["Model"' prefix.
+    topic          A topic frame ("Model\\0object\\0") and an event frame, as CPDKd sends them. The subscriber filters
+                   on "Model\\0" and only decodes the event frame.
+
+Run from the top of the repository:
+
+    python -m benchmarks.bench_pubsub --events 100000 --models 20
+"""
+import zmq
+import json
+import time
+import resource
+import argparse
+import multiprocessing
+from cpdk_codec import pubsub_topic
+
+LAYOUTS = ('legacy-all', 'legacy-prefix', 'topic')
+WANTED = 'Model03'
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def subscriber(layout, endpoint, pipe):
+    """
+    Subscriber process. Reports (events decoded, events wanted, CPU seconds) once the end marker arrives.
+    """
+    # The context inherited from the publisher can't be used after forking, so start a new one
+    context = zmq.Context()
+    zmq_socket = context.socket(zmq.SUB)
+    zmq_socket.setsockopt(zmq.RCVHWM, 0)
+    if layout == 'legacy-all':
+        zmq_socket.setsockopt(zmq.SUBSCRIBE, '')
+    elif layout == 'legacy-prefix':
+        zmq_socket.setsockopt(zmq.SUBSCRIBE, json.dumps([WANTED])[:-1])
+        zmq_socket.setsockopt(zmq.SUBSCRIBE, json.dumps(['END'])[:-1])
+    else:
+        zmq_socket.setsockopt(zmq.SUBSCRIBE, pubsub_topic(WANTED))
+        zmq_socket.setsockopt(zmq.SUBSCRIBE, pubsub_topic('END'))
+    zmq_socket.connect(endpoint)
+
+    decoded = 0
+    wanted = 0
+    pipe.send('ready')
+    start = cpu_time()
+    while True:
+        if layout == 'topic':
+            topic, payload = zmq_socket.recv_multipart()
+            if topic == pubsub_topic('END'):
+                break
+            event = json.loads(payload)
+            decoded += 1
+            wanted += 1
+        else:
+            model_name, event = json.loads(zmq_socket.recv())
+            if model_name == 'END':
+                break
+            decoded += 1
+            if model_name == WANTED:
+                wanted += 1
+
+    pipe.send((decoded, wanted, cpu_time() - start))
+    zmq_socket.close()
+    context.term()
+
+
+def run(layout, events, models):
+    """
+    Publish the events to a fresh subscriber process
+    :return: Tuple of (events decoded, events wanted, CPU seconds) reported by the subscriber
+    """
+    zmq_socket = zmq.Context.instance().socket(zmq.PUB)
+    zmq_socket.setsockopt(zmq.SNDHWM, 0)
+    port = zmq_socket.bind_to_random_port('tcp://127.0.0.1')
+
+    pipe, child_pipe = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=subscriber, args=(layout, 'tcp://127.0.0.1:%d' % port, child_pipe))
+    process.start()
+    pipe.recv()
+
+    # Give the subscription time to reach the publisher
+    time.sleep(1)
+
+    model_names = ['Model%02d' % x for x in range(models)]
+    for x in xrange(events):
+        model_name = model_names[x % models]
+        event = {'type': 3, 'obj': 'object%d' % x, 'field': 'port', 'value': x, 'rev': x + 1, 'prev': x}
+        if layout == 'topic':
+            zmq_socket.send_multipart([pubsub_topic(model_name, event['obj']), json.dumps(event)])
+        else:
+            zmq_socket.send(json.dumps([model_name, event]))
+
+    if layout == 'topic':
+        zmq_socket.send_multipart([pubsub_topic('END'), ''])
+    else:
+        zmq_socket.send(json.dumps(['END', {}]))
+
+    result = pipe.recv()
+    process.join()
+    zmq_socket.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark subscriber CPU for each PUB-SUB message layout')
+    parser.add_argument('--events', help='events to publish', type=int, default=100000)
+    parser.add_argument('--models', help='models the events are spread over', type=int, default=20)
+    args = parser.parse_args()
+
+    print '%-14s %10s %10s %14s' % ('layout', 'decoded', 'wanted', 'cpu(ms)/100k')
+    for layout in LAYOUTS:
+        decoded, wanted, cpu = run(layout, args.events, args.models)
+        print '%-14s %10d %10d %14.1f' % (layout, decoded, wanted, cpu * 1e3 * 100000 / args.events)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Measure how RedShell's generated schema scales with the number of models.
+
+A synthetic tree of --models models is written to a temporary directory, each with a few columns and a relationship to
+the next model. The schema is generated from it with cpdk_cli.build_cli(), then imported, and commands are dispatched
+through it with CPDKd replaced by a stub that answers every request, so only the shell's own work is timed. Finally
+redshell.py is started --startups times, timing how long it takes to show its prompt. Run from the top of the
+repository:
+
+    python -m benchmarks.bench_redshell --models 500
+"""
+import os
+import sys
+import imp
+import time
+import shutil
+import pexpect
+import argparse
+import tempfile
+import cpdk_cli
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = '''from settings import *
+
+MODELS_DIR = 'bench_models'
+SHELL_SCHEMA_FILE = 'bench_schema.py'
+SHELL_LOGIN_BANNER = ''
+'''
+
+MODEL_TEMPLATE = '''
+Map_%(i)d = Table('Map_%(i)d', CPDKModel.metadata,
+                  Column('left_id', Integer, ForeignKey('model%(i)d.id')),
+                  Column('right_id', Integer, ForeignKey('model%(next)d.id')))
+
+
+class Model%(i)d(CPDKModel):
+    port = Column(Integer)
+    address = Column(String)
+    enabled = Column(Boolean)
+    counter = Column(BigInteger, info={'display_only': True})
+    peers = relationship('Model%(next)d', secondary=Map_%(i)d)
+    display_name = 'model%(i)d'
+'''
+
+
+def write_models(models_dir, count):
+    """
+    Write the synthetic models, all in one file
+    :param models_dir: Directory to write them to
+    :param count: Number of models
+    :return: None
+    """
+    os.makedirs(models_dir)
+    open(os.path.join(models_dir, '__init__.py'), 'w').close()
+
+    with open(os.path.join(models_dir, 'synthetic.py'), 'w') as fh:
+        fh.write('from cpdk_db import CPDKModel\n')
+        fh.write('from sqlalchemy.orm import relationship\n')
+        fh.write('from sqlalchemy import Integer, Column, String, Boolean, BigInteger, Table, ForeignKey\n')
+        for i in xrange(count):
+            fh.write(MODEL_TEMPLATE % {'i': i, 'next': (i + 1) % count})
+
+
+def stub_request(msg):
+    """
+    Stand in for CPDKd, answering every request
+    """
+    return {'status': 'ok', 'result': []}
+
+
+def time_command(mode, line, repeat):
+    """
+    Time dispatching a command
+    :param mode: The command class instance
+    :param line: The command line
+    :param repeat: Number of times to run it
+    :return: Mean time in microseconds
+    """
+    start = time.time()
+    for _ in xrange(repeat):
+        mode.onecmd(line)
+    return (time.time() - start) / repeat * 1e6
+
+
+def time_startup(tmp_dir):
+    """
+    Time starting the shell, up to its prompt
+    :param tmp_dir: Directory holding the models, schema and settings
+    :return: Time in milliseconds
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([tmp_dir, ROOT_DIR]))
+    start = time.time()
+    shell = pexpect.spawn(sys.executable, [os.path.join(ROOT_DIR, 'redshell.py'), '--settings', 'bench_settings'],
+                          cwd=tmp_dir, env=env, timeout=120)
+    shell.expect('Global>')
+    elapsed = time.time() - start
+    shell.sendline('exit')
+    shell.close()
+    return elapsed * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark RedShell schema generation, import and dispatch')
+    parser.add_argument('--models', help='number of synthetic models', type=int, default=500)
+    parser.add_argument('--repeat', help='times each command is dispatched', type=int, default=2000)
+    parser.add_argument('--startups', help='times the shell is started', type=int, default=3)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        write_models(os.path.join(tmp_dir, 'bench_models'), args.models)
+        schema_file = os.path.join(tmp_dir, 'bench_schema.py')
+
+        # The schema generator imports the models by their path, relative to the current directory
+        os.chdir(tmp_dir)
+        sys.path.insert(0, tmp_dir)
+
+        start = time.time()
+        cpdk_cli.build_cli('bench_models', schema_file)
+        generate = time.time() - start
+
+        with open(schema_file, 'r') as fh:
+            source = fh.read()
+
+        start = time.time()
+        schema = imp.load_source('bench_schema', schema_file)
+        load = time.time() - start
+
+        schema.Global.request = staticmethod(stub_request)
+        first, last = 'model0', 'model%d' % (args.models - 1)
+        mode = getattr(schema, 'Model%d' % (args.models - 1))()
+        mode.name = 'obj'
+
+        print '%-28s %10d' % ('models', args.models)
+        print '%-28s %10d' % ('schema lines', source.count('\n'))
+        print '%-28s %10d' % ('schema bytes', len(source))
+        print '%-28s %10.1f' % ('generate (ms)', generate * 1e3)
+        print '%-28s %10.1f' % ('import (ms)', load * 1e3)
+        for line in ('show %s' % first, 'show %s' % last, 'delete %s obj' % first, 'delete %s obj' % last):
+            print '%-28s %10.1f' % ('%s (us)' % line, time_command(schema.Global(), line, args.repeat))
+        print '%-28s %10.1f' % ('add Model0 obj (us)', time_command(mode, 'add Model0 obj', args.repeat))
+        print '%-28s %10.1f' % ('port 80 (us)', time_command(mode, 'port 80', args.repeat))
+
+        with open(os.path.join(tmp_dir, 'bench_settings.py'), 'w') as fh:
+            fh.write(SETTINGS)
+        startups = sorted(time_startup(tmp_dir) for _ in xrange(args.startups))
+        print '%-28s %10.1f' % ('startup, median (ms)', startups[len(startups) / 2])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
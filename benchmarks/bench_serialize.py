@@ -0,0 +1,116 @@
+"""
+Measure how long it takes to serialize every object of a model, and how many SQL statements it takes.
+
+The previous serializer inspected the model for every row and lazily loaded each relationship with its own query.
+It's reproduced here to compare against CPDKModel.serialize() and CPDKModel.query_all(). Uses the examples/basic
+models and a temporary SQLite database. Run from the top of the repository:
+
+    python -m benchmarks.bench_serialize --sizes 100,10000,100000
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import CPDKd
+from cpdk_db import CPDKModel, import_user_models
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.inspection import inspect as sql_inspect
+from sqlalchemy.orm import sessionmaker
+
+MODELS_DIR = 'examples/basic/models'
+INSERT_CHUNK = 50000
+
+# Number of SQL statements run so far
+statements = [0]
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements[0] += 1
+
+
+def legacy_serialize(obj):
+    """
+    Serialize an object the way CPDKModel.serialize() used to
+    """
+    data = {}
+    for column in obj.__class__.__table__.columns:
+        data[column.name] = getattr(obj, column.name)
+
+    for key in sql_inspect(obj).mapper.relationships.keys():
+        data[key] = []
+        for i in getattr(obj, key):
+            data[key].append(i.name)
+
+    return data
+
+
+def grow_tables(engine, start, end):
+    """
+    Bulk insert virtual servers, each with one server behind it, until the tables hold 'end' rows
+    :return: None
+    """
+    vs_map = CPDKModel.metadata.tables['Server_VS_Map']
+    for chunk_start in xrange(start, end, INSERT_CHUNK):
+        ids = xrange(chunk_start + 1, min(chunk_start + INSERT_CHUNK, end) + 1)
+        engine.execute(CPDKd.user_models['Server'].__table__.insert(),
+                       [{'id': i, 'name': 'server%d' % i, 'port': 80} for i in ids])
+        engine.execute(CPDKd.user_models['VirtualServer'].__table__.insert(),
+                       [{'id': i, 'name': 'vip%d' % i, 'port': 443} for i in ids])
+        engine.execute(vs_map.insert(), [{'server_id': i, 'virtualserver_id': i} for i in ids])
+
+
+def measure(session_factory, list_objects):
+    """
+    Serialize every virtual server in a fresh session
+    :return: Tuple of (seconds, SQL statements)
+    """
+    session = session_factory()
+    statements[0] = 0
+    start = time.time()
+    result = list_objects(session)
+    elapsed = time.time() - start
+    session.close()
+    assert all(len(entry['servers']) == 1 for entry in result)
+    return elapsed, statements[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark serializing a whole model')
+    parser.add_argument('--sizes', help='comma separated table sizes', default='100,10000,100000')
+    parser.add_argument('--legacy-max', help='largest table size to run the previous serializer on, as it grows '
+                                             'quadratically with the join table', type=int, default=10000)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        engine = create_engine('sqlite:///' + os.path.join(tmp_dir, 'bench.db'))
+        CPDKd.user_models = import_user_models(MODELS_DIR)
+        CPDKModel.metadata.create_all(bind=engine)
+        event.listen(engine, 'before_cursor_execute', count_statement)
+        session_factory = sessionmaker(bind=engine)
+        model = CPDKd.user_models['VirtualServer'].__class__
+
+        rows = 0
+        print '%10s %14s %12s %14s %12s' % ('rows', 'legacy(ms)', 'legacy(sql)', 'compiled(ms)', 'compiled(sql)')
+        for size in [int(x) for x in args.sizes.split(',')]:
+            grow_tables(engine, rows, size)
+            rows = size
+
+            compiled = measure(session_factory,
+                               lambda session: [obj.serialize() for obj in model.query_all(session).all()])
+
+            if rows > args.legacy_max:
+                print '%10d %14s %12s %14.1f %12d' % (rows, '-', '-', compiled[0] * 1e3, compiled[1])
+                continue
+
+            legacy = measure(session_factory,
+                             lambda session: [legacy_serialize(obj) for obj in session.query(model).all()])
+            print '%10d %14.1f %12d %14.1f %12d' % (rows, legacy[0] * 1e3, legacy[1], compiled[0] * 1e3, compiled[1])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
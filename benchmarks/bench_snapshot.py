@@ -0,0 +1,185 @@
+"""
+Measure how long a daemon takes to fetch its objects when it starts, with and without a snapshot file.
+
+A single model is written to a temporary directory, along with a database holding --objects objects of it. CPDKd is
+started on it, and a daemon using the model's manager is compiled and run against it. The daemon times
+cpdk::Runtime::Start(), and adds up the port of every object it ends up with, to check that every mode sees the same
+objects. It's run in three modes:
+
+- list: without a snapshot file, listing every object from CPDKd
+- snapshot: with a snapshot file saved by the previous run, and nothing changed since
+- changed: with a snapshot file, after --changes objects were modified since it was saved
+
+Run from the top of the repository:
+
+    python -m benchmarks.bench_snapshot --objects 100000 --ldflags=-lzmq
+"""
+import os
+import sys
+import zmq
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from benchmarks.bench_events import free_port
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = '''from settings import *
+
+DB_NAME = %(db_name)r
+MODELS_DIR = 'bench_models'
+C_SRC_DIR = %(c_src_dir)r
+C_TEMPLATE_FILE = %(template)r
+ZMQ_PUBSUB_PORT = %(pubsub_port)d
+ZMQ_CLIENT_SERVER_PORT = %(client_port)d
+ZMQ_SHELL_PORT = %(shell_port)d
+CPDKD_CHANGELOG_SIZE = %(changelog_size)d
+CPDKD_STATS_FILE = None
+DEBUG = False
+'''
+
+MODEL = '''from cpdk_db import CPDKModel
+from sqlalchemy import Integer, Column, String, Boolean
+
+
+class Backend(CPDKModel):
+    port = Column(Integer)
+    address = Column(String)
+    enabled = Column(Boolean)
+'''
+
+DAEMON = r'''
+#include "Backend.h"
+#include <chrono>
+#include <iostream>
+
+static uint64_t loaded = 0;
+static uint64_t ports = 0;
+
+class BenchBackend : public Backend {
+public:
+    BenchBackend(std::string name) : Backend(name), m_Port(0) {}
+    ~BenchBackend() { ports -= m_Port; }
+    virtual void on_port(int val) { ports += val - m_Port; m_Port = val; }
+private:
+    int m_Port;
+};
+
+Backend * CreateCallback(std::string name, void *pData) { loaded++; return new BenchBackend(name); }
+void DeleteCallback(Backend *pObj, void *pData) { loaded--; delete pObj; }
+
+int main(int argc, char **argv) {
+    BackendMgr &mgr = BackendMgr::GetInstance();
+    mgr.Register(CreateCallback, DeleteCallback, NULL);
+    if(argc > 1)
+        mgr.SetSnapshotFile(argv[1]);
+
+    auto start = std::chrono::steady_clock::now();
+    cpdk::Runtime::GetInstance().Start();
+    std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+
+    std::cout << "{\"loaded\": " << loaded << ", \"ports\": " << ports << ", \"seconds\": " << elapsed.count() << "}"
+              << std::endl;
+    mgr.Cleanup();
+    return 0;
+}
+'''
+
+
+def send_batches(client_port, ops, batch_size=5000):
+    """
+    Send operations to CPDKd in batches
+    :return: None
+    """
+    context = zmq.Context()
+    zmq_socket = context.socket(zmq.REQ)
+    zmq_socket.connect('tcp://localhost:%d' % client_port)
+    for x in xrange(0, len(ops), batch_size):
+        zmq_socket.send_json({'t': 'batch', 'ops': ops[x:x + batch_size]})
+        assert zmq_socket.recv_json()['status'] == 'ok'
+    zmq_socket.close()
+    context.term()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark daemon startup with and without a snapshot file')
+    parser.add_argument('--objects', help='objects in the database', type=int, default=100000)
+    parser.add_argument('--changes', help='objects modified before the changed runs', type=int, default=1000)
+    parser.add_argument('--runs', help='times the daemon is started in each mode', type=int, default=5)
+    parser.add_argument('--cxx', help='C++ compiler', default=os.environ.get('CXX', 'g++'))
+    parser.add_argument('--ldflags', help='linker flags for libzmq', default='-lzmq')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    cpdkd = None
+    try:
+        c_src_dir = os.path.join(tmp_dir, 'c_src')
+        models_dir = os.path.join(tmp_dir, 'bench_models')
+        os.makedirs(c_src_dir)
+        os.makedirs(models_dir)
+        open(os.path.join(models_dir, '__init__.py'), 'w').close()
+        with open(os.path.join(models_dir, 'backend.py'), 'w') as fh:
+            fh.write(MODEL)
+
+        client_port = free_port()
+        with open(os.path.join(tmp_dir, 'bench_settings.py'), 'w') as fh:
+            fh.write(SETTINGS % {'db_name': os.path.join(tmp_dir, 'bench.db'), 'c_src_dir': c_src_dir,
+                                 'template': os.path.join(ROOT_DIR, 'template.h'), 'pubsub_port': free_port(),
+                                 'client_port': client_port, 'shell_port': free_port(),
+                                 'changelog_size': max(args.changes * (args.runs + 1), 10000)})
+
+        # The models are imported by their path, relative to the current directory
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([tmp_dir, ROOT_DIR]))
+        devnull = open(os.devnull, 'w')
+        for option in ('--syncdb', '--exportcpp'):
+            subprocess.check_call([sys.executable, os.path.join(ROOT_DIR, 'cpdk-util.py'), '--settings',
+                                   'bench_settings', option], cwd=tmp_dir, env=env, stdout=devnull)
+
+        with open(os.path.join(c_src_dir, 'bench.cpp'), 'w') as fh:
+            fh.write(DAEMON)
+        executable = os.path.join(tmp_dir, 'bench_snapshot')
+        include_dir = os.path.join(ROOT_DIR, 'examples', 'basic', 'c_src')
+        subprocess.check_call([args.cxx, '-std=c++11', '-O2', '-I' + c_src_dir, '-I' + include_dir,
+                               os.path.join(c_src_dir, 'bench.cpp'), '-o', executable] + args.ldflags.split())
+
+        cpdkd = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'CPDKd.py'), '--settings', 'bench_settings'],
+                                 cwd=tmp_dir, env=env, stdout=devnull, stderr=devnull)
+        time.sleep(3)
+        ops = []
+        for x in xrange(args.objects):
+            ops.append({'t': 'create', 'o': 'Backend', 'on': 'backend%d' % x})
+            ops.append({'t': 'modify', 'o': 'Backend', 'on': 'backend%d' % x, 'f': 'port', 'fv': x % 1000})
+            ops.append({'t': 'modify', 'o': 'Backend', 'on': 'backend%d' % x, 'f': 'address', 'fv': '10.0.0.1'})
+        send_batches(client_port, ops)
+
+        snapshot_file = os.path.join(tmp_dir, 'Backend.snapshot')
+        subprocess.check_output([executable, snapshot_file])
+
+        print '%-10s %8s %12s %12s %12s' % ('mode', 'loaded', 'ports', 'median (ms)', 'file (KB)')
+        for mode in ('list', 'snapshot', 'changed'):
+            results = []
+            for run in xrange(args.runs):
+                if mode == 'changed':
+                    send_batches(client_port, [{'t': 'modify', 'o': 'Backend', 'on': 'backend%d' % x, 'f': 'port',
+                                                'fv': run + 1000} for x in xrange(args.changes)])
+                    expected = json.loads(subprocess.check_output([executable]))['ports']
+                command = [executable] if mode == 'list' else [executable, snapshot_file]
+                results.append(json.loads(subprocess.check_output(command)))
+                if mode == 'changed':
+                    assert results[-1]['ports'] == expected, 'snapshot out of date'
+            results.sort(key=lambda result: result['seconds'])
+            median = results[len(results) / 2]
+            print '%-10s %8d %12d %12.1f %12d' % (mode, median['loaded'], median['ports'], median['seconds'] * 1e3,
+                                                  os.path.getsize(snapshot_file) / 1024)
+    finally:
+        if cpdkd is not None:
+            cpdkd.terminate()
+            cpdkd.wait()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Measure how long a daemon using many generated C++ managers takes to start, and what it holds open once it has.
+
+A synthetic tree of --models models is written to a temporary directory, along with a database holding --objects
+objects of each. CPDKd is started on it, and a daemon using every model's manager is compiled and run against it. The
+daemon times fetching every object, then reports how many threads and file descriptors it has open. It's run twice:
+with each manager calling Init() in turn, and with every manager calling Register() followed by a single
+cpdk::Runtime::Start(). Run from the top of the repository:
+
+    python -m benchmarks.bench_startup --models 40 --objects 100 --ldflags=-lzmq
+"""
+import os
+import sys
+import zmq
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from benchmarks.bench_events import free_port
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = '''from settings import *
+
+DB_NAME = %(db_name)r
+MODELS_DIR = 'bench_models'
+C_SRC_DIR = %(c_src_dir)r
+C_TEMPLATE_FILE = %(template)r
+ZMQ_PUBSUB_PORT = %(pubsub_port)d
+ZMQ_CLIENT_SERVER_PORT = %(client_port)d
+ZMQ_SHELL_PORT = %(shell_port)d
+CPDKD_STATS_FILE = None
+DEBUG = False
+'''
+
+MODEL_TEMPLATE = '''
+
+class Model%(i)d(CPDKModel):
+    port = Column(Integer)
+    address = Column(String)
+'''
+
+DAEMON_CALLBACKS = '''
+Model%(i)d * Create%(i)d(std::string name, void *pData) { loaded++; return new Model%(i)d(name); }
+void Delete%(i)d(Model%(i)d *pObj, void *pData) { delete pObj; }
+'''
+
+DAEMON_MAIN = r'''
+static int CountEntries(const char *path) {
+    int count = 0;
+    DIR *dir = opendir(path);
+    while(readdir(dir) != NULL)
+        count++;
+    closedir(dir);
+    return count - 2;
+}
+
+int main(int argc, char **argv) {
+    bool init = std::string(argv[1]) == "init";
+
+    auto start = std::chrono::steady_clock::now();
+%(start)s
+    std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+
+    std::cout << "{\"loaded\": " << loaded << ", \"seconds\": " << elapsed.count()
+              << ", \"threads\": " << CountEntries("/proc/self/task")
+              << ", \"fds\": " << CountEntries("/proc/self/fd") << "}" << std::endl;
+%(cleanup)s
+    return 0;
+}
+'''
+
+
+def write_models(models_dir, count):
+    """
+    Write the synthetic models, all in one file
+    :param models_dir: Directory to write them to
+    :param count: Number of models
+    :return: None
+    """
+    os.makedirs(models_dir)
+    open(os.path.join(models_dir, '__init__.py'), 'w').close()
+
+    with open(os.path.join(models_dir, 'synthetic.py'), 'w') as fh:
+        fh.write('from cpdk_db import CPDKModel\n')
+        fh.write('from sqlalchemy import Integer, Column, String\n')
+        for i in xrange(count):
+            fh.write(MODEL_TEMPLATE % {'i': i})
+
+
+def write_daemon(path, count):
+    """
+    Write the source of the daemon, which uses the manager of every model
+    :param path: Name of the source file
+    :param count: Number of models
+    :return: None
+    """
+    start = ['    if(init) {']
+    start += ['        Model%dMgr::GetInstance().Init(Create%d, Delete%d, NULL);' % (i, i, i) for i in xrange(count)]
+    start += ['    } else {']
+    start += ['        Model%dMgr::GetInstance().Register(Create%d, Delete%d, NULL);' % (i, i, i)
+              for i in xrange(count)]
+    start += ['        cpdk::Runtime::GetInstance().Start();', '    }']
+    cleanup = ['    Model%dMgr::GetInstance().Cleanup();' % i for i in xrange(count)]
+
+    with open(path, 'w') as fh:
+        for i in xrange(count):
+            fh.write('#include "Model%d.h"\n' % i)
+        fh.write('#include <chrono>\n#include <iostream>\n#include <dirent.h>\n\nstatic int loaded = 0;\n')
+        for i in xrange(count):
+            fh.write(DAEMON_CALLBACKS % {'i': i})
+        fh.write(DAEMON_MAIN % {'start': '\n'.join(start), 'cleanup': '\n'.join(cleanup)})
+
+
+def populate(client_port, models, objects):
+    """
+    Create the objects of every model through CPDKd
+    :return: None
+    """
+    context = zmq.Context()
+    zmq_socket = context.socket(zmq.REQ)
+    zmq_socket.connect('tcp://localhost:%d' % client_port)
+    for i in xrange(models):
+        zmq_socket.send_json({'t': 'batch', 'ops': [{'t': 'create', 'o': 'Model%d' % i, 'on': 'obj%d' % x}
+                                                     for x in xrange(objects)]})
+        assert zmq_socket.recv_json()['status'] == 'ok'
+    zmq_socket.close()
+    context.term()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of a daemon using many C++ managers')
+    parser.add_argument('--models', help='number of synthetic models', type=int, default=40)
+    parser.add_argument('--objects', help='objects of each model', type=int, default=100)
+    parser.add_argument('--runs', help='times the daemon is started in each mode', type=int, default=5)
+    parser.add_argument('--modes', help='comma separated modes to run: init, register', default='init,register')
+    parser.add_argument('--cxx', help='C++ compiler', default=os.environ.get('CXX', 'g++'))
+    parser.add_argument('--ldflags', help='linker flags for libzmq', default='-lzmq')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    cpdkd = None
+    try:
+        c_src_dir = os.path.join(tmp_dir, 'c_src')
+        os.makedirs(c_src_dir)
+        write_models(os.path.join(tmp_dir, 'bench_models'), args.models)
+
+        client_port = free_port()
+        with open(os.path.join(tmp_dir, 'bench_settings.py'), 'w') as fh:
+            fh.write(SETTINGS % {'db_name': os.path.join(tmp_dir, 'bench.db'), 'c_src_dir': c_src_dir,
+                                 'template': os.path.join(ROOT_DIR, 'template.h'), 'pubsub_port': free_port(),
+                                 'client_port': client_port, 'shell_port': free_port()})
+
+        # The models are imported by their path, relative to the current directory
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([tmp_dir, ROOT_DIR]))
+        devnull = open(os.devnull, 'w')
+        for option in ('--syncdb', '--exportcpp'):
+            subprocess.check_call([sys.executable, os.path.join(ROOT_DIR, 'cpdk-util.py'), '--settings',
+                                   'bench_settings', option], cwd=tmp_dir, env=env, stdout=devnull)
+
+        write_daemon(os.path.join(c_src_dir, 'bench.cpp'), args.models)
+        executable = os.path.join(tmp_dir, 'bench_startup')
+        include_dir = os.path.join(ROOT_DIR, 'examples', 'basic', 'c_src')
+        subprocess.check_call([args.cxx, '-std=c++11', '-O2', '-I' + c_src_dir, '-I' + include_dir,
+                               os.path.join(c_src_dir, 'bench.cpp'), '-o', executable] + args.ldflags.split())
+
+        cpdkd = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'CPDKd.py'), '--settings', 'bench_settings'],
+                                 cwd=tmp_dir, env=env, stdout=devnull, stderr=devnull)
+        time.sleep(3)
+        populate(client_port, args.models, args.objects)
+
+        print '%-10s %8s %12s %8s %8s' % ('mode', 'loaded', 'median (ms)', 'threads', 'fds')
+        for mode in args.modes.split(','):
+            results = [json.loads(subprocess.check_output([executable, mode])) for _ in xrange(args.runs)]
+            results.sort(key=lambda result: result['seconds'])
+            median = results[len(results) / 2]
+            print '%-10s %8d %12.1f %8d %8d' % (mode, median['loaded'], median['seconds'] * 1e3, median['threads'],
+                                                median['fds'])
+    finally:
+        if cpdkd is not None:
+            cpdkd.terminate()
+            cpdkd.wait()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Measure how quickly a daemon using a generated C++ manager can write to CPDKd.
+
+A single model is written to a temporary directory, along with a database holding --objects objects of it. CPDKd is
+started on it, and a daemon using the model's manager is compiled and run against it. The daemon times --writes
+updates spread over the objects, made in one of two modes: with UpdateField(), which waits for each update to be
+applied, or with UpdateFieldAsync() followed by cpdk::Runtime::Wait(), which sends them as batches and waits for all of
+the replies at the end. Run from the top of the repository:
+
+    python -m benchmarks.bench_writes --writes 20000 --ldflags=-lzmq
+"""
+import os
+import sys
+import zmq
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from benchmarks.bench_events import free_port
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = '''from settings import *
+
+DB_NAME = %(db_name)r
+MODELS_DIR = 'bench_models'
+C_SRC_DIR = %(c_src_dir)r
+C_TEMPLATE_FILE = %(template)r
+C_WRITE_BATCH_SIZE = %(batch_size)d
+ZMQ_PUBSUB_PORT = %(pubsub_port)d
+ZMQ_CLIENT_SERVER_PORT = %(client_port)d
+ZMQ_SHELL_PORT = %(shell_port)d
+CPDKD_STATS_FILE = None
+DEBUG = False
+'''
+
+MODEL = '''from cpdk_db import CPDKModel
+from sqlalchemy import Integer, Column
+
+
+class Counter(CPDKModel):
+    value = Column(Integer)
+'''
+
+DAEMON = r'''
+#include "Counter.h"
+#include <chrono>
+#include <iostream>
+#include <stdlib.h>
+
+Counter * CreateCallback(std::string name, void *pData) { return new Counter(name); }
+void DeleteCallback(Counter *pObj, void *pData) { delete pObj; }
+
+int main(int argc, char **argv) {
+    bool async = std::string(argv[1]) == "async";
+    int writes = atoi(argv[2]);
+    int objects = atoi(argv[3]);
+
+    CounterMgr &mgr = CounterMgr::GetInstance();
+    mgr.Register(CreateCallback, DeleteCallback, NULL);
+    cpdk::Runtime::GetInstance().Start();
+
+    uint64_t applied = 0;
+    auto start = std::chrono::steady_clock::now();
+    for(int x = 0; x < writes; x++) {
+        std::string name = "obj" + std::to_string(x % objects);
+        if(async) {
+            mgr.UpdateFieldAsync(name, "value", (uint64_t)x, [&applied](json &reply) {
+                if(reply["status"] == "ok")
+                    applied++;
+            });
+        } else {
+            mgr.UpdateField(name, "value", (uint64_t)x);
+            applied++;
+        }
+    }
+    cpdk::Runtime::GetInstance().Wait();
+    std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+
+    std::cout << "{\"applied\": " << applied << ", \"seconds\": " << elapsed.count() << "}" << std::endl;
+    mgr.Cleanup();
+    return 0;
+}
+'''
+
+
+def populate(client_port, objects):
+    """
+    Create the objects through CPDKd
+    :return: None
+    """
+    context = zmq.Context()
+    zmq_socket = context.socket(zmq.REQ)
+    zmq_socket.connect('tcp://localhost:%d' % client_port)
+    zmq_socket.send_json({'t': 'batch', 'ops': [{'t': 'create', 'o': 'Counter', 'on': 'obj%d' % x}
+                                                 for x in xrange(objects)]})
+    assert zmq_socket.recv_json()['status'] == 'ok'
+    zmq_socket.close()
+    context.term()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark writes made through a generated C++ manager')
+    parser.add_argument('--writes', help='updates made in each run', type=int, default=20000)
+    parser.add_argument('--objects', help='objects the updates are spread over', type=int, default=100)
+    parser.add_argument('--batch-size', help='C_WRITE_BATCH_SIZE of the generated header', type=int, default=1000,
+                        dest='batch_size')
+    parser.add_argument('--runs', help='times the daemon is run in each mode', type=int, default=3)
+    parser.add_argument('--modes', help='comma separated modes to run: sync, async', default='sync,async')
+    parser.add_argument('--cxx', help='C++ compiler', default=os.environ.get('CXX', 'g++'))
+    parser.add_argument('--ldflags', help='linker flags for libzmq', default='-lzmq')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    cpdkd = None
+    try:
+        c_src_dir = os.path.join(tmp_dir, 'c_src')
+        models_dir = os.path.join(tmp_dir, 'bench_models')
+        os.makedirs(c_src_dir)
+        os.makedirs(models_dir)
+        open(os.path.join(models_dir, '__init__.py'), 'w').close()
+        with open(os.path.join(models_dir, 'counter.py'), 'w') as fh:
+            fh.write(MODEL)
+
+        client_port = free_port()
+        with open(os.path.join(tmp_dir, 'bench_settings.py'), 'w') as fh:
+            fh.write(SETTINGS % {'db_name': os.path.join(tmp_dir, 'bench.db'), 'c_src_dir': c_src_dir,
+                                 'template': os.path.join(ROOT_DIR, 'template.h'), 'batch_size': args.batch_size,
+                                 'pubsub_port': free_port(), 'client_port': client_port, 'shell_port': free_port()})
+
+        # The models are imported by their path, relative to the current directory
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([tmp_dir, ROOT_DIR]))
+        devnull = open(os.devnull, 'w')
+        for option in ('--syncdb', '--exportcpp'):
+            subprocess.check_call([sys.executable, os.path.join(ROOT_DIR, 'cpdk-util.py'), '--settings',
+                                   'bench_settings', option], cwd=tmp_dir, env=env, stdout=devnull)
+
+        with open(os.path.join(c_src_dir, 'bench.cpp'), 'w') as fh:
+            fh.write(DAEMON)
+        executable = os.path.join(tmp_dir, 'bench_writes')
+        include_dir = os.path.join(ROOT_DIR, 'examples', 'basic', 'c_src')
+        subprocess.check_call([args.cxx, '-std=c++11', '-O2', '-I' + c_src_dir, '-I' + include_dir,
+                               os.path.join(c_src_dir, 'bench.cpp'), '-o', executable] + args.ldflags.split())
+
+        cpdkd = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'CPDKd.py'), '--settings', 'bench_settings'],
+                                 cwd=tmp_dir, env=env, stdout=devnull, stderr=devnull)
+        time.sleep(3)
+        populate(client_port, args.objects)
+
+        print '%-8s %8s %12s %12s' % ('mode', 'applied', 'median (ms)', 'writes/s')
+        for mode in args.modes.split(','):
+            results = [json.loads(subprocess.check_output([executable, mode, str(args.writes), str(args.objects)]))
+                       for _ in xrange(args.runs)]
+            results.sort(key=lambda result: result['seconds'])
+            median = results[len(results) / 2]
+            print '%-8s %8d %12.1f %12.0f' % (mode, median['applied'], median['seconds'] * 1e3,
+                                              median['applied'] / median['seconds'])
+    finally:
+        if cpdkd is not None:
+            cpdkd.terminate()
+            cpdkd.wait()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+// Wire encodings for the messages exchanged with CPDKd (JSON and MessagePack).
+// Copied next to the generated headers by cpdk-util.py --exportcpp.
+#ifndef CPDK_CODEC_H
+#define CPDK_CODEC_H
+
+#include "json.hpp"
+
+#include <stdint.h>
+#include <string.h>
+#include <string>
+#include <stdexcept>
+
+namespace cpdk {
+
+enum Encoding {
+    ENCODING_JSON,
+    ENCODING_MSGPACK
+};
+
+// Write an unsigned integer in network byte order
+inline void PackBigEndian(std::string &out, uint64_t val, int bytes) {
+    for(int i = bytes - 1; i >= 0; i--)
+        out.push_back((char)((val >> (i * 8)) & 0xff));
+}
+
+// Read an unsigned integer in network byte order
+inline uint64_t UnpackBigEndian(const unsigned char *&p, const unsigned char *end, int bytes) {
+    if(end - p < bytes)
+        throw std::runtime_error("truncated msgpack message");
+
+    uint64_t val = 0;
+    for(int i = 0; i < bytes; i++)
+        val = (val << 8) | *p++;
+    return val;
+}
+
+// Write the header of a str, array or map. fixBase is the fix* type byte, or 0 if the type has none.
+inline void PackHeader(std::string &out, uint64_t len, unsigned char fixBase, uint64_t fixMax,
+                       unsigned char type8, unsigned char type16, unsigned char type32) {
+    if(fixBase && len <= fixMax) {
+        out.push_back((char)(fixBase | len));
+    } else if(type8 && len <= 0xff) {
+        out.push_back((char)type8);
+        PackBigEndian(out, len, 1);
+    } else if(len <= 0xffff) {
+        out.push_back((char)type16);
+        PackBigEndian(out, len, 2);
+    } else {
+        out.push_back((char)type32);
+        PackBigEndian(out, len, 4);
+    }
+}
+
+inline void PackInteger(std::string &out, int64_t val) {
+    if(val >= 0) {
+        uint64_t u = val;
+        if(u <= 0x7f) {
+            out.push_back((char)u);
+        } else if(u <= 0xff) {
+            out.push_back((char)0xcc);
+            PackBigEndian(out, u, 1);
+        } else if(u <= 0xffff) {
+            out.push_back((char)0xcd);
+            PackBigEndian(out, u, 2);
+        } else if(u <= 0xffffffff) {
+            out.push_back((char)0xce);
+            PackBigEndian(out, u, 4);
+        } else {
+            out.push_back((char)0xcf);
+            PackBigEndian(out, u, 8);
+        }
+    } else if(val >= -32) {
+        out.push_back((char)(val & 0xff));
+    } else if(val >= -128) {
+        out.push_back((char)0xd0);
+        PackBigEndian(out, (uint64_t)val, 1);
+    } else if(val >= -32768) {
+        out.push_back((char)0xd1);
+        PackBigEndian(out, (uint64_t)val, 2);
+    } else if(val >= -2147483648LL) {
+        out.push_back((char)0xd2);
+        PackBigEndian(out, (uint64_t)val, 4);
+    } else {
+        out.push_back((char)0xd3);
+        PackBigEndian(out, (uint64_t)val, 8);
+    }
+}
+
+inline void PackMsgPack(std::string &out, const nlohmann::json &j) {
+    switch(j.type()) {
+        case nlohmann::json::value_t::null:
+        case nlohmann::json::value_t::discarded:
+            out.push_back((char)0xc0);
+            break;
+        case nlohmann::json::value_t::boolean:
+            out.push_back(j.get<bool>() ? (char)0xc3 : (char)0xc2);
+            break;
+        case nlohmann::json::value_t::number_integer:
+            PackInteger(out, j.get<int64_t>());
+            break;
+        case nlohmann::json::value_t::number_unsigned: {
+            uint64_t u = j.get<uint64_t>();
+            if(u <= 0x7fffffffffffffffULL) {
+                PackInteger(out, (int64_t)u);
+            } else {
+                out.push_back((char)0xcf);
+                PackBigEndian(out, u, 8);
+            }
+        } break;
+        case nlohmann::json::value_t::number_float: {
+            double d = j.get<double>();
+            uint64_t bits;
+            memcpy(&bits, &d, sizeof(bits));
+            out.push_back((char)0xcb);
+            PackBigEndian(out, bits, 8);
+        } break;
+        case nlohmann::json::value_t::string: {
+            const std::string &s = j.get_ref<const std::string &>();
+            PackHeader(out, s.size(), 0xa0, 31, 0xd9, 0xda, 0xdb);
+            out.append(s);
+        } break;
+        case nlohmann::json::value_t::array:
+            PackHeader(out, j.size(), 0x90, 15, 0, 0xdc, 0xdd);
+            for(auto &item : j)
+                PackMsgPack(out, item);
+            break;
+        case nlohmann::json::value_t::object:
+            PackHeader(out, j.size(), 0x80, 15, 0, 0xde, 0xdf);
+            for(auto it = j.begin(); it != j.end(); ++it) {
+                PackHeader(out, it.key().size(), 0xa0, 31, 0xd9, 0xda, 0xdb);
+                out.append(it.key());
+                PackMsgPack(out, it.value());
+            }
+            break;
+    }
+}
+
+inline nlohmann::json UnpackMsgPack(const unsigned char *&p, const unsigned char *end);
+
+inline std::string UnpackString(const unsigned char *&p, const unsigned char *end, uint64_t len) {
+    if((uint64_t)(end - p) < len)
+        throw std::runtime_error("truncated msgpack message");
+    std::string s((const char *)p, len);
+    p += len;
+    return s;
+}
+
+inline nlohmann::json UnpackArray(const unsigned char *&p, const unsigned char *end, uint64_t len) {
+    nlohmann::json j = nlohmann::json::array();
+    for(uint64_t i = 0; i < len; i++)
+        j.push_back(UnpackMsgPack(p, end));
+    return j;
+}
+
+inline nlohmann::json UnpackMap(const unsigned char *&p, const unsigned char *end, uint64_t len) {
+    nlohmann::json j = nlohmann::json::object();
+    for(uint64_t i = 0; i < len; i++) {
+        nlohmann::json key = UnpackMsgPack(p, end);
+        if(!key.is_string())
+            throw std::runtime_error("msgpack map keys must be strings");
+        j[key.get<std::string>()] = UnpackMsgPack(p, end);
+    }
+    return j;
+}
+
+inline nlohmann::json UnpackMsgPack(const unsigned char *&p, const unsigned char *end) {
+    if(p >= end)
+        throw std::runtime_error("truncated msgpack message");
+
+    unsigned char type = *p++;
+
+    if(type <= 0x7f)
+        return (uint64_t)type;
+    if(type >= 0xe0)
+        return (int64_t)(int8_t)type;
+    if((type & 0xe0) == 0xa0)
+        return UnpackString(p, end, type & 0x1f);
+    if((type & 0xf0) == 0x90)
+        return UnpackArray(p, end, type & 0x0f);
+    if((type & 0xf0) == 0x80)
+        return UnpackMap(p, end, type & 0x0f);
+
+    switch(type) {
+        case 0xc0: return nullptr;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xcc: return UnpackBigEndian(p, end, 1);
+        case 0xcd: return UnpackBigEndian(p, end, 2);
+        case 0xce: return UnpackBigEndian(p, end, 4);
+        case 0xcf: return UnpackBigEndian(p, end, 8);
+        case 0xd0: return (int64_t)(int8_t)UnpackBigEndian(p, end, 1);
+        case 0xd1: return (int64_t)(int16_t)UnpackBigEndian(p, end, 2);
+        case 0xd2: return (int64_t)(int32_t)UnpackBigEndian(p, end, 4);
+        case 0xd3: return (int64_t)UnpackBigEndian(p, end, 8);
+        case 0xca: {
+            uint32_t bits = UnpackBigEndian(p, end, 4);
+            float f;
+            memcpy(&f, &bits, sizeof(f));
+            return f;
+        }
+        case 0xcb: {
+            uint64_t bits = UnpackBigEndian(p, end, 8);
+            double d;
+            memcpy(&d, &bits, sizeof(d));
+            return d;
+        }
+        // Binary data is handed back as a string
+        case 0xc4: case 0xd9: return UnpackString(p, end, UnpackBigEndian(p, end, 1));
+        case 0xc5: case 0xda: return UnpackString(p, end, UnpackBigEndian(p, end, 2));
+        case 0xc6: case 0xdb: return UnpackString(p, end, UnpackBigEndian(p, end, 4));
+        case 0xdc: return UnpackArray(p, end, UnpackBigEndian(p, end, 2));
+        case 0xdd: return UnpackArray(p, end, UnpackBigEndian(p, end, 4));
+        case 0xde: return UnpackMap(p, end, UnpackBigEndian(p, end, 2));
+        case 0xdf: return UnpackMap(p, end, UnpackBigEndian(p, end, 4));
+        default:
+            throw std::runtime_error("unsupported msgpack type");
+    }
+}
+
+// Lookup table of the CRC-32 used for field IDs
+struct CRC32Table {
+    uint32_t entries[256];
+
+    CRC32Table() {
+        for(uint32_t n = 0; n < 256; n++) {
+            uint32_t c = n;
+            for(int k = 0; k < 8; k++)
+                c = (c & 1) ? 0xEDB88320u ^ (c >> 1) : c >> 1;
+            entries[n] = c;
+        }
+    }
+};
+
+// The ID of a field, as sent in the 'fid' of PUB-SUB events: the CRC-32 of its name, the same as Python's zlib.crc32()
+inline uint32_t FieldId(const std::string &name) {
+    static const CRC32Table table;
+
+    uint32_t crc = 0xFFFFFFFFu;
+    for(unsigned char c : name)
+        crc = table.entries[(crc ^ c) & 0xFF] ^ (crc >> 8);
+    return crc ^ 0xFFFFFFFFu;
+}
+
+// Encode a message for sending to CPDKd
+inline std::string Encode(const nlohmann::json &j, Encoding encoding) {
+    if(encoding == ENCODING_JSON)
+        return j.dump();
+
+    std::string out;
+    PackMsgPack(out, j);
+    return out;
+}
+
+// Decode a message from CPDKd. JSON messages always start with a printable character, MessagePack maps and arrays
+// with a byte of 0x80 or above, so the encoding doesn't have to be known up front.
+inline nlohmann::json Decode(const char *data, size_t len) {
+    if(len && (unsigned char)data[0] >= 0x80) {
+        const unsigned char *p = (const unsigned char *)data;
+        return UnpackMsgPack(p, p + len);
+    }
+
+    return nlohmann::json::parse(std::string(data, len));
+}
+
+} // namespace cpdk
+
+#endif // CPDK_CODEC_H
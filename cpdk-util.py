@@ -6,137 +6,410 @@ Control Plane Development Kit (CPDK)
 """
 import os
 import sys
+import zmq
+import json
+import hashlib
 import logging
 import argparse
-import sqlalchemy
+import multiprocessing
 from sqlalchemy.inspection import inspect as sql_inspect
 import settings
-from redshell import build_cli as rs_build_cli
-from cpdk_db import create_db, import_user_models
+from cpdk_cli import build_cli as rs_build_cli
+from cpdk_db import CPDKModel, create_db, import_user_models, create_cpdk_engine
+from cpdk_dump import dump as dump_db, load as load_db, DEFAULT_CHUNK_SIZE
+from cpdk_codec import get_codec, field_id, ENCODING_JSON, ENCODING_MSGPACK
+from cpdk_profile import ProcessProfiler
+from cpdk_settings import apply_defaults
+from cpdk_template import Template, cpp_type
 
 logger = logging.getLogger(__name__)
 
+# The generated C++ code's names for each encoding
+CPP_ENCODINGS = {ENCODING_JSON: 'cpdk::ENCODING_JSON', ENCODING_MSGPACK: 'cpdk::ENCODING_MSGPACK'}
+
+# Support code included by the generated headers
+CPP_CODEC_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'c_src', 'cpdk_codec.h')
+
+# Template of the runtime shared by every generated manager, and the name of the header it's generated as
+CPP_RUNTIME_TEMPLATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runtime_template.h')
+CPP_RUNTIME_HEADER = 'cpdk_runtime.h'
+
+# How long to wait for CPDKd to publish the changes made by --load, in milliseconds
+RELOAD_TIMEOUT = 60000
+
+# Generated headers start with this, followed by a hash of everything they were generated from
+FINGERPRINT_PREFIX = '// Generated by cpdk-util.py. Fingerprint: '
+
+# Source of the code generator. Part of every fingerprint, so headers are generated again whenever it changes.
+GENERATOR_FILES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                   for name in ('cpdk-util.py', 'cpdk_template.py', 'cpdk_codec.py')]
+
+# Hash of GENERATOR_FILES, read the first time it's needed
+generator_digest = None
+
+# Headers each process has to generate before --exportcpp forks more of them
+MIN_HEADERS_PER_JOB = 8
+
 
 def syncdb():
 
     # Import all of the user models
     import_user_models(settings.MODELS_DIR)
 
-    # Create the database
-    create_db(settings.DB_NAME, settings.DEBUG)
+    # Create the database, and any indexes its existing tables are missing
+    skipped = create_db(settings.DB_NAME, settings.DEBUG)
+    for index_name, duplicates in sorted(skipped.iteritems()):
+        print 'Not creating the unique index %s, the table has duplicates: %s' % \
+              (index_name, ', '.join(unicode(value) for value in duplicates))
+
+
+def open_db():
+    """
+    Open the database with the same settings CPDKd uses
+    :return: The database engine
+    """
+    return create_cpdk_engine(settings.DB_NAME, settings.DEBUG,
+                              journal_mode=settings.DB_JOURNAL_MODE,
+                              synchronous=settings.DB_SYNCHRONOUS,
+                              cache_size=settings.DB_CACHE_SIZE)
+
+
+def dump(path):
+    """
+    Write every object and relationship to a dump file
+    :param path: Name of the dump file
+    :return: None
+    """
+    import_user_models(settings.MODELS_DIR)
+
+    counts = dump_db(open_db(), CPDKModel.metadata, path)
+    print 'Dumped %d rows from %d tables to %s' % (sum(counts.values()), len(counts), path)
+
 
+def load(path, replace, chunk_size, reload_events):
+    """
+    Load a dump file, then have CPDKd tell the daemons about it
+    :param path: Name of the dump file
+    :param replace: Delete the existing objects first
+    :param chunk_size: Number of rows to insert at once
+    :param reload_events: Publish an event per object and field, rather than a single reload event per model
+    :return: None
+    """
+    models = import_user_models(settings.MODELS_DIR)
+
+    counts = load_db(open_db(), CPDKModel.metadata, path, replace, chunk_size)
+    print 'Loaded %d rows into %d tables from %s' % (sum(counts.values()), len(counts), path)
+
+    # Every model with a table, or a relationship, that was loaded has changed
+    changed = []
+    for model_name, model in sorted(models.iteritems()):
+        tables = [model.__table__.name] + [rel.secondary.name for rel in sql_inspect(model).mapper.relationships
+                                           if rel.secondary is not None]
+        if any(table in counts for table in tables):
+            changed.append(model_name)
+
+    if changed:
+        notify_reload(changed, reload_events)
+
+
+def notify_reload(model_names, reload_events):
+    """
+    Ask CPDKd to drop what it has cached of the models, and to publish their new contents, all in one transaction
+    :param model_names: Names of the models which were loaded
+    :param reload_events: Publish an event per object and field, rather than a single reload event per model
+    :return: None
+    """
+    context = zmq.Context()
+    zmq_socket = context.socket(zmq.REQ)
+    zmq_socket.setsockopt(zmq.RCVTIMEO, RELOAD_TIMEOUT)
+    zmq_socket.setsockopt(zmq.LINGER, 0)
+    zmq_socket.connect('tcp://localhost:%d' % settings.ZMQ_CLIENT_SERVER_PORT)
+
+    try:
+        zmq_socket.send_json({'t': 'batch', 'ops': [{'t': 'reload', 'o': model_name, 'notice': not reload_events}
+                                                     for model_name in model_names]})
+        reply = zmq_socket.recv_json()
+        if reply['status'] == 'ok':
+            print 'CPDKd published the reload of %s' % ', '.join(model_names)
+        else:
+            print 'CPDKd failed to publish the reload: %s' % reply['message']
+    except zmq.Again:
+        print 'CPDKd did not answer. Restart it, and any daemons, to pick up the load.'
+    finally:
+        zmq_socket.close()
+        context.term()
+
+
+def describe_model(model_name, model):
+    """
+    Collect everything about a model that its header is generated from
+    :param model_name: Name of the model class
+    :param model: The model
+    :return: A dictionary with the model name, its columns as (name, C++ type) pairs and its relationships as
+             (key, referenced class name) pairs. It only holds plain values, so it can be hashed and sent to another
+             process.
+    :raises ValueError: If two fields, or two referenced classes, have the same ID
+    """
+    columns = [(column.name, cpp_type(column.type)) for column in model.__table__.columns]
+
+    relationships = [(key, rel.mapper.class_.__name__)
+                     for key, rel in sql_inspect(model).mapper.relationships.items()]
 
-def build_cpp():
+    # The generated managers dispatch on field IDs, so they have to be unique
+    for names in ([name for name, _ in columns] + [key for key, _ in relationships],
+                  set(ref_class for _, ref_class in relationships)):
+        ids = {}
+        for name in names:
+            if field_id(name) in ids:
+                raise ValueError('%s and %s of %s have the same field ID, rename one of them' %
+                                 (ids[field_id(name)], name, model_name))
+            ids[field_id(name)] = name
+
+    return {'name': model_name, 'columns': columns, 'relationships': relationships}
+
+
+def header_settings():
+    """
+    Collect the settings the generated headers depend on
+    :return: A dictionary of template placeholders and their values
+    """
+    return {'ZMQ_PUBSUB_PORT': str(settings.ZMQ_PUBSUB_PORT),
+            'ZMQ_CLIENT_SERVER_PORT': str(settings.ZMQ_CLIENT_SERVER_PORT),
+            'C_LIST_PAGE_SIZE': str(settings.C_LIST_PAGE_SIZE),
+            'C_EVENT_BUDGET': str(settings.C_EVENT_BUDGET),
+            'C_WRITE_BATCH_SIZE': str(settings.C_WRITE_BATCH_SIZE),
+            'C_MAX_IN_FLIGHT': str(settings.C_MAX_IN_FLIGHT),
+            'ZMQ_CLIENT_SERVER_ENCODING': CPP_ENCODINGS[get_codec(settings.ZMQ_CLIENT_SERVER_ENCODING).name]}
+
+
+def header_fingerprint(description, template, values):
+    """
+    Hash everything a header is generated from. If the fingerprint hasn't changed, neither has the header.
+    :param description: The model, as returned by describe_model()
+    :param template: Text of the template
+    :param values: The settings, as returned by header_settings()
+    :return: The fingerprint, as a hex string
+    """
+    digest = hashlib.sha1(generator_fingerprint())
+    digest.update(json.dumps([description, values], sort_keys=True))
+    digest.update(template)
+    return digest.hexdigest()
+
+
+def generator_fingerprint():
+    """
+    Hash the source of the code generator
+    :return: The hash, as a hex string
+    """
+    global generator_digest
+    if generator_digest is None:
+        digest = hashlib.sha1()
+        for path in GENERATOR_FILES:
+            with open(path, 'rb') as fh:
+                digest.update(fh.read())
+        generator_digest = digest.hexdigest()
+
+    return generator_digest
+
+
+def read_fingerprint(path):
+    """
+    Read the fingerprint recorded at the top of a generated header
+    :param path: Name of the header
+    :return: The fingerprint, or None if the header doesn't exist or wasn't generated with one
+    """
+    try:
+        with open(path, 'r') as fh:
+            first_line = fh.readline()
+    except IOError:
+        return None
+
+    if first_line.startswith(FINGERPRINT_PREFIX):
+        return first_line[len(FINGERPRINT_PREFIX):].strip()
+    return None
+
+
+def render_header(job):
+    """
+    Generate the header of a single model
+    :param job: Tuple of the model description, the parsed template, the settings and the fingerprint
+    :return: Text of the header
+    """
+    description, template, settings_values, fingerprint = job
+    model = description['name']
+
+    values = dict(settings_values)
+    values.update({
+        'TEMPLATE_BASE': model,
+        'TEMPLATE_MGR': model + 'Mgr',
+    })
+
+    forward_decls = ['// Forward declarations\n']
+    field_ids = ["// IDs of the fields, as sent in the 'fid' of events\n"]
+    reference_fields = []
+    add_ref_logic = []
+    del_ref_logic = []
+    ref_init_logic = []
+    reference_keys = []
+
+    # The individual field accessor virtual function declarations, and the calling of them during a modify
+    base_fields = []
+    modify_logic = []
+    for column_name, column_type in description['columns']:
+        field_ids.append('static const uint32_t FIELD_%s = %du;\n' % (column_name, field_id(column_name)))
+        base_fields.append('virtual void on_%s(%s val) { }\n' % (column_name, column_type))
+        modify_logic.append('case %s::FIELD_%s:\n    pObj->on_%s(value);\n    break;\n' % (model, column_name,
+                                                                                          column_name))
+
+    # For all of the relationships, setup virtuals, and the logic that calls them for each event and when objects are
+    # first loaded. Events name the referenced class rather than the relationship.
+    ref_classes = []
+    for key, ref_class in description['relationships']:
+        field_ids.append('static const uint32_t FIELD_%s = %du;\n' % (key, field_id(key)))
+        ref_init_logic.append('case %s::FIELD_%s:\n'
+                              '   for(auto &obj : value) {\n'
+                              '      pObj->on_add_%s(obj);\n'
+                              '   }\n'
+                              '   break;\n' % (model, key, ref_class))
+
+        if ref_class in ref_classes:
+            continue
+        ref_classes.append(ref_class)
+        forward_decls.append('class %s;\nclass %sMgr;\n' % (ref_class, ref_class))
+
+        reference_fields.append('virtual void on_add_%s(std::string name) { }\n' % ref_class)
+        reference_fields.append('virtual void on_remove_%s(std::string name) { }\n' % ref_class)
+        field_ids.append('static const uint32_t REF_%s = %du;\n' % (ref_class, field_id(ref_class)))
+
+        add_ref_logic.append('case %s::REF_%s:\n'
+                             '    pObj->on_add_%s(value);\n'
+                             '    break;\n' % (model, ref_class, ref_class))
+        del_ref_logic.append('case %s::REF_%s:\n'
+                             '    pObj->on_remove_%s(value);\n'
+                             '    break;\n' % (model, ref_class, ref_class))
+        reference_keys.append('case %s::REF_%s:\n    return "%s";\n' % (model, ref_class, key))
+
+    # Every field is matched by a single switch on its ID
+    for logic in (modify_logic, ref_init_logic, add_ref_logic, del_ref_logic, reference_keys):
+        logic.insert(0, 'switch(fid) {\n')
+        logic.append('default:\n    break;\n}\n')
+
+    values.update({
+        'TEMPLATE_FORWARD_DECLS': ''.join(forward_decls),
+        'TEMPLATE_FIELD_IDS': ''.join(field_ids),
+        'TEMPLATE_REFERENCE_FIELDS': ''.join(reference_fields),
+        'TEMPLATE_BASE_REF_INIT_LOGIC': ''.join(ref_init_logic),
+        'TEMPLATE_BASE_REF_ADD_LOGIC': ''.join(add_ref_logic),
+        'TEMPLATE_BASE_REF_DELETE_LOGIC': ''.join(del_ref_logic),
+        'TEMPLATE_BASE_FIELDS': ''.join(base_fields),
+        'TEMPLATE_BASE_MODIFY_LOGIC': ''.join(modify_logic),
+        'TEMPLATE_REFERENCE_KEYS': ''.join(reference_keys),
+        # Snapshot files are only read back by a header generated from exactly the same inputs
+        'TEMPLATE_SNAPSHOT_TAG': fingerprint,
+    })
+
+    return '%s%s\n%s' % (FINGERPRINT_PREFIX, fingerprint, template.render(values))
+
+
+def write_if_changed(path, contents):
+    """
+    Write a file, unless it already holds exactly these contents. Unchanged files keep their modification time, so
+    make doesn't rebuild anything that includes them.
+    :param path: Name of the file
+    :param contents: The new contents
+    :return: True if the file was written
+    """
+    try:
+        with open(path, 'r') as fh:
+            if fh.read() == contents:
+                return False
+    except IOError:
+        pass
+
+    with open(path, 'w') as fh:
+        fh.write(contents)
+    return True
+
+
+def build_runtime(c_src_dir, values):
+    """
+    Generate the header of the runtime the managers share: the ZMQ context, the sockets and the dispatching of events
+    to the managers
+    :param c_src_dir: Directory to write it to
+    :param values: The settings, as returned by header_settings()
+    :return: True if the header was written
+    """
+    with open(CPP_RUNTIME_TEMPLATE_FILE, 'r') as fh:
+        template_text = fh.read()
+
+    path = os.path.join(c_src_dir, CPP_RUNTIME_HEADER)
+    fingerprint = header_fingerprint(None, template_text, values)
+    if read_fingerprint(path) == fingerprint:
+        return False
+
+    header = '%s%s\n%s' % (FINGERPRINT_PREFIX, fingerprint, Template(template_text).render(values))
+    if not write_if_changed(path, header):
+        return False
+
+    print 'Regenerated %s' % CPP_RUNTIME_HEADER
+    return True
+
+
+def build_cpp(jobs=None):
+    """
+    Generate a C++ header for every model, and the runtime they share. Only the headers whose fingerprint changed are
+    generated again, and they're generated in parallel.
+    :param jobs: Number of processes generating headers. None uses one per CPU.
+    :return: List of the models whose header was written
+    """
 
     # Import all the user models
     models = import_user_models(settings.MODELS_DIR)
 
-    fh = open(settings.C_TEMPLATE_FILE, 'r')
-    original_template = fh.read()
-    fh.close()
-
-    for model in models:
-        fh = open(os.path.abspath(settings.C_SRC_DIR) + os.path.sep + model + '.h', 'w')
-        template = original_template
-
-        # Replace {{ TEMPLATE_BASE }} with the class name
-        template = template.replace('{{ TEMPLATE_BASE }}', model)
-
-        # Replace {{ TEMPLATE_MGR }} with the class name plus a "Mgr" suffix
-        template = template.replace('{{ TEMPLATE_MGR }}', model + 'Mgr')
-
-        # Fill in the desired ZMQ PUB-SUB port
-        template = template.replace('{{ ZMQ_PUBSUB_PORT }}', str(settings.ZMQ_PUBSUB_PORT))
-
-        # Fill in the desired CLIENT-SERVER port
-        template = template.replace('{{ ZMQ_CLIENT_SERVER_PORT }}', str(settings.ZMQ_CLIENT_SERVER_PORT))
-
-        field_code = ''
-        add_ref_logic = ''
-        del_ref_logic = ''
-        ref_init_logic = ''
-
-        # Create the logic that will be used to initialize relationships on each object
-        i = sql_inspect(models[model])
-        for x, key in enumerate(i.mapper.relationships.keys()):
-            if x > 0:
-                ref_init_logic += 'else '
-
-            ref_init_logic += 'if(field == "%s") {\n' % key
-            ref_init_logic += '   for(auto &obj : value) {\n'
-            ref_init_logic += '      pObj->on_add_%s(obj);\n' % i.mapper.relationships[key].mapper.class_.__name__
-            ref_init_logic += '   }\n'
-            ref_init_logic += '}\n'
-
-        forward_decls = '// Forward declarations\n'
-        # For all of the RelationshipProperty objects, setup virtuals
-        for x, column in enumerate(sql_inspect(models[model]).mapper.relationships):
-            forward_decls += 'class %s;\n' % column.mapper.class_.__name__
-            forward_decls += 'class %sMgr;\n' % column.mapper.class_.__name__
-
-            field_code += 'virtual void on_add_%s(std::string name) { }\n' % column.mapper.class_.__name__
-            field_code += 'virtual void on_remove_%s(std::string name) { }\n' % column.mapper.class_.__name__
-
-            if x > 0:
-                add_ref_logic += 'else '
-                del_ref_logic += 'else '
-
-            add_ref_logic += 'if(field == "%s") {\n' % column.mapper.class_.__name__
-            add_ref_logic += '    pObj->on_add_%s(value);\n' % column.mapper.class_.__name__
-            add_ref_logic += '}\n'
-
-            del_ref_logic += 'if(field == "%s") {\n' % column.mapper.class_.__name__
-            del_ref_logic += '    pObj->on_remove_%s(value);\n' % column.mapper.class_.__name__
-            del_ref_logic += '}\n'
-
-        template = template.replace('{{ TEMPLATE_BASE_REF_INIT_LOGIC }}', ref_init_logic)
-        template = template.replace('{{ TEMPLATE_BASE_REF_ADD_LOGIC }}', add_ref_logic)
-        template = template.replace('{{ TEMPLATE_BASE_REF_DELETE_LOGIC }}', del_ref_logic)
-        template = template.replace('{{ TEMPLATE_REFERENCE_FIELDS }}', field_code)
-        template = template.replace('{{ TEMPLATE_FORWARD_DECLS }}', forward_decls)
-
-        field_code = ''
-        # Construct the individual field accessor virtual function declarations
-        for column in models[model].__table__.columns:
-
-            this_field = 'virtual void on_%s(%s val) { }\n'
-            if type(column.type) is sqlalchemy.types.Boolean:
-                field_code += this_field % (column.name, 'bool')
-            elif type(column.type) is sqlalchemy.types.Integer:
-                field_code += this_field % (column.name, 'int')
-            elif type(column.type) is sqlalchemy.types.BigInteger:
-                field_code += this_field % (column.name, 'uint64_t')
-            elif type(column.type) is sqlalchemy.types.Text or type(column.type) is sqlalchemy.types.String:
-                field_code += this_field % (column.name, 'std::string')
-            else:
-                raise NotImplementedError('column of type %s not supported' % column.type)
-
-        template = template.replace('{{ TEMPLATE_BASE_FIELDS }}', field_code)
-
-        # Construct the calling of the individual field accessor virtuals during a modify
-        field_code = ''
-        for x, column in enumerate(models[model].__table__.columns):
-            if x > 0:
-                field_code += 'else '
-
-            field_code += 'if(field == "%s") {\n' % column.name
-            if type(column.type) is sqlalchemy.types.Boolean:
-                field_code += '    pObj->on_%s(value);\n} ' % column.name
-            elif type(column.type) is sqlalchemy.types.Integer:
-                field_code += '    pObj->on_%s(value);\n} ' % column.name
-            elif type(column.type) is sqlalchemy.types.BigInteger:
-                field_code += '    pObj->on_%s(value);\n} ' % column.name
-            elif type(column.type) is sqlalchemy.types.Text or type(column.type) is sqlalchemy.types.String:
-                field_code += '    pObj->on_%s(value);\n} ' % column.name
-            else:
-                raise NotImplementedError('column of type %s not supported' % column.type)
-
-        field_code += '\n'
-        template = template.replace('{{ TEMPLATE_BASE_MODIFY_LOGIC }}', field_code)
-
-        # Write the file to disk
-        fh.write(template)
-        fh.close()
+    # The template is parsed once, and rendered for every model
+    with open(settings.C_TEMPLATE_FILE, 'r') as fh:
+        template_text = fh.read()
+    template = Template(template_text)
+
+    c_src_dir = os.path.abspath(settings.C_SRC_DIR)
+    with open(CPP_CODEC_FILE, 'r') as fh:
+        write_if_changed(os.path.join(c_src_dir, os.path.basename(CPP_CODEC_FILE)), fh.read())
+
+    values = header_settings()
+    build_runtime(c_src_dir, values)
+
+    # Work out which headers are out of date
+    stale = []
+    for model in sorted(models):
+        description = describe_model(model, models[model])
+        fingerprint = header_fingerprint(description, template_text, values)
+        if read_fingerprint(os.path.join(c_src_dir, model + '.h')) != fingerprint:
+            stale.append((description, template, values, fingerprint))
+
+    # Forking only pays off with a few headers to share out
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(stale) // MIN_HEADERS_PER_JOB)
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            headers = pool.map(render_header, stale)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        headers = [render_header(job) for job in stale]
+
+    written = []
+    for job, header in zip(stale, headers):
+        model = job[0]['name']
+        if write_if_changed(os.path.join(c_src_dir, model + '.h'), header):
+            written.append(model)
+            print 'Regenerated %s.h' % model
+
+    print 'Regenerated %d of %d headers in %s' % (len(written), len(models), c_src_dir)
+    return written
 
 
 def build_cli():
@@ -152,7 +425,18 @@ def main():
     parser.add_argument('--syncdb', help='synchronize the database with object models', action='store_true')
     parser.add_argument('--buildcli', help='create CLI schema', action='store_true')
     parser.add_argument('--exportcpp', help='create C source files', action='store_true')
+    parser.add_argument('--jobs', help='processes generating C source files (default: one per CPU)', type=int)
     parser.add_argument('--settings', help='python path to settings file', dest='settings')
+    parser.add_argument('--dump', help='write every object and relationship to a file (.gz to compress)',
+                        metavar='FILE')
+    parser.add_argument('--load', help='load a file written by --dump', metavar='FILE')
+    parser.add_argument('--replace', help='delete the existing objects before loading', action='store_true')
+    parser.add_argument('--chunk-size', help='rows inserted at once while loading', type=int,
+                        default=DEFAULT_CHUNK_SIZE, dest='chunk_size')
+    parser.add_argument('--reload-events', help='after loading, publish an event per object and field instead of one '
+                        'reload event per model, for daemons which predate reload events. CPDKd holds up every other '
+                        'request while it publishes them.', action='store_true', dest='reload_events')
+    parser.add_argument('--profile', help='write a CPU profile of the commands to PROFILE_DIR', action='store_true')
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -166,10 +450,16 @@ def main():
         settings = __import__(args['settings'], globals(), locals(), ['DB_NAME', 'DEBUG'], -1)
     else:
         import settings
+    apply_defaults(settings)
 
     if settings.DEBUG:
         logger.setLevel(logging.DEBUG)
 
+    profiler = None
+    if args['profile']:
+        profiler = ProcessProfiler('cpdk-util', settings.PROFILE_DIR)
+        profiler.start()
+
     if args['syncdb']:
         syncdb()
 
@@ -177,7 +467,17 @@ def main():
         build_cli()
 
     if args['exportcpp']:
-        build_cpp()
+        build_cpp(args['jobs'])
+
+    if args['dump']:
+        dump(args['dump'])
+
+    if args['load']:
+        load(args['load'], args['replace'], args['chunk_size'], args['reload_events'])
+
+    if profiler is not None:
+        for f in profiler.stop():
+            print 'Wrote %s' % f
 
 
 if __name__ == '__main__':
@@ -0,0 +1,268 @@
+"""
+In-memory object cache used by CPDKd.
+"""
+import threading
+from collections import OrderedDict
+
+
+class ObjectCache(object):
+    """
+    LRU cache of serialized objects, keyed by (model name, object name).
+    CPDKd is the only writer to the database, so the cache is kept up to date by applying every committed change to it.
+    Entries are the dictionaries returned by CPDKModel.serialize().
+
+    Objects are also indexed by model, in the order of their ids, so a model is listed without going through the
+    objects of every other model.
+
+    The cache is shared between CPDKd's threads. Readers fill it with fill() and fill_model(), passing the version
+    they saw before reading from the database. If a committed change was applied in the meantime, what they read may
+    already be stale, so it's dropped.
+    """
+
+    def __init__(self, max_size):
+        """
+        Constructor
+        :param max_size: Maximum number of objects to keep in the cache
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+        # The same entries for each model, keyed by object name and ordered by id
+        self.models = {}
+
+        # Models whose objects were added out of order, and have to be sorted before they're listed
+        self.unsorted = set()
+
+        # Models for which every single object is in the cache. These can be listed without touching the database.
+        self.complete_models = set()
+
+        # Bumped every time a committed change is applied
+        self.version = 0
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model_name, name):
+        """
+        Fetch an object from the cache
+        :param model_name: Name of the model class
+        :param name: Name of the object
+        :return: The serialized object, or None if it isn't cached
+        """
+        with self.lock:
+            key = (model_name, name)
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Move the entry to the most recently used end
+            self.entries[key] = entry
+            self.hits += 1
+            return entry
+
+    def list(self, model_name):
+        """
+        Fetch every object of a model, if all of them are cached
+        :param model_name: Name of the model class
+        :return: A list of serialized objects ordered by id, or None if the model isn't completely cached
+        """
+        with self.lock:
+            if model_name not in self.complete_models:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            objects = self.models.get(model_name, {})
+            if model_name in self.unsorted:
+                objects = OrderedDict(sorted(objects.iteritems(), key=lambda item: item[1]['id']))
+                self.models[model_name] = objects
+                self.unsorted.discard(model_name)
+            return objects.values()
+
+    def contains(self, model_name, name):
+        """
+        Check if an object should be kept up to date in the cache
+        :return: True if the object is cached, or the model is completely cached
+        """
+        with self.lock:
+            return model_name in self.complete_models or (model_name, name) in self.entries
+
+    def _insert(self, model_name, name, entry):
+        """
+        Add or replace an object, evicting the least recently used objects if the cache is full.
+        The caller must hold the lock.
+        :return: None
+        """
+        key = (model_name, name)
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+
+        # Objects keep their place when they're replaced, and new ones usually have the highest id yet
+        objects = self.models.setdefault(model_name, OrderedDict())
+        if name not in objects and objects and objects[next(reversed(objects))]['id'] > entry['id']:
+            self.unsorted.add(model_name)
+        objects[name] = entry
+
+        while len(self.entries) > self.max_size:
+            evicted_key, _ = self.entries.popitem(last=False)
+            self._remove_from_model(*evicted_key)
+            self.complete_models.discard(evicted_key[0])
+            self.evictions += 1
+
+    def _remove_from_model(self, model_name, name):
+        """
+        Remove an object from the index of its model. The caller must hold the lock.
+        :return: None
+        """
+        objects = self.models.get(model_name)
+        if objects is not None:
+            objects.pop(name, None)
+            if not objects:
+                del self.models[model_name]
+                self.unsorted.discard(model_name)
+
+    def _remove_model(self, model_name):
+        """
+        Remove every object of a model. The caller must hold the lock.
+        :return: None
+        """
+        for name in self.models.pop(model_name, {}):
+            del self.entries[(model_name, name)]
+        self.unsorted.discard(model_name)
+
+    def put(self, model_name, name, entry):
+        """
+        Add or replace an object in the cache with its committed state
+        :param model_name: Name of the model class
+        :param name: Name of the object
+        :param entry: The serialized object
+        :return: None
+        """
+        with self.lock:
+            self.version += 1
+            self._insert(model_name, name, entry)
+
+    def put_model(self, model_name, entries):
+        """
+        Add every object of a model to the cache. The model is marked complete, unless some of the objects
+        had to be evicted to make room.
+        :param model_name: Name of the model class
+        :param entries: List of all the serialized objects of the model
+        :return: None
+        """
+        with self.lock:
+            self.version += 1
+            self.complete_models.add(model_name)
+            for entry in entries:
+                self._insert(model_name, entry['name'], entry)
+
+    def fill(self, model_name, name, entry, version):
+        """
+        Add an object that was read from the database, unless the cache has changed since the read started
+        :param model_name: Name of the model class
+        :param name: Name of the object
+        :param entry: The serialized object
+        :param version: The cache version from before the object was read
+        :return: None
+        """
+        with self.lock:
+            if version == self.version:
+                self._insert(model_name, name, entry)
+
+    def fill_model(self, model_name, entries, version):
+        """
+        Add every object of a model that was read from the database, unless the cache has changed since the read started
+        :param model_name: Name of the model class
+        :param entries: List of all the serialized objects of the model
+        :param version: The cache version from before the objects were read
+        :return: None
+        """
+        with self.lock:
+            if version == self.version:
+                self.complete_models.add(model_name)
+                for entry in entries:
+                    self._insert(model_name, entry['name'], entry)
+
+    def pop(self, model_name, name):
+        """
+        Remove an object from the cache
+        :return: None
+        """
+        with self.lock:
+            self.version += 1
+            self.entries.pop((model_name, name), None)
+            self._remove_from_model(model_name, name)
+
+    def pop_model(self, model_name):
+        """
+        Remove every cached object of a model. Unlike clear_model(), the model isn't complete afterwards.
+        :param model_name: Name of the model class
+        :return: None
+        """
+        with self.lock:
+            self.version += 1
+            self._remove_model(model_name)
+            self.complete_models.discard(model_name)
+
+    def clear_model(self, model_name):
+        """
+        Remove every object of a model, and remember that the model has no objects left
+        :param model_name: Name of the model class
+        :return: None
+        """
+        with self.lock:
+            self.version += 1
+            self._remove_model(model_name)
+            self.complete_models.add(model_name)
+
+    def clear(self):
+        """
+        Remove every object
+        :return: None
+        """
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+            self.models.clear()
+            self.unsorted.clear()
+            self.complete_models.clear()
+
+    def remove_reference(self, model_name, field, name=None):
+        """
+        Remove a reference from the relationship field of every cached object of a model
+        :param model_name: Name of the model class holding the relationship
+        :param field: Name of the relationship field
+        :param name: Name of the referenced object. If None, every reference is removed.
+        :return: None
+        """
+        with self.lock:
+            self.version += 1
+            objects = self.models.get(model_name, {})
+            for obj_name, entry in objects.items():
+                if name is None:
+                    references = []
+                else:
+                    references = [ref for ref in entry[field] if ref != name]
+
+                # Replacing the values leaves the object's place in both orders alone
+                if references != entry[field]:
+                    entry = dict(entry)
+                    entry[field] = references
+                    objects[obj_name] = entry
+                    self.entries[(model_name, obj_name)] = entry
+
+    def stats(self):
+        """
+        Fetch the cache counters
+        :return: A dictionary of counters
+        """
+        with self.lock:
+            return {'size': len(self.entries),
+                    'max_size': self.max_size,
+                    'complete_models': sorted(self.complete_models),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
@@ -0,0 +1,165 @@
+"""
+Revisioned log of the changes committed by CPDKd.
+"""
+import json
+import uuid
+
+from sqlalchemy import MetaData, Table, Column, Integer, Text, func, select
+
+# Kept apart from the user models, so these tables never show up in the CLI or the generated C++ code
+metadata = MetaData()
+
+# Last revision of every model
+revision_table = Table('cpdk_revision', metadata,
+                       Column('model', Text, primary_key=True),
+                       Column('revision', Integer, nullable=False))
+
+# The most recent changes, one row per PUB-SUB event
+changelog_table = Table('cpdk_changelog', metadata,
+                        Column('revision', Integer, primary_key=True),
+                        Column('model', Text, nullable=False),
+                        Column('event', Text, nullable=False))
+
+# Made up when the tables are first created, so revisions of one database are never mistaken for another's
+epoch_table = Table('cpdk_epoch', metadata,
+                    Column('epoch', Text, primary_key=True))
+
+
+class ChangeLog(object):
+    """
+    Gives every committed change a revision, and keeps the last max_size changes in the database.
+
+    Revisions count up by one for every event, across all models. Each event also carries the revision of the previous
+    event for the same model ('prev'), so a subscriber that only listens to one model can still tell if it missed
+    something: if 'prev' is newer than the last revision it has seen, there's a gap.
+
+    Only CPDKd's main thread writes. Worker threads only read the current revision.
+    """
+
+    def __init__(self, max_size):
+        """
+        Constructor
+        :param max_size: Number of changes to keep in the database
+        """
+        self.max_size = max_size
+
+        # Revision of the last committed change
+        self.revision = 0
+
+        # Revision of the last committed change of each model
+        self.model_revisions = {}
+
+        # Identifies the database the revisions belong to
+        self.epoch = None
+
+    def load(self, engine):
+        """
+        Pick up the revisions from the database. Existing databases may predate the change log, so its tables are
+        created if they're missing, and so is the epoch.
+        :param engine: The database engine
+        :return: None
+        """
+        metadata.create_all(bind=engine)
+
+        connection = engine.connect()
+        try:
+            rows = connection.execute(select([revision_table.c.model, revision_table.c.revision])).fetchall()
+            self.epoch = connection.execute(select([epoch_table.c.epoch])).scalar()
+            if self.epoch is None:
+                self.epoch = replace_epoch(connection)
+        finally:
+            connection.close()
+
+        self.model_revisions = dict(rows)
+        self.revision = max(self.model_revisions.values() or [0])
+
+    def refresh_epoch(self, session):
+        """
+        Pick up the epoch again, once cpdk-util.py --load has replaced it
+        :param session: The database session to read from
+        :return: None
+        """
+        self.epoch = session.execute(select([epoch_table.c.epoch])).scalar() or self.epoch
+
+    def stamp(self, session, events):
+        """
+        Give each event a revision, and write them to the change log as part of the current transaction.
+        Nothing changes in memory until the transaction has been committed and advance() is called.
+        :param session: The database session holding the transaction
+        :param events: List of (model name, event) tuples. 'rev' and 'prev' are added to each event.
+        :return: Dictionary of the new revision of each model, to be passed to advance()
+        """
+        revision = self.revision
+        model_revisions = {}
+
+        for model_name, event in events:
+            revision += 1
+            event['rev'] = revision
+            event['prev'] = model_revisions.get(model_name, self.model_revisions.get(model_name, 0))
+            model_revisions[model_name] = revision
+
+        session.execute(changelog_table.insert(),
+                        [{'revision': event['rev'], 'model': model_name, 'event': json.dumps(event)}
+                         for model_name, event in events])
+        session.execute(revision_table.insert().prefix_with('OR REPLACE'),
+                        [{'model': model_name, 'revision': rev} for model_name, rev in model_revisions.iteritems()])
+
+        # Drop the changes which have fallen off the end of the log
+        session.execute(changelog_table.delete().where(changelog_table.c.revision <= revision - self.max_size))
+
+        return model_revisions
+
+    def advance(self, model_revisions):
+        """
+        Make the revisions of a committed transaction current
+        :param model_revisions: The dictionary returned by stamp()
+        :return: None
+        """
+        self.model_revisions.update(model_revisions)
+        self.revision = max([self.revision] + model_revisions.values())
+
+    def changes_since(self, session, revision, model_name=None):
+        """
+        Fetch the changes committed after a revision
+        :param session: The database session to read from
+        :param revision: The last revision the caller has seen
+        :param model_name: Only return the changes to this model. None returns the changes to every model.
+        :return: Tuple of (list of (model name, event) tuples in order, revision they bring the caller up to).
+            The list is None if the log no longer goes back far enough, and the caller has to reload everything.
+        """
+        current = self.revision
+        if revision > current:
+            # The caller has seen changes this database never made, it must have been replaced
+            return None, current
+
+        if revision < current:
+            oldest = session.execute(select([func.min(changelog_table.c.revision)])).scalar()
+            if oldest is None or oldest > revision + 1:
+                return None, current
+
+        query = select([changelog_table.c.model, changelog_table.c.event]) \
+            .where(changelog_table.c.revision > revision) \
+            .order_by(changelog_table.c.revision)
+        if model_name is not None:
+            query = query.where(changelog_table.c.model == model_name)
+
+        changes = [(row.model, json.loads(row.event)) for row in session.execute(query)]
+
+        # Changes committed while this was running may be included. The caller can skip them when they're published.
+        for model, event in changes:
+            current = max(current, event['rev'])
+
+        return changes, current
+
+
+def replace_epoch(connection):
+    """
+    Make up a new epoch for the database, so no revision handed out before is ever taken to describe its contents
+    :param connection: The connection, or session, to write it with. Usually in the transaction which changed the
+        contents behind CPDKd's back.
+    :return: The new epoch
+    """
+    epoch = uuid.uuid4().hex
+    connection.execute(epoch_table.delete())
+    connection.execute(epoch_table.insert().values(epoch=epoch))
+    return epoch
@@ -0,0 +1,455 @@
+"""
+Generates the RedShell schema: the cmd.Cmd classes RedShell runs, built from the user models.
+
+The schema is kept apart from redshell.py, so that starting the shell doesn't have to import SQLAlchemy or the models.
+It carries what the shell needs to know about each model (its display name, fields and references), and the models are
+only imported if one of them has to format itself for 'show'.
+"""
+import os
+import inspect                  # Because, let's be honest, meta programming is cool
+from cpdk_db import CPDKModel
+from cpdk_template import Template, lookup_type
+import sqlalchemy
+from sqlalchemy.inspection import inspect as sql_inspect
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+
+# Function converting the argument of a field's command to the type of the column. Column types not listed here are
+# looked up by their base classes.
+PYTHON_TYPES = {
+    sqlalchemy.types.Integer: 'int',
+    sqlalchemy.types.BigInteger: 'long',
+    sqlalchemy.types.Float: 'float',
+    sqlalchemy.types.Numeric: 'float',
+    sqlalchemy.types.String: 'str',
+}
+
+# The base class of every command class in the schema. The commands shared by every model look the model up in the
+# MODES table at the end of the schema, so they're the same whatever the number of models.
+SCHEMA_BASE = '''import cmd
+
+
+class BaseCmd(cmd.Cmd):
+    intro = None
+    file = None
+    name = None
+
+    # Set by the command class of each model
+    model = None
+    display_name = None
+    daemon_managed = False
+    fields = ()
+    custom_display = False
+
+    def do_exit(self, _):
+        return True
+
+    def do_show(self, args):
+        arg_list = args.split(" ")
+        if arg_list[0] == "":
+            print ""
+            return
+        mode = MODES.get(arg_list[0])
+        if mode is None:
+            print "*** ERROR: unknown mode %s" % arg_list[0]
+            return
+        zmq_cmd = {"t": "list", "o": mode.model}
+        if len(arg_list) > 1:
+            zmq_cmd["on"] = arg_list[1]
+        reply = Global.request(zmq_cmd)
+        if reply["status"] != "ok":
+            print reply["message"]
+            return
+        for r in reply["result"]:
+            print self.display(mode, r)
+
+    def do_delete(self, args):
+        arg_list = args.split(" ")
+        if len(arg_list) < 2:
+            print "Not enough argments (delete <mode> <item>)"
+            return
+        if arg_list[0] == "":
+            print "***ERROR: argument required"
+            return
+        mode = MODES.get(arg_list[0])
+        if mode is None:
+            print "*** ERROR: unknown mode %s" % arg_list[0]
+        elif mode.daemon_managed:
+            # Daemon managed models can't be deleted via the CLI
+            print "%s objects can not be deleted" % mode.display_name
+        else:
+            reply = Global.request({"t": "delete", "o": mode.model, "on": arg_list[1]})
+            if reply["status"] != "ok":
+                print reply["message"]
+
+    def display(self, mode, r):
+        if mode.custom_display:
+            # The model formats objects itself, so it has to be imported
+            return str(Global.user_models()[mode.model].__class__(**r))
+        output = "%s\\n" % r["name"]
+        output += "===================\\n"
+        for field in mode.fields:
+            if r.get(field):
+                output += "%s: %s\\n" % (field, r[field])
+        return output
+
+    def enter(self, mode, arg):
+        # If the model is managed by daemons, disallow creation of one via the CLI
+        msg_type = "get" if mode.daemon_managed else "get_or_create"
+        s = Global.request({"t": msg_type, "o": mode.model, "on": arg})
+        if s["status"] != "ok":
+            print s["message"]
+            return
+        m = mode()
+        m.name = arg
+        m.prompt = mode.display_name + "-" + arg + ">"
+        m.cmdloop()
+
+    def modify(self, field, arg, convert=None):
+        if convert is not None:
+            # Verify the parameter is of the correct type
+            try:
+                arg = convert(arg)
+            except ValueError as e:
+                print e
+                return
+        s = Global.request({"t": "modify", "o": self.model, "on": self.name, "f": field, "fv": arg})
+        if s["status"] != "ok":
+            print s["status"]
+
+
+class RefCmd(BaseCmd):
+    # Referenced model name -> relationship, set by the command class of each model
+    references = {}
+
+    def do_add(self, args):
+        self.change_reference("add_ref", args)
+
+    def do_remove(self, args):
+        self.change_reference("del_ref", args)
+
+    def change_reference(self, msg_type, args):
+        arg_list = args.split(" ")
+        if len(arg_list) < 2:
+            print "*** ERROR: not enough arguments"
+            return
+        rel = self.references.get(arg_list[0])
+        if rel is None:
+            print "*** ERROR: %s can not be referenced" % arg_list[0]
+            return
+        s = Global.request({"t": msg_type, "o": self.model, "on": self.name, "f": arg_list[0], "fv": arg_list[1],
+                            "rv": rel})
+        if s["status"] != "ok":
+            print s["message"]
+'''
+
+# Command entering the mode of a model
+ENTER_TEMPLATE = Template('''
+    def do_{{ COMMAND }}(self, arg):
+        self.enter({{ MODEL }}, arg)
+''')
+
+# Command class of a model
+COMMAND_TEMPLATE = Template('''
+
+class {{ MODEL }}({{ BASE }}):
+    prompt = "{{ DISPLAY_NAME }}>"
+    model = "{{ MODEL }}"
+    display_name = "{{ DISPLAY_NAME }}"
+    daemon_managed = {{ DAEMON_MANAGED }}
+    fields = {{ FIELDS }}
+    custom_display = {{ CUSTOM_DISPLAY }}
+{{ REFERENCES }}''')
+
+# Commands setting a boolean field, and clearing it
+BOOLEAN_FIELD_TEMPLATE = Template('''
+    def do_{{ COMMAND }}(self, arg):
+        self.modify("{{ FIELD }}", True)
+
+    def do_{{ NEGATIVE_COMMAND }}(self, arg):
+        self.modify("{{ FIELD }}", False)
+''')
+
+# Command setting any other field
+FIELD_TEMPLATE = Template('''
+    def do_{{ COMMAND }}(self, arg):
+        self.modify("{{ FIELD }}", arg, {{ CONVERT }})
+''')
+
+
+class CLIParseMode(object):
+    """
+    Special class which represents a 'mode' for the CLI. Modes are simply directories in the models hierarchy.
+    Each mode must have handlers in place for all the commands found within that mode.
+    """
+    name = ""
+    child_modes = []
+    child_commands = []
+
+    def __init__(self, name):
+        self.name = name
+        self.child_modes = []
+        self.child_commands = []
+
+    def add_child_mode(self, mode):
+        self.child_modes.append(mode)
+
+    def add_child_command(self, command):
+        self.child_commands.append(command)
+
+    def get_commands(self, child_commands=None):
+        """
+        Recursively build a list of all CLIParseCmd's within this mode
+        :return: A list of CLIParseCmd objects
+        """
+        if child_commands:
+            child_commands.extend(self.child_commands)
+        else:
+            child_commands = self.child_commands
+
+        for mode in self.child_modes:
+            child_commands.extend(mode.get_commands(child_commands))
+
+        return child_commands
+
+    def build_cli(self, fh):
+        """
+        Write handlers to the schema file.
+        :param fh: File handle
+        :return: None
+        """
+
+        output = '\n'
+        output += 'class %s(BaseCmd):\n' % self.name
+        output += '    prompt = "%s>"\n' % self.name
+        if self.name == 'Global':
+            output += '    zmq_socket = None\n'
+            output += '    codec = None\n'
+            output += '    models = None\n'
+            output += '    import_models = None\n'
+            output += '\n'
+            output += '    @staticmethod\n'
+            output += '    def request(msg):\n'
+            output += '        Global.zmq_socket.send(Global.codec.encode(msg))\n'
+            output += '        return Global.codec.decode(Global.zmq_socket.recv())\n'
+            output += '\n'
+            output += '    @staticmethod\n'
+            output += '    def user_models():\n'
+            output += '        # The models are only imported the first time one of them is needed\n'
+            output += '        if Global.models is None:\n'
+            output += '            Global.models = Global.import_models()\n'
+            output += '        return Global.models\n'
+
+        # Add mode accessors for any commands in this mode
+        for command in self.child_commands:
+            output += ENTER_TEMPLATE.render({'COMMAND': command.model.get_display_name(), 'MODEL': command.name})
+
+        # Add handlers for any nested modes within this mode
+        for mode in self.child_modes:
+            output += '\n'
+            output += '    def do_%s(self, arg):\n' % mode.name
+            output += '        %s().cmdloop()\n' % mode.name
+
+        fh.write(output)
+
+        # Write out the actual child command classes
+        for command in self.child_commands:
+            command.build_cli(fh)
+
+        # Write out the actual child mode classes
+        for child in self.child_modes:
+            child.build_cli(fh)
+
+    def __str__(self):
+        return "Mode: %s" % self.name
+
+
+class CLIParseCmd(object):
+    """
+    Represent a command (aka a model which inherits from CPDKModel)
+    """
+    name = ""
+    fields = []
+
+    def __init__(self, name, model):
+        """
+        Constructor.
+        :param name: The name of the model
+        :param model: The SQLAlchemy class (CPDKModel) this command maps to
+        """
+        self.name = name
+        self.fields = []
+        self.model = model
+
+    def __str__(self):
+        return self.name
+
+    def add_field(self, field):
+        self.fields.append(field)
+
+    def build_cli(self, fh):
+        """
+        Write the class to the schema file, which is used by cmd.Cmd in RedShell
+        :param fh: File handle object
+        :return: None
+        """
+        # Search through all of the relationships, skipping the ones with the 'read-only' info hash key.
+        # The keys of the relationships are simply the field names in the model
+        # ex: this->> *virtual_servers* = relalationship('VirtualServer'....)
+        # Shipping this over to the server (ref_field) so it knows the field name to add the reference to
+        references = {}
+        for key, rel in sql_inspect(self.model).mapper.relationships.items():
+            if not rel.info.get('read-only'):
+                references[rel.mapper.class_.__name__] = key
+
+        # If all relationships are read-only, don't generate add or remove commands
+        values = {'MODEL': self.name,
+                  'DISPLAY_NAME': self.model.get_display_name(),
+                  'DAEMON_MANAGED': repr(bool(getattr(self.model, 'daemon_managed', False))),
+                  'BASE': 'RefCmd' if references else 'BaseCmd',
+
+                  # What 'show' needs to display objects without importing the model, unless it overrides __str__
+                  'FIELDS': repr(tuple(str(column.name) for column in self.model.__table__.columns)),
+                  'CUSTOM_DISPLAY': repr(self.model.__str__.im_func is not CPDKModel.__str__.im_func),
+                  'REFERENCES': '    references = %r\n' % references if references else ''}
+        output = COMMAND_TEMPLATE.render(values)
+
+        fh.write(output)
+
+        # Write out all the handlers for fields in the model
+        for field in self.fields:
+            field.build_cli(fh)
+
+
+class CLIParseField(object):
+    """
+    Represent an individual field within a model class
+    """
+    name = ""
+
+    def __init__(self, name, parent_cmd, column, obj_type):
+        """
+        Constructor
+        :param name: Name of the parameter
+        :param parent_cmd: The CLIParseCmd object under which this field lives
+        :param column: The SQLAlchemy Column object representing this field
+        :param obj_type:
+        """
+        self.name = name
+        self.parent_cmd = parent_cmd
+        self.column = column
+        self.obj_type = obj_type
+
+    def build_cli(self, fh):
+        """
+        Write the accessor CLI commands for this field to the schema file
+        :param fh: File Handle
+        :return: None
+        """
+
+        # Skip creating a command if the field is display-only
+        if 'display_only' in self.column.info and self.column.info['display_only']:
+            return
+
+        values = {'FIELD': self.name, 'COMMAND': self.name}
+
+        # Special case for booleans
+        if self.obj_type == sqlalchemy.types.Boolean:
+            values['NEGATIVE_COMMAND'] = self.column.info.get('negative_cmd', 'no_' + self.name)
+            output = BOOLEAN_FIELD_TEMPLATE.render(values)
+        else:
+            # The argument is converted to the type of the column before it's sent
+            values['CONVERT'] = lookup_type(PYTHON_TYPES, self.obj_type)
+            output = FIELD_TEMPLATE.render(values)
+
+        fh.write(output)
+
+
+def build_cli_recurse(parent_dir, parent_mode):
+    """
+    Walk through a directory and build command/mode/field nodes as appropriate
+    :param parent_dir: Full path of the parent directory
+    :param parent_mode: The CLIParseMode object to serve as a parent to all nodes found
+    :return: None
+    """
+    # Look for files and directories inside of parent_dir
+    for obj in os.listdir(parent_dir):
+        full_path = parent_dir + os.path.sep + obj
+
+        if os.path.isfile(full_path):
+
+            # Skip over special files or non-python files
+            if obj.startswith('__') or (obj.endswith('.py') is False):
+                continue
+
+            # Change from a file system path to a dotted module path (remove .py)
+            import_path = full_path.replace('.py', '')
+            from_path = parent_dir.replace(os.path.sep, '.')
+            module_path = import_path.replace(os.path.sep, '.')
+
+            import_namespcae = __import__(module_path, fromlist=[from_path])
+
+            for name, o in inspect.getmembers(import_namespcae, inspect.isclass):
+                # The 'name' != 'CPDKModel' check is to weed out the sqlalchemy Base class override
+                if inspect.isclass(o) and issubclass(o, CPDKModel) and name != 'CPDKModel':
+                    new_cmd = CLIParseCmd(name, o)
+                    parent_mode.add_child_command(new_cmd)
+
+                    # Import all the database attributes
+                    for member_name, member_object in inspect.getmembers(o):
+
+                        # Never import a member named "id" or "name" as that's an internal-only attribute
+                        if type(member_object) == InstrumentedAttribute and member_name != 'id' and member_name != 'name':
+                            if member_name in o.__table__.columns:
+                                obj_type = getattr(o.__table__.columns, member_name).type
+                                field = CLIParseField(name=member_name, parent_cmd=new_cmd,
+                                                      column=member_object, obj_type=type(obj_type))
+                                new_cmd.add_field(field)
+
+        elif os.path.isdir(full_path):
+            # Create a new mode object, add it to the parents object list, and recurse into it
+            new_mode = CLIParseMode(name=obj)
+            parent_mode.add_child_mode(new_mode)
+            build_cli_recurse(full_path, new_mode)
+        else:
+            raise NotImplemented('Unknown file system object encountered during file scan')
+
+
+def build_modes_table(global_mode):
+    """
+    Define the table the shared commands look models up in
+    :param global_mode: The top level CLIParseMode
+    :return: A string, containing the definition of the table
+    """
+    output = '\n\n# Display name -> command class of every model\n'
+    output += 'MODES = {\n'
+    for command in global_mode.get_commands():
+        output += '    "%s": %s,\n' % (command.model.get_display_name(), command.name)
+    output += '}\n'
+    return output
+
+
+def build_cli(base_dir, schema_file):
+    """
+    Walk through the base_dir and build the CLI schema.
+     Directories are treated as empty mode containers.
+    :param base_dir: The base directory to start recursion from
+    :param schema_file: The name of the file to write to
+    :return: None
+    """
+
+    global_mode = CLIParseMode(name='Global')
+
+    # Generate a tree of all the modes, commands, and fields
+    build_cli_recurse(base_dir, global_mode)
+
+    # Write out the schema that cmd.Cmd can use when RedShell is invoked as a daemon
+    fh = open(schema_file, mode='w')
+
+    # Write out the base classes that every command/mode will inherit
+    fh.write(SCHEMA_BASE)    # TODO: Upgrade to cmd2 to get more features?
+
+    global_mode.build_cli(fh)
+
+    # Write out the table of models, now that all of the command classes are defined
+    fh.write(build_modes_table(global_mode))
+    fh.close()
@@ -0,0 +1,103 @@
+"""
+Wire encodings for the messages exchanged with CPDKd.
+"""
+import json
+import zlib
+
+# MessagePack is optional, JSON works without it
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ENCODING_JSON = 'json'
+ENCODING_MSGPACK = 'msgpack'
+
+
+class JSONCodec(object):
+    """
+    The default encoding. Messages are JSON text.
+    """
+    name = ENCODING_JSON
+
+    @staticmethod
+    def encode(obj):
+        return json.dumps(obj)
+
+    @staticmethod
+    def decode(data):
+        return json.loads(data)
+
+
+class MsgPackCodec(object):
+    """
+    MessagePack encoding. Messages are smaller and quicker to encode and decode than JSON.
+    Strings are always packed as the MessagePack str type and decoded to unicode, just like JSON.
+    """
+    name = ENCODING_MSGPACK
+
+    @staticmethod
+    def encode(obj):
+        return msgpack.packb(obj, use_bin_type=False)
+
+    @staticmethod
+    def decode(data):
+        return msgpack.unpackb(data, encoding='utf-8')
+
+
+codecs = {ENCODING_JSON: JSONCodec, ENCODING_MSGPACK: MsgPackCodec}
+
+
+def get_codec(name):
+    """
+    Look up a codec by the name used in the settings
+    :param name: 'json' or 'msgpack'
+    :return: The codec class
+    :raises ValueError: If the encoding is unknown, or its module isn't installed
+    """
+    if name not in codecs:
+        raise ValueError('unknown encoding %s' % name)
+
+    if name == ENCODING_MSGPACK and msgpack is None:
+        raise ValueError('the msgpack encoding needs the msgpack-python package')
+
+    return codecs[name]
+
+
+def sniff_codec(data):
+    """
+    Work out which codec a message was encoded with. Messages are always JSON objects or arrays, which start with
+    a printable character, while MessagePack maps and arrays always start with a byte of 0x80 or above.
+    :param data: The encoded message
+    :return: The codec class
+    """
+    if data and ord(data[0]) >= 0x80 and msgpack is not None:
+        return MsgPackCodec
+
+    return JSONCodec
+
+
+def pubsub_topic(model_name, obj_name=None):
+    """
+    Build the topic frame of a PUB-SUB message. Every message is sent as two frames, the topic and the encoded event.
+    Subscribers filter on the start of the topic: "Model\\0" gets every event of a model, and "Model\\0object\\0" only
+    the events of a single object. The terminating NUL keeps "Server\\0" from matching "ServerPool\\0".
+    :param model_name: Name of the model
+    :param obj_name: Name of the object, if the event is about a single object
+    :return: The topic, as UTF-8 bytes
+    """
+    topic = model_name + u'\0'
+    if obj_name is not None:
+        topic += obj_name + u'\0'
+    return topic.encode('utf-8')
+
+
+def field_id(field_name):
+    """
+    Work out the numeric ID of a field, which PUB-SUB events carry next to the field's name. It's the CRC-32 of the
+    name, so a field keeps its ID as others are added or removed, and the generated C++ managers can work out the ID of
+    the names in 'list' responses too.
+    :param field_name: Name of the field: a column or relationship, or the referenced model of an add_ref or del_ref
+    :return: The ID, an unsigned 32 bit integer
+    """
+    return zlib.crc32(field_name.encode('utf-8')) & 0xffffffff
@@ -0,0 +1,119 @@
+"""
+Conflation of high rate field updates, used by CPDKd.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class Conflator(object):
+    """
+    Holds the latest value of fields declared with info={'conflate': True}, until CPDKd writes them out.
+    Updates to such fields are accepted right away, but only the last value of each (model, object, field) is
+    committed and published, once per interval.
+
+    Only CPDKd's main thread changes the pending values. The counters can be read from any thread.
+    """
+
+    def __init__(self, interval):
+        """
+        Constructor
+        :param interval: How long updates are held back for, in milliseconds
+        """
+        self.interval = interval / 1000.0
+        self.pending = OrderedDict()
+        self.lock = threading.RLock()
+
+        # When the oldest pending update was accepted, None if nothing is pending
+        self.since = None
+
+        # Updates accepted for conflation
+        self.accepted = 0
+
+        # Updates replaced by a newer value before they were written
+        self.coalesced = 0
+
+        # Updates committed and published
+        self.flushed = 0
+
+        # Updates thrown away, because the object was deleted, the field was written directly, or the write failed
+        self.dropped = 0
+
+    def accept(self, model_name, name, field, value):
+        """
+        Remember the latest value of a field
+        :param model_name: Name of the model class
+        :param name: Name of the object
+        :param field: Name of the field
+        :param value: The new value
+        :return: None
+        """
+        with self.lock:
+            key = (model_name, name, field)
+            if not self.pending:
+                self.since = time.time()
+            if key in self.pending:
+                self.coalesced += 1
+            self.pending[key] = value
+            self.accepted += 1
+
+    def take(self):
+        """
+        Hand over every pending update, oldest first, and forget about them
+        :return: List of ((model name, object name, field), value) tuples
+        """
+        with self.lock:
+            updates = self.pending.items()
+            self.pending = OrderedDict()
+            self.since = None
+            return updates
+
+    def due_in(self):
+        """
+        Work out how long until the pending updates have to be written out
+        :return: Seconds until they're due (0 if they're overdue), or None if nothing is pending
+        """
+        with self.lock:
+            if self.since is None:
+                return None
+            return max(0.0, self.since + self.interval - time.time())
+
+    def discard(self, model_name, name=None, field=None):
+        """
+        Throw away pending updates which a committed change has made obsolete
+        :param model_name: Name of the model class
+        :param name: Name of the object. If None, the updates of every object of the model are thrown away.
+        :param field: Name of the field. If None, the updates of every field of the object are thrown away.
+        :return: None
+        """
+        with self.lock:
+            for key in self.pending.keys():
+                if key[0] == model_name and name in (None, key[1]) and field in (None, key[2]):
+                    del self.pending[key]
+                    self.dropped += 1
+
+            if not self.pending:
+                self.since = None
+
+    def count(self, flushed, dropped):
+        """
+        Record the outcome of writing out the updates returned by take()
+        :param flushed: Number of updates committed and published
+        :param dropped: Number of updates which couldn't be written
+        :return: None
+        """
+        with self.lock:
+            self.flushed += flushed
+            self.dropped += dropped
+
+    def stats(self):
+        """
+        Fetch the conflation counters
+        :return: A dictionary of counters
+        """
+        with self.lock:
+            return {'pending': len(self.pending),
+                    'accepted': self.accepted,
+                    'coalesced': self.coalesced,
+                    'flushed': self.flushed,
+                    'dropped': self.dropped}
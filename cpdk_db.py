@@ -3,14 +3,23 @@ These are the base types for CPDK models.
 """
 import os
 import sys
+import decimal
 from os import walk
+from operator import attrgetter
 
-from sqlalchemy import Column, Integer, Text
-from sqlalchemy import create_engine
+from sqlalchemy import Column, Integer, Numeric, Text, Index
+from sqlalchemy import create_engine, bindparam, event, select, func
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.ext import baked
 from sqlalchemy.inspection import inspect as sql_inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.orm import clear_mappers
+from sqlalchemy.orm import clear_mappers, subqueryload
+from cpdk_changelog import metadata as changelog_metadata
+
+# Cache of compiled queries. Every model gets its own entries, so keep this large enough for big model trees.
+bakery = baked.bakery(size=5000)
+name_queries = {}
 
 
 class CPDKModel(object):
@@ -28,25 +37,115 @@ class CPDKModel(object):
     def __tablename__(cls):
         return cls.__name__.lower()
 
-    def serialize(self):
+    @classmethod
+    def compile_serializer(cls):
+        """
+        Work out which columns and relationships serialize() exports. This is done once per model, when the models are
+        imported, so serializing a row doesn't have to inspect the model again.
+        :return: None
+        """
+        cls._serialize_columns = tuple(column.name for column in cls.__table__.columns)
+        cls._serialize_relationships = tuple(sql_inspect(cls).relationships.keys())
+
+        # Numeric columns are read back as Decimal, which neither JSON nor MessagePack can encode
+        cls._serialize_decimals = tuple(column.name for column in cls.__table__.columns
+                                        if isinstance(column.type, Numeric) and column.type.asdecimal)
+
+        # Fetches the values of every column in one call. Models always have at least two columns (id and name),
+        # so this always returns a tuple.
+        cls._serialize_getter = attrgetter(*cls._serialize_columns)
+
+    def serialize(self, columns=None, relationships=None):
         """
         Export all columns to JSON
+        :param columns: Names of the columns to export. None exports all of them.
+        :param relationships: Names of the relationships to export. None exports all of them.
         :return: A dictionary containing columns as keys, and their values.
         """
-        data = {}
+        cls = self.__class__
+        if '_serialize_getter' not in cls.__dict__:
+            cls.compile_serializer()
+
+        # Get the attributes
+        if columns is None:
+            data = dict(zip(cls._serialize_columns, cls._serialize_getter(self)))
+        else:
+            data = {column: getattr(self, column) for column in columns}
 
-        # Get all the attributes
-        for column in self.__class__.__table__.columns:
-            data[column.name] = getattr(self, column.name)
+        for column in cls._serialize_decimals:
+            if isinstance(data.get(column), decimal.Decimal):
+                data[column] = float(data[column])
 
         # Get any relations
-        for key in sql_inspect(self).mapper.relationships.keys():
-            data[key] = []
-            for i in getattr(self, key):
-                data[key].append(i.name)
+        if relationships is None:
+            relationships = cls._serialize_relationships
+
+        for key in relationships:
+            data[key] = [i.name for i in getattr(self, key)]
 
         return data
 
+    @classmethod
+    def query_all(cls, session, relationships=None):
+        """
+        Build a query for objects of this model, which loads their relationships up front.
+        Each relationship is loaded with one extra query for all of the objects, rather than one query per object.
+        :param session: The database session to run the query in
+        :param relationships: Names of the relationships that will be serialized. None loads all of them.
+        :return: A query object
+        """
+        if relationships is None:
+            relationships = sql_inspect(cls).relationships.keys()
+
+        # Only the names of the referenced objects are serialized, so leave the rest of their columns alone
+        return session.query(cls).options(*[subqueryload(key).load_only('name') for key in relationships])
+
+    @classmethod
+    def is_filterable(cls, column_name):
+        """
+        Check if objects of this model can be looked up by the value of a column.
+        Only indexed columns are filterable, so a lookup never has to scan the whole table.
+        :param column_name: Name of the column
+        :return: True if the column is indexed
+        """
+        if not isinstance(column_name, basestring) or column_name not in cls.__table__.columns:
+            return False
+
+        column = cls.__table__.columns[column_name]
+        if column.primary_key or column.index or column.unique:
+            return True
+
+        return any(column_name in index.columns for index in cls.__table__.indexes)
+
+    @classmethod
+    def is_conflated(cls, column_name):
+        """
+        Check if updates to a column are conflated by CPDKd, rather than committed one at a time.
+        :param column_name: Name of the column
+        :return: True if the column was declared with info={'conflate': True}
+        """
+        if not isinstance(column_name, basestring) or column_name not in cls.__table__.columns:
+            return False
+
+        return bool(cls.__table__.columns[column_name].info.get('conflate'))
+
+    @classmethod
+    def query_by_name(cls, session, name):
+        """
+        Look up objects of this model by name.
+        The query is only built and compiled the first time it's used for a model. After that it's reused.
+        :param session: The database session to run the query in
+        :param name: Name of the object to look for
+        :return: A baked query result. Call one(), first() or all() on it to fetch the objects.
+        """
+        if cls not in name_queries:
+            # The class is part of the cache key, otherwise every model would share the same compiled query
+            query = bakery(lambda session: session.query(cls), cls)
+            query += lambda q: q.filter(cls.name == bindparam('name'))
+            name_queries[cls] = query
+
+        return name_queries[cls](session).params(name=name)
+
     @classmethod
     def get_display_name(cls):
         """
@@ -72,7 +171,9 @@ class CPDKModel(object):
         return output
 
     id = Column(Integer, primary_key=True)
-    name = Column(Text)
+
+    # Objects are always looked up by name, so it's indexed. Models can redefine this column to allow duplicates.
+    name = Column(Text, index=True, unique=True)
 
 # Needed for mixing in with the stock SQLAlchemy base model
 CPDKModel = declarative_base(cls=CPDKModel)
@@ -104,12 +205,30 @@ def import_user_models(base_dir):
     all_my_base_classes = {cls.__name__: cls for cls in CPDKModel.__subclasses__()}
 
     for class_name in all_my_base_classes:
+        # Columns flagged with info={'index': True} get a database index
+        add_info_indexes(all_my_base_classes[class_name])
+
         # Instantiate the class and write its schema to the database
         models[class_name] = all_my_base_classes[class_name]()
 
+    # All of the models are mapped by now, so their relationships are known
+    for cls in all_my_base_classes.values():
+        cls.compile_serializer()
+
     return models
 
 
+def add_info_indexes(cls):
+    """
+    Create an index for every column of a model declared with info={'index': True}
+    :param cls: The model class
+    :return: None
+    """
+    for column in cls.__table__.columns:
+        if column.info.get('index') and not cls.is_filterable(column.name):
+            Index('ix_%s_%s' % (cls.__tablename__, column.name), column)
+
+
 def unimport_user_modules(models, base_dir):
     """
     Delete any previously imported users modules
@@ -119,6 +238,7 @@ def unimport_user_modules(models, base_dir):
 
     clear_mappers()
     CPDKModel().metadata.clear()
+    name_queries.clear()
 
     while len(models):
         k = models.keys()[0]
@@ -146,7 +266,92 @@ def unimport_user_modules(models, base_dir):
 def create_db(db_name, debug):
     """
     Lay down the databse schema based on the CPDKModels which have been defined.
-    :return: None
+    :return: Dictionary of the unique indexes which couldn't be added to existing tables. See create_missing_indexes().
     """
     engine = create_engine('sqlite:///' + db_name, echo=debug)
     CPDKModel().metadata.create_all(bind=engine)
+    changelog_metadata.create_all(bind=engine)
+    return create_missing_indexes(engine)
+
+
+def create_missing_indexes(engine):
+    """
+    Create the indexes of the models which an existing database doesn't have yet. create_all() only indexes the tables
+    it creates, so tables laid down before an index was declared would never get it.
+    A unique index isn't created if the table already holds duplicate values for it.
+    :param engine: The database engine
+    :return: Dictionary of the unique indexes left out, and the values duplicated in each
+    """
+    inspector = sql_inspect(engine)
+    skipped = {}
+
+    for table in CPDKModel.metadata.sorted_tables:
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in sorted(table.indexes, key=attrgetter('name')):
+            if index.name in existing:
+                continue
+
+            if index.unique:
+                columns = list(index.columns)
+                query = select(columns).group_by(*columns).having(func.count() > 1)
+                duplicates = [row[0] if len(row) == 1 else tuple(row) for row in engine.execute(query)]
+                if duplicates:
+                    skipped[index.name] = duplicates
+                    continue
+
+            index.create(bind=engine)
+
+    return skipped
+
+
+def create_cpdk_engine(db_name, debug, pool_size=5, max_overflow=10, journal_mode=None, synchronous=None,
+                       cache_size=None):
+    """
+    Create a pooled database engine. The SQLite tuning options are applied to every new connection.
+    :param db_name: Name of the SQLite database file
+    :param debug: Log all SQL statements
+    :param pool_size: Number of connections kept open in the pool
+    :param max_overflow: Number of extra connections allowed when the pool is exhausted
+    :param journal_mode: SQLite journal mode (DELETE, TRUNCATE, WAL, ...). None leaves the database default.
+    :param synchronous: SQLite synchronous level (OFF, NORMAL, FULL, EXTRA). None leaves the SQLite default.
+    :param cache_size: SQLite page cache size. Negative values are in KiB. None leaves the SQLite default.
+    :return: The engine
+    """
+    # Connections are handed out to whichever thread checks them out of the pool
+    engine = create_engine('sqlite:///' + db_name, echo=debug, poolclass=QueuePool, pool_size=pool_size,
+                           max_overflow=max_overflow, connect_args={'check_same_thread': False})
+
+    pragmas = [('journal_mode', journal_mode), ('synchronous', synchronous), ('cache_size', cache_size)]
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas:
+            if value is not None:
+                cursor.execute('PRAGMA %s=%s' % (pragma, value))
+        cursor.close()
+
+        # pysqlite commits the open transaction before a SAVEPOINT, so take over starting transactions from it
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin_transaction(connection):
+        connection.execute('BEGIN')
+
+    return engine
+
+
+def describe_engine(engine):
+    """
+    Fetch the settings actually in effect for a database engine
+    :param engine: The engine returned by create_cpdk_engine()
+    :return: A dictionary of setting names and values
+    """
+    connection = engine.connect()
+    try:
+        return {'pool': engine.pool.status(),
+                'journal_mode': connection.execute('PRAGMA journal_mode').scalar(),
+                'synchronous': connection.execute('PRAGMA synchronous').scalar(),
+                'cache_size': connection.execute('PRAGMA cache_size').scalar()}
+    finally:
+        connection.close()
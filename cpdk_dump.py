@@ -0,0 +1,246 @@
+"""
+Streaming dump and load of the whole configuration, used by cpdk-util.
+
+A dump is a text file with one JSON document per line. The first line is a header listing the tables, in the order
+they were written. Every other line is a single row: {"t": table name, "r": {column: value}}. Object ids aren't
+dumped, since they're assigned again when the dump is loaded. Foreign keys to a model, including the ones in the
+association tables behind many-to-many relationships, are written as the name of the object they point at.
+
+Files ending in .gz are compressed.
+"""
+import gzip
+import json
+import decimal
+import logging
+
+from sqlalchemy import select, bindparam
+from cpdk_changelog import metadata as changelog_metadata, replace_epoch
+
+DUMP_VERSION = 1
+
+# Rows inserted with each executemany() call while loading
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def open_dump(path, mode):
+    """
+    Open a dump file, compressed if its name ends in .gz
+    :param path: Name of the file
+    :param mode: 'r' or 'w'
+    :return: The file object
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 'b')
+    return open(path, mode)
+
+
+def name_references(table):
+    """
+    Find the columns of a table which point at a model, and can be written as the name of the object
+    :param table: The table
+    :return: Dictionary of column name to the referenced table
+    """
+    references = {}
+    for column in table.columns:
+        for fk in column.foreign_keys:
+            ref = fk.column.table
+            if fk.column.name == 'id' and 'name' in ref.columns:
+                references[column.name] = ref
+    return references
+
+
+def dumped_columns(table):
+    """
+    List the columns of a table which are dumped
+    :param table: The table
+    :return: List of columns. Model ids are left out.
+    """
+    return [c for c in table.columns if not (c.name == 'id' and 'name' in table.columns)]
+
+
+def dump_value(value):
+    """
+    Convert the values json can't encode itself. Numeric columns are read back as Decimal.
+    :param value: The value
+    :return: A value json can encode
+    :raises TypeError: If the value can't be converted
+    """
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def dump(engine, metadata, path):
+    """
+    Write every row of every table to a dump file. Rows are streamed from the database, one at a time.
+    :param engine: The database engine
+    :param metadata: Metadata holding the tables of the user models
+    :param path: Name of the dump file
+    :return: Dictionary of the number of rows written for each table
+    """
+    tables = metadata.sorted_tables
+    counts = {}
+
+    connection = engine.connect()
+    try:
+        with open_dump(path, 'w') as f:
+            f.write(json.dumps({'cpdk_dump': DUMP_VERSION, 'tables': [table.name for table in tables]}) + '\n')
+
+            for table in tables:
+                references = name_references(table)
+
+                # Join in the referenced objects, so their names can be written instead of their ids
+                columns = []
+                from_clause = table
+                for column in dumped_columns(table):
+                    if column.name in references:
+                        ref = references[column.name].alias()
+                        from_clause = from_clause.outerjoin(ref, column == ref.c.id)
+                        columns.append(ref.c.name.label(column.name))
+                    else:
+                        columns.append(column)
+
+                query = select(columns).select_from(from_clause)
+                if 'id' in table.columns:
+                    query = query.order_by(table.c.id)
+
+                counts[table.name] = 0
+                for row in connection.execute(query):
+                    f.write(json.dumps({'t': table.name, 'r': dict(row.items())}, default=dump_value) + '\n')
+                    counts[table.name] += 1
+    finally:
+        connection.close()
+
+    return counts
+
+
+class Loader(object):
+    """
+    Inserts the rows of one table in chunks, looking up the ids of referenced objects by name in the database
+    """
+
+    def __init__(self, connection, table, chunk_size):
+        """
+        Constructor
+        :param connection: The connection holding the load's transaction
+        :param table: The table to insert into
+        :param chunk_size: Number of rows to insert at once
+        """
+        self.connection = connection
+        self.table = table
+        self.chunk_size = chunk_size
+        self.columns = set(c.name for c in dumped_columns(table))
+        self.rows = []
+        self.count = 0
+
+        # The ids of referenced objects are looked up by the INSERT itself, so nothing has to be kept in memory
+        values = {}
+        for column_name, ref in name_references(table).iteritems():
+            values[column_name] = select([ref.c.id]).where(ref.c.name == bindparam('ref_' + column_name)).as_scalar()
+        self.references = values.keys()
+
+        for column_name in self.columns:
+            if column_name not in values:
+                values[column_name] = bindparam('col_' + column_name)
+        self.statement = table.insert().values(values)
+
+    def add(self, row):
+        """
+        Queue up a row, inserting the queued rows once there's a chunk of them
+        :param row: Dictionary of column names and values, as written by dump()
+        :return: None
+        :raises ValueError: If the row has columns the table doesn't
+        """
+        unknown = set(row) - self.columns
+        if unknown:
+            raise ValueError('%s has no columns %s' % (self.table.name, ', '.join(sorted(unknown))))
+
+        params = {}
+        for column_name in self.columns:
+            if column_name in self.references:
+                params['ref_' + column_name] = row.get(column_name)
+            else:
+                params['col_' + column_name] = row.get(column_name)
+        self.rows.append(params)
+
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Insert the queued rows
+        :return: None
+        """
+        if self.rows:
+            self.connection.execute(self.statement, self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+
+def load(engine, metadata, path, replace=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Insert every row of a dump file. Rows are read and inserted a chunk at a time, all in a single transaction, so
+    either the whole dump is loaded or nothing is. The database gets a new epoch in the same transaction, so daemons
+    never resume from revisions, or snapshot files, of what was there before.
+    :param engine: The database engine
+    :param metadata: Metadata holding the tables of the user models
+    :param path: Name of the dump file
+    :param replace: Delete the existing rows of every table in the dump first
+    :param chunk_size: Number of rows to insert at once
+    :return: Dictionary of the number of rows loaded for each table in the dump
+    :raises ValueError: If the file isn't a dump, or doesn't match the models
+    """
+    connection = engine.connect()
+    transaction = connection.begin()
+    try:
+        with open_dump(path, 'r') as f:
+            header = json.loads(f.readline() or '{}')
+            if header.get('cpdk_dump') != DUMP_VERSION:
+                raise ValueError('%s is not a version %d dump' % (path, DUMP_VERSION))
+
+            unknown = [name for name in header['tables'] if name not in metadata.tables]
+            if unknown:
+                raise ValueError('the models have no tables %s' % ', '.join(unknown))
+
+            if replace:
+                # Association tables first, so nothing is left pointing at a deleted row
+                for table in reversed(metadata.sorted_tables):
+                    if table.name in header['tables']:
+                        connection.execute(table.delete())
+
+            # Rows are grouped by table, and the tables come in dependency order, so only one loader is ever filling
+            counts = dict((name, 0) for name in header['tables'])
+            loaded = set()
+            loader = None
+            for line in f:
+                item = json.loads(line)
+                if loader is None or loader.table.name != item['t']:
+                    if loader is not None:
+                        loader.flush()
+                        logging.info('Loaded %d rows into %s' % (loader.count, loader.table.name))
+
+                    if item['t'] not in header['tables']:
+                        raise ValueError('%s is not listed in the header' % item['t'])
+                    if item['t'] in loaded:
+                        raise ValueError('the rows of %s are not together' % item['t'])
+
+                    loader = Loader(connection, metadata.tables[item['t']], chunk_size)
+                    loaded.add(item['t'])
+
+                loader.add(item['r'])
+                counts[item['t']] += 1
+
+            if loader is not None:
+                loader.flush()
+                logging.info('Loaded %d rows into %s' % (loader.count, loader.table.name))
+
+        changelog_metadata.create_all(bind=connection)
+        replace_epoch(connection)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return counts
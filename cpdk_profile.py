@@ -0,0 +1,247 @@
+"""
+CPU profiles and SQL timings for CPDKd, cpdk-util and RedShell.
+"""
+import os
+import time
+import pstats
+import logging
+import cProfile
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Number of functions listed in the text summary of a profile
+SUMMARY_LINES = 60
+
+
+class SQLTimer(object):
+    """
+    Times every SQL statement run by any engine while it's started, grouped by the statement text
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        # Statement text -> [count, total seconds, slowest seconds]
+        self.statements = {}
+
+    def start(self):
+        """
+        Start listening for statements
+        :return: None
+        """
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def stop(self):
+        """
+        Stop listening for statements
+        :return: None
+        """
+        event.remove(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.started = time.time()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Statements which were already running when the timer was started aren't counted
+        started = getattr(self.local, 'started', None)
+        if started is None:
+            return
+
+        self.local.started = None
+        elapsed = time.time() - started
+
+        with self.lock:
+            timing = self.statements.get(statement)
+            if timing is None:
+                timing = self.statements[statement] = [0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+
+    def report(self):
+        """
+        Summarize the timings, slowest statements (by total time) first
+        :return: The report, as text
+        """
+        with self.lock:
+            timings = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+
+        lines = ['%8s %12s %10s %10s  %s' % ('count', 'total ms', 'mean ms', 'max ms', 'statement')]
+        for statement, (count, total, slowest) in timings:
+            lines.append('%8d %12.3f %10.3f %10.3f  %s' % (count, total * 1e3, total * 1e3 / count, slowest * 1e3,
+                                                          ' '.join(statement.split())))
+        return '\n'.join(lines) + '\n'
+
+
+def profile_path(directory, name):
+    """
+    Pick the base name of a profile's files
+    :param directory: Directory the profiles are written to. Created if it doesn't exist.
+    :param name: Name of the program or message type being profiled
+    :return: The path, without an extension
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    return os.path.join(directory, '%s-%s-%d' % (name, time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+
+
+def write_profile(path, stats):
+    """
+    Write a profile as <path>.prof (for pstats, snakeviz and the like), and a text summary as <path>.txt
+    :param path: Path returned by profile_path()
+    :param stats: The pstats.Stats to write
+    :return: List of the files written
+    """
+    stats.dump_stats(path + '.prof')
+
+    with open(path + '.txt', 'w') as f:
+        stats.stream = f
+        stats.sort_stats('cumulative').print_stats(SUMMARY_LINES)
+        stats.sort_stats('tottime').print_stats(SUMMARY_LINES)
+
+    return [path + '.prof', path + '.txt']
+
+
+def write_sql_timings(path, sql_timer):
+    """
+    Write the SQL timings which ran alongside a profile as <path>-sql.txt
+    :param path: Path returned by profile_path()
+    :param sql_timer: The SQLTimer
+    :return: List of the files written
+    """
+    with open(path + '-sql.txt', 'w') as f:
+        f.write(sql_timer.report())
+
+    return [path + '-sql.txt']
+
+
+class ProcessProfiler(object):
+    """
+    Profiles everything the calling thread does between start() and stop(), and times the SQL statements of every
+    thread. Used by the --profile option of CPDKd, cpdk-util and RedShell.
+    """
+
+    def __init__(self, name, directory):
+        """
+        Constructor
+        :param name: Name of the program, used in the file names
+        :param directory: Directory the profile is written to
+        """
+        self.name = name
+        self.directory = directory
+        self.profile = cProfile.Profile()
+        self.sql_timer = SQLTimer()
+
+    def start(self):
+        """
+        Start profiling
+        :return: None
+        """
+        self.sql_timer.start()
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling and write the profile out
+        :return: List of the files written
+        """
+        self.profile.disable()
+        self.sql_timer.stop()
+
+        path = profile_path(self.directory, self.name)
+        files = write_profile(path, pstats.Stats(self.profile)) + write_sql_timings(path, self.sql_timer)
+        logging.info('Profile written to %s' % ', '.join(files))
+        return files
+
+
+class RequestProfiler(object):
+    """
+    Profiles one in every `sample` requests, in whichever thread processes it. The profiles are merged per message
+    type, and written out when profiling stops: a profile per message type, and the SQL timings of every request.
+    """
+
+    def __init__(self, name, directory, sample):
+        """
+        Constructor
+        :param name: Name of the program, used in the file names
+        :param directory: Directory the profiles are written to
+        :param sample: Profile one request in this many
+        """
+        self.name = name
+        self.directory = directory
+        self.sample = max(1, int(sample))
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.sampled = 0
+        self.running = False
+        self.sql_timer = SQLTimer()
+
+        # Message type -> merged pstats.Stats
+        self.stats = {}
+
+    def start(self):
+        """
+        Start sampling requests
+        :return: None
+        """
+        self.sql_timer.start()
+        self.running = True
+
+    def call(self, msg_type, func, *args):
+        """
+        Call a function processing a request, profiling it if it's sampled
+        :param msg_type: The message type of the request
+        :param func: The function
+        :return: Whatever the function returns
+        """
+        with self.lock:
+            self.requests += 1
+            sampled = self.running and self.requests % self.sample == 0
+
+        if not sampled:
+            return func(*args)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            with self.lock:
+                if self.running:
+                    self.sampled += 1
+                    if msg_type in self.stats:
+                        self.stats[msg_type].add(profile)
+                    else:
+                        self.stats[msg_type] = pstats.Stats(profile)
+
+    def stop(self):
+        """
+        Stop sampling and write the profiles out
+        :return: List of the files written
+        """
+        with self.lock:
+            self.running = False
+        self.sql_timer.stop()
+
+        path = profile_path(self.directory, self.name)
+        files = write_sql_timings(path, self.sql_timer)
+        for msg_type, stats in sorted(self.stats.items()):
+            files += write_profile('%s-%s' % (path, msg_type), stats)
+        logging.info('Profiled %d of %d requests, written to %s' % (self.sampled, self.requests, ', '.join(files)))
+        return files
+
+    def status(self):
+        """
+        Fetch the sampling counters
+        :return: A dictionary with the sample rate, and the number of requests seen and profiled
+        """
+        with self.lock:
+            return {'sample': self.sample, 'requests': self.requests, 'sampled': self.sampled}
@@ -0,0 +1,41 @@
+"""
+Defaults of the settings added after settings files were first written, so that older --settings modules keep working.
+"""
+
+# Name and default value of each setting. See settings.py for what they do.
+DEFAULTS = {
+    'DB_POOL_SIZE': 5,
+    'DB_POOL_MAX_OVERFLOW': 10,
+    'DB_JOURNAL_MODE': 'WAL',
+    'DB_SYNCHRONOUS': 'NORMAL',
+    'DB_CACHE_SIZE': -16000,
+    'C_LIST_PAGE_SIZE': 1000,
+    'C_EVENT_BUDGET': 1000,
+    'C_WRITE_BATCH_SIZE': 1000,
+    'C_MAX_IN_FLIGHT': 100,
+    'ZMQ_SHELL_ENCODING': 'json',
+    'ZMQ_CLIENT_SERVER_ENCODING': 'json',
+    'ZMQ_PUBSUB_ENCODING': 'json',
+    'CPDKD_POLL_TIMEOUT': 250,
+    'CPDKD_CACHE_SIZE': 0,
+    'CPDKD_CACHE_PRELOAD': False,
+    'CPDKD_WORKER_THREADS': 4,
+    'CPDKD_LIST_MAX_PAGE_SIZE': 5000,
+    'CPDKD_CHANGELOG_SIZE': 10000,
+    'CPDKD_CONFLATE_INTERVAL': 1000,
+    'CPDKD_METRICS': True,
+    'CPDKD_STATS_FILE': None,
+    'CPDKD_STATS_INTERVAL': 60,
+    'PROFILE_DIR': 'profiles',
+    'CPDKD_PROFILE_SAMPLE': 100,
+}
+
+
+def apply_defaults(settings):
+    """
+    Give a settings module the default of every setting it doesn't define
+    :param settings: The settings module
+    :return: None
+    """
+    for name, value in DEFAULTS.iteritems():
+        setattr(settings, name, getattr(settings, name, value))
@@ -0,0 +1,95 @@
+"""
+The template engine behind the code generated by cpdk-util (C++ headers) and RedShell (the CLI schema).
+
+Templates are plain text with {{ NAME }} placeholders. A template is parsed once, into the literal text between the
+placeholders and the names of the placeholders, and can then be rendered any number of times. Rendering joins the
+pieces together in a single pass, so it takes time linear in the size of the output.
+"""
+import re
+
+import sqlalchemy
+
+# Exactly one space inside the braces, so C++ initializer lists like {{1, 2}} are left alone
+PLACEHOLDER = re.compile(r'\{\{ (\w+) \}\}')
+
+# C++ type of the values of each column type. Column types not listed here are looked up by their base classes, so
+# Text, Unicode, Enum and String(n) are all strings, and SmallInteger is an int.
+CPP_TYPES = {
+    sqlalchemy.types.Boolean: 'bool',
+    sqlalchemy.types.Integer: 'int',
+    sqlalchemy.types.BigInteger: 'uint64_t',
+    sqlalchemy.types.Float: 'double',
+    sqlalchemy.types.Numeric: 'double',
+    sqlalchemy.types.String: 'std::string',
+}
+
+
+class Template(object):
+    """
+    A parsed template
+    """
+
+    def __init__(self, text):
+        """
+        Constructor. Parses the template.
+        :param text: Text of the template
+        """
+        pieces = PLACEHOLDER.split(text)
+
+        # split() alternates between literal text and placeholder names, starting and ending with literal text
+        self.literals = pieces[0::2]
+        self.names = pieces[1::2]
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Parse a template file
+        :param path: Name of the file
+        :return: The template
+        """
+        with open(path, 'r') as fh:
+            return cls(fh.read())
+
+    def placeholders(self):
+        """
+        List the placeholders used by the template
+        :return: A set of placeholder names
+        """
+        return set(self.names)
+
+    def render(self, values):
+        """
+        Fill in the placeholders
+        :param values: Dictionary of placeholder names and their text
+        :return: The rendered text
+        :raises KeyError: If a placeholder has no value
+        """
+        output = [None] * (len(self.literals) + len(self.names))
+        output[0::2] = self.literals
+        output[1::2] = [values[name] for name in self.names]
+        return ''.join(output)
+
+
+def lookup_type(types, column_type):
+    """
+    Look up a column type in a table of types, falling back on the base classes of the type
+    :param types: Dictionary of SQLAlchemy type classes to values, like CPP_TYPES
+    :param column_type: The type of a column, either an instance like String(32) or a class
+    :return: The value for the closest class in the table
+    :raises NotImplementedError: If neither the type nor any of its base classes is in the table
+    """
+    type_class = column_type if isinstance(column_type, type) else type(column_type)
+    for cls in type_class.__mro__:
+        if cls in types:
+            return types[cls]
+
+    raise NotImplementedError('column of type %s not supported' % column_type)
+
+
+def cpp_type(column_type):
+    """
+    Find the C++ type the generated headers use for the values of a column
+    :param column_type: The type of the column
+    :return: Name of the C++ type
+    """
+    return lookup_type(CPP_TYPES, column_type)
@@ -1,11 +1,15 @@
+// Generated by cpdk-util.py. Fingerprint: d58b87a04ad14df992de2475fdf2676633495fef
 // 3rd party requirements
 #include "zmq.h"
 #include "json.hpp"
+#include "cpdk_codec.h"
+#include "cpdk_runtime.h"
 
 // Standard libraries
 #include <stdio.h>
 #include <string.h>
 #include <cassert>
+#include <algorithm>
 #include <unordered_map>
 
 using json = nlohmann::json;
@@ -16,6 +20,7 @@ using json = nlohmann::json;
 #define MSG_TYPE_ADD_REF 4
 #define MSG_TYPE_DELETE_REF 5
 #define MSG_TYPE_DELETE_ALL 6
+#define MSG_TYPE_RELOAD 7
 
 // Forward declarations
 class VirtualServer;
@@ -27,6 +32,17 @@ public:
     Server(std::string name){m_Name = name;}
     virtual ~Server(){}
 
+    // IDs of the fields, as sent in the 'fid' of events
+static const uint32_t FIELD_id = 3208210256u;
+static const uint32_t FIELD_name = 1579384326u;
+static const uint32_t FIELD_address = 223244161u;
+static const uint32_t FIELD_port = 1133600204u;
+static const uint32_t FIELD_enabled = 1358543748u;
+static const uint32_t FIELD_weight = 130897217u;
+static const uint32_t FIELD_virtual_servers = 2046633528u;
+static const uint32_t REF_VirtualServer = 1282164522u;
+
+
     virtual void on_add_VirtualServer(std::string name) { }
 virtual void on_remove_VirtualServer(std::string name) { }
 
@@ -36,6 +52,7 @@ virtual void on_name(std::string val) { }
 virtual void on_address(std::string val) { }
 virtual void on_port(int val) { }
 virtual void on_enabled(bool val) { }
+virtual void on_weight(double val) { }
 
 
     inline std::string GetName(){return m_Name;}
@@ -46,7 +63,7 @@ private:
 typedef Server * (*Server_Create)(std::string name, void *pData);
 typedef void (*Server_Delete)(Server *pObj, void *pData);
 
-class ServerMgr {
+class ServerMgr : public cpdk::Subscriber {
 public:
 
     static ServerMgr & GetInstance() {
@@ -54,12 +71,20 @@ public:
         return s_Instance;
     }
 
+    void Register(Server_Create create_cb, Server_Delete delete_cb, void *pData);
     void Init(Server_Create create_cb, Server_Delete delete_cb, void *pData);
     void Cleanup(void);
-    void ProcessMessageQueue(void);
+    int ProcessMessageQueue(int budget = 1000);
+    int GetFD(void);
+    bool HasPending(void);
     Server * GetObj(std::string name){ return m_InstanceMap[name];}
 
-    // Methods for object management
+    // Keep the objects in a local file as well, so the next run only has to fetch what changed in between. Set it
+    // before the objects are fetched. The file is written by SaveSnapshot(), and by Cleanup().
+    void SetSnapshotFile(std::string path) { m_SnapshotFile = path; }
+    bool SaveSnapshot(void);
+
+    // Methods for object management. They wait for CPDKd to apply the change.
     void DeleteAll(void);
     void Create(std::string objectName);
     void UpdateField(std::string objectName, std::string fieldName, std::string val);
@@ -67,11 +92,15 @@ public:
     void UpdateField(std::string objectName, std::string fieldName, bool val);
     // TODO: Add more data types to UpdateField()
 
-private:
-    void * m_ZMQPubSubSocket;
-    void * m_ZMQClientSocket;
-    void * m_ZMQContext;
+    // The same, without waiting. Changes are queued, and sent as a single CPDKd batch by cpdk::Runtime::Flush(), or
+    // once C_WRITE_BATCH_SIZE of them are queued. The callback gets the result once the batch has been applied.
+    void DeleteAllAsync(cpdk::Callback cb = nullptr);
+    void CreateAsync(std::string objectName, cpdk::Callback cb = nullptr);
+    void UpdateFieldAsync(std::string objectName, std::string fieldName, std::string val, cpdk::Callback cb = nullptr);
+    void UpdateFieldAsync(std::string objectName, std::string fieldName, uint64_t val, cpdk::Callback cb = nullptr);
+    void UpdateFieldAsync(std::string objectName, std::string fieldName, bool val, cpdk::Callback cb = nullptr);
 
+private:
     Server_Create m_CreateCallback;
     Server_Delete m_DeleteCallback;
     void * m_pCallbackData;
@@ -79,98 +108,235 @@ private:
     typedef std::unordered_map<std::string, Server *> ObjMap;
     ObjMap m_InstanceMap;
 
+    // Revision of the last change applied to m_InstanceMap, and the epoch of the database it belongs to
+    uint64_t m_Revision;
+    std::string m_Epoch;
+
+    // The objects as CPDKd lists them, for SaveSnapshot(). Only kept when there's a snapshot file.
+    typedef std::unordered_map<std::string, json> StateMap;
+    StateMap m_State;
+    std::string m_SnapshotFile;
+
     json SendClientMessage(json &j);
+    json DeleteAllMessage(void);
+    json CreateMessage(std::string objectName);
+    template<typename T> json ModifyMessage(std::string objectName, std::string fieldName, T val);
+    void LoadAll(void);
+    void LoadObjects(json &objects);
+    void Resync(void);
+    void ApplyEvent(json &data);
+    void RecordEvent(json &data);
+    const char * ReferenceKey(uint32_t fid);
+
+    // cpdk::Subscriber
+    const char * ModelName(void) { return "Server"; }
+    void LoadSnapshot(json &page, uint64_t revision);
+    void OnEvent(json &data);
+    uint64_t ReadSnapshot(void);
+    void ResumeSnapshot(json &changes);
 
 protected:
     // Constructors (hidden for singleton-only access)
-    ServerMgr() {};
+    ServerMgr() : m_Revision(0) {};
     ServerMgr(ServerMgr const &);
     void operator=(ServerMgr const&);
 };
 
-void ServerMgr::Init(Server_Create create_cb, Server_Delete delete_cb, void *pData) {
+void ServerMgr::Register(Server_Create create_cb, Server_Delete delete_cb,
+                                  void *pData) {
 
     m_CreateCallback = create_cb;
     m_DeleteCallback = delete_cb;
     m_pCallbackData = pData;
 
-    m_ZMQContext = zmq_ctx_new();
-    m_ZMQPubSubSocket = zmq_socket(m_ZMQContext, ZMQ_SUB);
+    // Subscribe to the Server PUB-SUB channel. The objects are fetched by cpdk::Runtime::Start(), along
+    // with those of every other registered manager.
+    cpdk::Runtime::GetInstance().Register(this);
+
+} // end of ServerMgr::Register()
 
-    // Subscribe to the Server PUB-SUB channel
-    zmq_setsockopt(m_ZMQPubSubSocket, ZMQ_SUBSCRIBE, "[\"Server\"", strlen("[\"Server\""));
-    zmq_connect(m_ZMQPubSubSocket, "tcp://localhost:5744");
+void ServerMgr::Init(Server_Create create_cb, Server_Delete delete_cb, void *pData) {
+
+    Register(create_cb, delete_cb, pData);
 
-    // Subscribe to the client-server socket
-    m_ZMQClientSocket = zmq_socket(m_ZMQContext, ZMQ_REQ);
-    zmq_connect(m_ZMQClientSocket, "tcp://localhost:5279");
+    // Fetch all of the objects this manager cares about, and those of any manager registered before it
+    cpdk::Runtime::GetInstance().Start();
 
-    // Fetch all of the objects this manager cares about
+} // end of ServerMgr::Init()
+
+void ServerMgr::LoadAll(void) {
     json j;
     j["t"] = "list";
     j["o"] = "Server";
-    std::string j_msg = j.dump();
-    zmq_send(m_ZMQClientSocket, j_msg.c_str(), strlen(j_msg.c_str()), 0);
-
-    zmq_msg_t msg;
-    zmq_msg_init(&msg);
+    j["limit"] = 1000;
 
-    int msgLen = zmq_recvmsg(m_ZMQClientSocket, &msg, 0);
-    if(msgLen == -1)
-        // TODO: Something more meaningful
-        throw "oops";
+    json j2 = SendClientMessage(j);
+    LoadSnapshot(j2, j2["revision"]);
+} // end of ServerMgr::LoadAll()
 
-    std::string recvBuffer((char *)zmq_msg_data(&msg), msgLen);
-    json j2 = json::parse(recvBuffer.c_str());
+void ServerMgr::LoadSnapshot(json &page, uint64_t revision) {
+    // Changes committed while paging may already be included, and will be applied again when they're published
+    m_Revision = revision;
+    m_Epoch = cpdk::Runtime::GetInstance().GetEpoch();
+    LoadObjects(page["result"]);
 
-    if(j2["status"] != "ok")
-        // TODO: Needs a custom exception
-        throw "list command failed";
+    // Fetch the rest of the objects one page at a time. The last page comes without a cursor.
+    json j;
+    j["t"] = "list";
+    j["o"] = "Server";
+    j["limit"] = 1000;
+
+    json cursor = page.find("cursor") != page.end() ? page["cursor"] : json();
+    while(!cursor.is_null()) {
+        j["cursor"] = cursor;
+        json j2 = SendClientMessage(j);
+        LoadObjects(j2["result"]);
+        cursor = j2.find("cursor") != j2.end() ? j2["cursor"] : json();
+    }
+} // end of ServerMgr::LoadSnapshot()
 
-    for(auto &obj : j2["result"]) {
+void ServerMgr::LoadObjects(json &objects) {
+    for(auto &obj : objects) {
         Server *pObj = m_CreateCallback(obj["name"], m_pCallbackData);
         m_InstanceMap[obj["name"]] = pObj;
 
         for (json::iterator it = obj.begin(); it != obj.end(); ++it) {
-            std::string field = it.key();
+            uint32_t fid = cpdk::FieldId(it.key());
             auto value = it.value();
 
             if(value.is_null())
                 continue;
-if(field == "id") {
+switch(fid) {
+case Server::FIELD_id:
     pObj->on_id(value);
-} else if(field == "name") {
+    break;
+case Server::FIELD_name:
     pObj->on_name(value);
-} else if(field == "address") {
+    break;
+case Server::FIELD_address:
     pObj->on_address(value);
-} else if(field == "port") {
+    break;
+case Server::FIELD_port:
     pObj->on_port(value);
-} else if(field == "enabled") {
+    break;
+case Server::FIELD_enabled:
     pObj->on_enabled(value);
-} 
+    break;
+case Server::FIELD_weight:
+    pObj->on_weight(value);
+    break;
+default:
+    break;
+}
 
-if(field == "virtual_servers") {
+switch(fid) {
+case Server::FIELD_virtual_servers:
    for(auto &obj : value) {
       pObj->on_add_VirtualServer(obj);
    }
+   break;
+default:
+    break;
 }
 
         }
+
+        if(!m_SnapshotFile.empty()) {
+            std::string name = obj["name"];
+            m_State[name] = std::move(obj);
+        }
+    }
+} // end of ServerMgr::LoadObjects()
+
+uint64_t ServerMgr::ReadSnapshot(void) {
+    json snapshot;
+    if(m_SnapshotFile.empty() || !cpdk::ReadSnapshotFile(m_SnapshotFile, snapshot))
+        return 0;
+
+    // Snapshots written by a header generated from another model, template or settings can't be trusted
+    if(snapshot["tag"] != "d58b87a04ad14df992de2475fdf2676633495fef" || !snapshot["revision"].is_number_unsigned())
+        return 0;
+
+    m_Revision = snapshot["revision"];
+    m_Epoch = snapshot["epoch"].is_string() ? snapshot["epoch"].get<std::string>() : "";
+    for(auto &obj : snapshot["objects"]) {
+        std::string name = obj["name"];
+        m_State[name] = std::move(obj);
+    }
+    return m_Revision;
+} // end of ServerMgr::ReadSnapshot()
+
+void ServerMgr::ResumeSnapshot(json &changes) {
+    // The saved objects are only any use if CPDKd still has every change made to the same database since
+    if(changes["status"] != "ok" || changes.find("resync") != changes.end() ||
+       m_Epoch != cpdk::Runtime::GetInstance().GetEpoch()) {
+        m_State.clear();
+        LoadAll();
+        return;
     }
 
+    json objects = json::array();
+    for(auto &it : m_State)
+        objects.push_back(std::move(it.second));
+    m_State.clear();
+    LoadObjects(objects);
 
-} // end of ServerMgr::Init()
+    for(auto &change : changes["changes"]) {
+        ApplyEvent(change.at(1));
+    }
+    m_Revision = std::max(m_Revision, changes["revision"].get<uint64_t>());
+} // end of ServerMgr::ResumeSnapshot()
+
+bool ServerMgr::SaveSnapshot(void) {
+    if(m_SnapshotFile.empty() || m_Epoch.empty())
+        return false;
+
+    json snapshot;
+    snapshot["tag"] = "d58b87a04ad14df992de2475fdf2676633495fef";
+    snapshot["epoch"] = m_Epoch;
+    snapshot["revision"] = m_Revision;
+    snapshot["objects"] = json::array();
+    for(auto &it : m_State)
+        snapshot["objects"].push_back(it.second);
+
+    return cpdk::WriteSnapshotFile(m_SnapshotFile, snapshot);
+} // end of ServerMgr::SaveSnapshot()
+
+void ServerMgr::Resync(void) {
+    // Catch up on the changes committed since the last one applied
+    json j;
+    j["t"] = "changes_since";
+    j["o"] = "Server";
+    j["rev"] = m_Revision;
+    json j2 = SendClientMessage(j);
+
+    if(j2.find("resync") != j2.end()) {
+        // CPDKd no longer has all of the changes, so start over
+        for(auto &it : m_InstanceMap) {
+            m_DeleteCallback(it.second, NULL);
+        }
+        m_InstanceMap.clear();
+        m_State.clear();
+        LoadAll();
+        return;
+    }
+
+    for(auto &change : j2["changes"]) {
+        ApplyEvent(change.at(1));
+    }
+    m_Revision = std::max(m_Revision, j2["revision"].get<uint64_t>());
+} // end of ServerMgr::Resync()
 
 void ServerMgr::Cleanup(void) {
-    zmq_close(m_ZMQPubSubSocket);
-    zmq_close(m_ZMQClientSocket);
-    zmq_ctx_destroy(m_ZMQContext);
+    // Save the objects for the next run, if there's a snapshot file
+    SaveSnapshot();
+
+    // The shared sockets are closed along with the last manager
+    cpdk::Runtime::GetInstance().Unregister(this);
 } // end of ServerMgr::Cleanup()
 
 void ServerMgr::DeleteAll(void) {
-    json j;
-    j["t"] = "delete_all";
-    j["o"] = "Server";
+    json j = DeleteAllMessage();
     SendClientMessage(j);
 
     // Note: No actual deletes will occur here.
@@ -178,11 +344,7 @@ void ServerMgr::DeleteAll(void) {
 } // end of void ServerMgr::DeleteAll()
 
 void ServerMgr::Create(std::string objectName) {
-    json j;
-    j["t"] = "create";
-    j["o"] = "Server";
-    j["on"] = objectName;
-
+    json j = CreateMessage(objectName);
     SendClientMessage(j);
 
     // Note: No actual creates will occur here.
@@ -190,86 +352,124 @@ void ServerMgr::Create(std::string objectName) {
 
 } // end of ServerMgr::Create()
 
-json ServerMgr::SendClientMessage(json &j) {
+void ServerMgr::DeleteAllAsync(cpdk::Callback cb) {
+    json j = DeleteAllMessage();
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of ServerMgr::DeleteAllAsync()
 
-    int msgLen;
-    zmq_msg_t msg;
-    json jResponse;
-    std::string j_msg;
+void ServerMgr::CreateAsync(std::string objectName, cpdk::Callback cb) {
+    json j = CreateMessage(objectName);
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of ServerMgr::CreateAsync()
 
-    j_msg = j.dump();
-    zmq_msg_init(&msg);
-
-    zmq_send(m_ZMQClientSocket, j_msg.c_str(), strlen(j_msg.c_str()), 0);
-    msgLen = zmq_recvmsg(m_ZMQClientSocket, &msg, 0);
-    if(msgLen == -1)
-        // TODO: Something more meaningful
-        throw "oops";
+json ServerMgr::DeleteAllMessage(void) {
+    json j;
+    j["t"] = "delete_all";
+    j["o"] = "Server";
+    return j;
+} // end of ServerMgr::DeleteAllMessage()
 
-    std::string recvBuffer((char *)zmq_msg_data(&msg), msgLen);
-    jResponse = json::parse(recvBuffer.c_str());
-    if(jResponse["status"] != "ok")
-        // TODO: Needs a custom exception
-        throw "list command failed";
+json ServerMgr::CreateMessage(std::string objectName) {
+    json j;
+    j["t"] = "create";
+    j["o"] = "Server";
+    j["on"] = objectName;
+    return j;
+} // end of ServerMgr::CreateMessage()
 
-    return jResponse;
+json ServerMgr::SendClientMessage(json &j) {
+    return cpdk::Runtime::GetInstance().Request(j);
 } // end of ServerMgr::SendClientMessage()
 
-void ServerMgr::UpdateField(std::string objectName, std::string fieldName, std::string val) {
+template<typename T> json ServerMgr::ModifyMessage(std::string objectName, std::string fieldName, T val) {
     json j;
     j["t"] = "modify";
     j["o"] = "Server";
     j["on"] = objectName;
     j["f"] = fieldName;
     j["fv"] = val;
+    return j;
+} // end of ServerMgr::ModifyMessage()
 
+void ServerMgr::UpdateField(std::string objectName, std::string fieldName, std::string val) {
+    json j = ModifyMessage(objectName, fieldName, val);
     SendClientMessage(j);
 } // end of ServerMgr::UpdateField()
 
 void ServerMgr::UpdateField(std::string objectName, std::string fieldName, uint64_t val) {
-    json j;
-    j["t"] = "modify";
-    j["o"] = "Server";
-    j["on"] = objectName;
-    j["f"] = fieldName;
-    j["fv"] = val;
-
+    json j = ModifyMessage(objectName, fieldName, val);
     SendClientMessage(j);
 } // end of ServerMgr::UpdateField()
 
 void ServerMgr::UpdateField(std::string objectName, std::string fieldName, bool val) {
-    json j;
-    j["t"] = "modify";
-    j["o"] = "Server";
-    j["on"] = objectName;
-    j["f"] = fieldName;
-    j["fv"] = val;
-
+    json j = ModifyMessage(objectName, fieldName, val);
     SendClientMessage(j);
 } // end of ServerMgr::UpdateField()
 
+void ServerMgr::UpdateFieldAsync(std::string objectName, std::string fieldName, std::string val,
+                                          cpdk::Callback cb) {
+    json j = ModifyMessage(objectName, fieldName, val);
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of ServerMgr::UpdateFieldAsync()
+
+void ServerMgr::UpdateFieldAsync(std::string objectName, std::string fieldName, uint64_t val,
+                                          cpdk::Callback cb) {
+    json j = ModifyMessage(objectName, fieldName, val);
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of ServerMgr::UpdateFieldAsync()
+
+void ServerMgr::UpdateFieldAsync(std::string objectName, std::string fieldName, bool val,
+                                          cpdk::Callback cb) {
+    json j = ModifyMessage(objectName, fieldName, val);
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of ServerMgr::UpdateFieldAsync()
+
+int ServerMgr::ProcessMessageQueue(int budget) {
+    // The events of every model arrive on the same socket, so this applies those of the other managers too
+    return cpdk::Runtime::GetInstance().ProcessMessageQueue(budget);
+} // end of ServerMgr::ProcessMessageQueue()
+
+int ServerMgr::GetFD(void) {
+    return cpdk::Runtime::GetInstance().GetFD();
+} // end of ServerMgr::GetFD()
+
+bool ServerMgr::HasPending(void) {
+    return cpdk::Runtime::GetInstance().HasPending();
+} // end of ServerMgr::HasPending()
+
+void ServerMgr::OnEvent(json &data) {
+    uint64_t revision = data["rev"];
+    uint64_t previous = data["prev"];
+
+    // Already applied, either from the initial fetch or a resync
+    if(revision <= m_Revision)
+        return;
 
-void ServerMgr::ProcessMessageQueue(void) {
-    zmq_msg_t msg;
-    zmq_msg_init(&msg);
-
-    // Process any messages from the PUB-SUB socket
-    int msg_len = zmq_recvmsg(m_ZMQPubSubSocket, &msg, ZMQ_DONTWAIT);
-    if( msg_len == -1)
+    // The previous change to this model never arrived. Resync() fetches it, along with this one.
+    if(previous > m_Revision) {
+        Resync();
         return;
+    }
 
-    std::string recvBuffer((char *)zmq_msg_data(&msg), msg_len);
-    json j = json::parse((char *)recvBuffer.c_str());
-    json data = j.at(1);
+    // A reload fetches every object again, at a newer revision than its own
+    ApplyEvent(data);
+    m_Revision = std::max(m_Revision, revision);
+} // end of ServerMgr::OnEvent()
 
+void ServerMgr::ApplyEvent(json &data) {
     std::string objName = "";
     if(data.find("obj") != data.end())   // Optional for messages like "DELETE_ALL"
         objName = data["obj"];
 
     int id = data["type"];
 
+    if(!m_SnapshotFile.empty())
+        RecordEvent(data);
+
     switch(id) {
         case MSG_TYPE_CREATE: {
+            if(m_InstanceMap.find(objName) != m_InstanceMap.end())
+                break;  // Already fetched
             m_InstanceMap[objName] = m_CreateCallback(objName, NULL);
         } break;
         case MSG_TYPE_DELETE: {
@@ -286,26 +486,45 @@ void ServerMgr::ProcessMessageQueue(void) {
             }
             m_InstanceMap.clear();
         } break;
+        case MSG_TYPE_RELOAD: {
+            // Every object was replaced at once, so fetch them all again
+            for(auto &it : m_InstanceMap) {
+                m_DeleteCallback(it.second, NULL);
+            }
+            m_InstanceMap.clear();
+            LoadAll();
+        } break;
         case MSG_TYPE_MODIFY: {
             ObjMap::iterator it = m_InstanceMap.find(objName);
             if(it == m_InstanceMap.end())
                 break;
 
             Server *pObj = m_InstanceMap[objName];
-            std::string field = data["field"];
+            uint32_t fid = cpdk::EventFieldId(data);
             auto value = data["value"];
 
-if(field == "id") {
+switch(fid) {
+case Server::FIELD_id:
     pObj->on_id(value);
-} else if(field == "name") {
+    break;
+case Server::FIELD_name:
     pObj->on_name(value);
-} else if(field == "address") {
+    break;
+case Server::FIELD_address:
     pObj->on_address(value);
-} else if(field == "port") {
+    break;
+case Server::FIELD_port:
     pObj->on_port(value);
-} else if(field == "enabled") {
+    break;
+case Server::FIELD_enabled:
     pObj->on_enabled(value);
-} 
+    break;
+case Server::FIELD_weight:
+    pObj->on_weight(value);
+    break;
+default:
+    break;
+}
 
         } break;
         case MSG_TYPE_ADD_REF: {
@@ -313,11 +532,15 @@ if(field == "id") {
             assert(it != m_InstanceMap.end());
 
             Server *pObj = it->second;
-            std::string field = data["field"];
+            uint32_t fid = cpdk::EventFieldId(data);
             auto value = data["value"];
 
-            if(field == "VirtualServer") {
+            switch(fid) {
+case Server::REF_VirtualServer:
     pObj->on_add_VirtualServer(value);
+    break;
+default:
+    break;
 }
 
             (void)pObj; // Prevent compiler warnings
@@ -327,11 +550,15 @@ if(field == "id") {
             assert(it != m_InstanceMap.end());
 
             Server *pObj = it->second;
-            std::string field = data["field"];
+            uint32_t fid = cpdk::EventFieldId(data);
             auto value = data["value"];
 
-            if(field == "VirtualServer") {
+            switch(fid) {
+case Server::REF_VirtualServer:
     pObj->on_remove_VirtualServer(value);
+    break;
+default:
+    break;
 }
 
             (void)pObj; // Prevent compiler warnings
@@ -339,4 +566,58 @@ if(field == "id") {
         default:
         throw "Unknown message type";
     }
-} // end of ServerMgr::ProcessMessageQueue()
\ No newline at end of file
+} // end of ServerMgr::ApplyEvent()
+
+void ServerMgr::RecordEvent(json &data) {
+    // Keep m_State the same as what CPDKd would list now
+    std::string objName = data.find("obj") != data.end() ? data["obj"].get<std::string>() : "";
+
+    switch(data["type"].get<int>()) {
+        case MSG_TYPE_CREATE: {
+            if(m_State.find(objName) == m_State.end())
+                m_State[objName]["name"] = objName;
+        } break;
+        case MSG_TYPE_DELETE:
+            m_State.erase(objName);
+            break;
+        case MSG_TYPE_DELETE_ALL:
+        case MSG_TYPE_RELOAD:
+            // Reloads list every object again
+            m_State.clear();
+            break;
+        case MSG_TYPE_MODIFY: {
+            StateMap::iterator it = m_State.find(objName);
+            if(it != m_State.end())
+                it->second[data["field"].get<std::string>()] = data["value"];
+        } break;
+        case MSG_TYPE_ADD_REF:
+        case MSG_TYPE_DELETE_REF: {
+            StateMap::iterator it = m_State.find(objName);
+            const char *key = ReferenceKey(cpdk::EventFieldId(data));
+            if(it == m_State.end() || key == NULL)
+                break;
+
+            // The same change may be applied twice, once from a snapshot and once when it's published
+            json &names = it->second[key];
+            if(!names.is_array())
+                names = json::array();
+            json::iterator name = std::find(names.begin(), names.end(), data["value"]);
+            if(data["type"] == MSG_TYPE_DELETE_REF && name != names.end())
+                names.erase(name);
+            else if(data["type"] == MSG_TYPE_ADD_REF && name == names.end())
+                names.push_back(data["value"]);
+        } break;
+    }
+} // end of ServerMgr::RecordEvent()
+
+const char * ServerMgr::ReferenceKey(uint32_t fid) {
+    // Reference events name the referenced class, the objects are listed with the name of the relationship
+switch(fid) {
+case Server::REF_VirtualServer:
+    return "virtual_servers";
+default:
+    break;
+}
+
+    return NULL;
+} // end of ServerMgr::ReferenceKey()
@@ -3,6 +3,7 @@
 #include "Interface.h"
 #include <unistd.h>
 #include <signal.h>
+#include <poll.h>
 
 class MyVirtual : public VirtualServer {
 public:
@@ -67,10 +68,11 @@ int main(void) {
     // Register a signal handler to process ctrl-c
     signal(SIGINT, sig_handler);
 
-    // Initialize our object managers
-    ServerMgr::GetInstance().Init(CreateCallback, DeleteCallback, NULL);
-    VirtualServerMgr::GetInstance().Init(CreateVirtualCallback, DeleteVirtualCallback, NULL);
-    InterfaceMgr::GetInstance().Init(CreateInterfaceCB, DeleteInterfaceCB, NULL);
+    // Register our object managers, then fetch all of their objects with a single request
+    ServerMgr::GetInstance().Register(CreateCallback, DeleteCallback, NULL);
+    VirtualServerMgr::GetInstance().Register(CreateVirtualCallback, DeleteVirtualCallback, NULL);
+    InterfaceMgr::GetInstance().Register(CreateInterfaceCB, DeleteInterfaceCB, NULL);
+    cpdk::Runtime::GetInstance().Start();
 
     // Delete any existing interface objectsin the database
     InterfaceMgr::GetInstance().DeleteAll();
@@ -81,11 +83,19 @@ int main(void) {
     InterfaceMgr::GetInstance().UpdateField("eth12", "packets_out", uint64_t(456));
     InterfaceMgr::GetInstance().UpdateField("eth12", "enabled", true);
 
+    // The events of every manager arrive on one socket. Wait on it along with anything else the daemon polls.
+    cpdk::Runtime &runtime = cpdk::Runtime::GetInstance();
+    struct pollfd fds[1];
+    fds[0].fd = runtime.GetFD();
+    fds[0].events = POLLIN;
+
     // Enter the main message processing loop
     while(is_running) {
-        ServerMgr::GetInstance().ProcessMessageQueue();
-        VirtualServerMgr::GetInstance().ProcessMessageQueue();
-        InterfaceMgr::GetInstance().ProcessMessageQueue();
+        // The socket only becomes readable when new events arrive, so only wait once every queued event is applied
+        if(!runtime.HasPending())
+            poll(fds, 1, 1000);
+
+        runtime.ProcessMessageQueue();
     }
 
     std::cout << "exiting..." << std::endl;
@@ -93,7 +103,7 @@ int main(void) {
     // Delete any daemon-managed objects.
     InterfaceMgr::GetInstance().DeleteAll();
 
-    // Allow the object managers to cleanup
+    // Allow the object managers to cleanup. The last one closes the connection to CPDKd.
     ServerMgr::GetInstance().Cleanup();
     VirtualServerMgr::GetInstance().Cleanup();
     InterfaceMgr::GetInstance().Cleanup();
@@ -1,6 +1,6 @@
 from cpdk_db import CPDKModel
 from sqlalchemy.orm import relationship
-from sqlalchemy import Integer, Column, String, Boolean, BigInteger, Table, ForeignKey
+from sqlalchemy import Integer, Column, String, Boolean, BigInteger, Numeric, Table, ForeignKey
 
 
 class Interface(CPDKModel):
@@ -8,9 +8,11 @@ class Interface(CPDKModel):
                      info={'negative_cmd': 'disabled'})
 
     packets_out = Column(BigInteger, default=0,
-                         info={'display_only': True})  # No CLI command will be generated
+                         info={'display_only': True,    # No CLI command will be generated
+                               'conflate': True})       # Only the latest count is committed, once per interval
     packets_in = Column(BigInteger, default=0,
-                        info={'display_only': True})    # No CLI command will be generated
+                        info={'display_only': True,     # No CLI command will be generated
+                              'conflate': True})        # Only the latest count is committed, once per interval
 
     display_name = 'port'     # The string used in the CLI to enter the mode
     daemon_managed = True     # This model can only be created/deleted by daemons
@@ -23,9 +25,11 @@ Server_VS_Map = Table('Server_VS_Map',
 
 
 class Server(CPDKModel):
-    address = Column(String)
+    address = Column(String,
+                     info={'index': True})    # Servers can be listed by address
     port = Column(Integer)
     enabled = Column(Boolean)
+    weight = Column(Numeric(6, 2))    # Share of the traffic, relative to the other servers
     virtual_servers = relationship('VirtualServer',
                                    secondary=Server_VS_Map)
 
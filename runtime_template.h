@@ -0,0 +1,525 @@
+#ifndef CPDK_RUNTIME_H
+#define CPDK_RUNTIME_H
+
+// 3rd party requirements
+#include "zmq.h"
+#include "json.hpp"
+#include "cpdk_codec.h"
+
+// Standard libraries
+#include <stdio.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <string>
+#include <vector>
+#include <utility>
+#include <algorithm>
+#include <functional>
+#include <unordered_map>
+
+namespace cpdk {
+
+// The ID of the field an event is about. Events logged before CPDKd sent IDs only have the name.
+inline uint32_t EventFieldId(nlohmann::json &data) {
+    nlohmann::json::iterator it = data.find("fid");
+    if(it != data.end())
+        return it->get<uint32_t>();
+    return FieldId(data["field"]);
+}
+
+// Called with CPDKd's reply to an asynchronous request
+typedef std::function<void(nlohmann::json &reply)> Callback;
+
+// Write a snapshot file. It's written under another name and renamed over the old one, so a crash part way through
+// never leaves a torn file behind. Returns false if it couldn't be written.
+inline bool WriteSnapshotFile(const std::string &path, const nlohmann::json &snapshot) {
+    std::string data;
+    PackMsgPack(data, snapshot);
+
+    std::string tmpPath = path + ".tmp";
+    FILE *fp = fopen(tmpPath.c_str(), "wb");
+    if(fp == NULL)
+        return false;
+
+    bool ok = fwrite(data.data(), 1, data.size(), fp) == data.size();
+    ok = fclose(fp) == 0 && ok;
+    if(!ok || rename(tmpPath.c_str(), path.c_str()) != 0) {
+        unlink(tmpPath.c_str());
+        return false;
+    }
+    return true;
+} // end of WriteSnapshotFile()
+
+// Read a snapshot file. It's mapped rather than read, so it's decoded straight from the page cache. Returns false if
+// it doesn't exist or can't be decoded.
+inline bool ReadSnapshotFile(const std::string &path, nlohmann::json &snapshot) {
+    int fd = open(path.c_str(), O_RDONLY);
+    if(fd == -1)
+        return false;
+
+    struct stat st;
+    if(fstat(fd, &st) != 0 || st.st_size == 0) {
+        close(fd);
+        return false;
+    }
+
+    void *pData = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if(pData == MAP_FAILED)
+        return false;
+
+    bool ok = true;
+    try {
+        const unsigned char *p = (const unsigned char *)pData;
+        snapshot = UnpackMsgPack(p, p + st.st_size);
+    } catch(std::exception &e) {
+        ok = false;
+    }
+    munmap(pData, st.st_size);
+    return ok && snapshot.is_object();
+} // end of ReadSnapshotFile()
+
+// Implemented by every generated object manager
+class Subscriber {
+public:
+    virtual ~Subscriber() {}
+
+    // Name of the model the manager is for
+    virtual const char * ModelName(void) = 0;
+
+    // Load the objects of the model from the first page of a 'list' response, along with the revision it was fetched
+    // at. The rest of the pages are fetched by the manager.
+    virtual void LoadSnapshot(nlohmann::json &page, uint64_t revision) = 0;
+
+    // Apply a PUB-SUB event published for the model
+    virtual void OnEvent(nlohmann::json &data) = 0;
+
+    // Read the objects saved by an earlier run, without creating them yet. Returns the revision they were saved at,
+    // or 0 if there's nothing to resume from and the objects have to be listed.
+    virtual uint64_t ReadSnapshot(void) { return 0; }
+
+    // Create the objects read by ReadSnapshot(), and apply the changes made since, from a 'changes_since' response.
+    // If the response is an error, a resync, or comes from another database, every object is listed instead.
+    virtual void ResumeSnapshot(nlohmann::json &changes) {}
+};
+
+// The connection to CPDKd shared by all of the object managers in a daemon: one ZMQ context, one SUB socket
+// subscribed to the topics of every registered model, and one DEALER socket for requests.
+class Runtime {
+public:
+
+    static Runtime & GetInstance() {
+        static Runtime s_Instance;
+        return s_Instance;
+    }
+
+    void Register(Subscriber *pSubscriber);
+    void Unregister(Subscriber *pSubscriber);
+    void Start(void);
+    void Cleanup(void);
+    nlohmann::json Request(nlohmann::json &j);
+    void Send(nlohmann::json &j, Callback cb = nullptr);
+    void Queue(nlohmann::json &op, Callback cb = nullptr);
+    void Flush(void);
+    void Wait(void);
+    int ProcessMessageQueue(int budget = {{ C_EVENT_BUDGET }});
+    int GetFD(void);
+    int GetReplyFD(void);
+    bool HasPending(void);
+    const std::string & GetEpoch(void) { return m_Epoch; }
+
+private:
+    // A request waiting for its reply
+    struct PendingRequest {
+        PendingRequest() : batch(false), sync(false), done(false) {}
+
+        // The callback of the request, or of each operation of a batch
+        std::vector<Callback> callbacks;
+        bool batch;
+
+        // Synchronous requests keep their reply here, for Request() to pick up
+        bool sync;
+        bool done;
+        nlohmann::json reply;
+    };
+
+    void * m_ZMQPubSubSocket;
+    void * m_ZMQClientSocket;
+    void * m_ZMQContext;
+
+    typedef std::unordered_map<std::string, Subscriber *> SubscriberMap;
+    SubscriberMap m_Subscribers;
+
+    // Registered, but without a snapshot yet
+    std::vector<Subscriber *> m_Pending;
+
+    // Epoch of the database CPDKd last replied about
+    std::string m_Epoch;
+
+    // Requests sent, by request ID
+    typedef std::unordered_map<uint64_t, PendingRequest> RequestMap;
+    RequestMap m_InFlight;
+    uint64_t m_NextRequestId;
+
+    // Operations queued for the next batch, and their callbacks
+    nlohmann::json m_Batch;
+    std::vector<Callback> m_BatchCallbacks;
+
+    void Connect(void);
+    uint64_t SendRequest(nlohmann::json &j, PendingRequest &request);
+    bool ReceiveReply(int flags);
+    bool IsBusy(void);
+
+protected:
+    // Constructors (hidden for singleton-only access)
+    Runtime() : m_ZMQPubSubSocket(NULL), m_ZMQClientSocket(NULL), m_ZMQContext(NULL), m_NextRequestId(1),
+                m_Batch(nlohmann::json::array()) {};
+    Runtime(Runtime const &);
+    void operator=(Runtime const&);
+};
+
+inline void Runtime::Connect(void) {
+    m_ZMQContext = zmq_ctx_new();
+
+    // Topics are subscribed to as the managers register
+    m_ZMQPubSubSocket = zmq_socket(m_ZMQContext, ZMQ_SUB);
+    zmq_connect(m_ZMQPubSubSocket, "tcp://localhost:{{ ZMQ_PUBSUB_PORT }}");
+
+    // A DEALER rather than a REQ socket, so more than one request can be waiting for its reply
+    m_ZMQClientSocket = zmq_socket(m_ZMQContext, ZMQ_DEALER);
+    zmq_connect(m_ZMQClientSocket, "tcp://localhost:{{ ZMQ_CLIENT_SERVER_PORT }}");
+} // end of Runtime::Connect()
+
+inline void Runtime::Register(Subscriber *pSubscriber) {
+    if(m_ZMQContext == NULL)
+        Connect();
+
+    std::string model = pSubscriber->ModelName();
+    if(m_Subscribers.find(model) != m_Subscribers.end())
+        return;
+
+    // The topic of every event of the model is its name, followed by a NUL. Subscribing before the snapshot is
+    // fetched means no event is lost in between; the ones already in the snapshot are skipped by their revision.
+    zmq_setsockopt(m_ZMQPubSubSocket, ZMQ_SUBSCRIBE, model.c_str(), model.size() + 1);
+    m_Subscribers[model] = pSubscriber;
+    m_Pending.push_back(pSubscriber);
+} // end of Runtime::Register()
+
+inline void Runtime::Unregister(Subscriber *pSubscriber) {
+    std::string model = pSubscriber->ModelName();
+    SubscriberMap::iterator it = m_Subscribers.find(model);
+    if(it == m_Subscribers.end())
+        return;
+
+    zmq_setsockopt(m_ZMQPubSubSocket, ZMQ_UNSUBSCRIBE, model.c_str(), model.size() + 1);
+    m_Subscribers.erase(it);
+    for(std::vector<Subscriber *>::iterator p = m_Pending.begin(); p != m_Pending.end(); ++p) {
+        if(*p == pSubscriber) {
+            m_Pending.erase(p);
+            break;
+        }
+    }
+
+    // The last manager out closes the connection
+    if(m_Subscribers.empty())
+        Cleanup();
+} // end of Runtime::Unregister()
+
+inline void Runtime::Start(void) {
+    if(m_Pending.empty())
+        return;
+
+    // Fetch the first page of every registered model in a single batch, so they're all read in the same transaction
+    // and at the same revision. Managers which saved their objects in an earlier run only ask for what has changed
+    // since.
+    nlohmann::json j;
+    j["t"] = "batch";
+    j["ops"] = nlohmann::json::array();
+    std::vector<bool> resumed;
+    for(auto pSubscriber : m_Pending) {
+        nlohmann::json op;
+        op["o"] = pSubscriber->ModelName();
+
+        uint64_t revision = pSubscriber->ReadSnapshot();
+        resumed.push_back(revision != 0);
+        if(revision) {
+            op["t"] = "changes_since";
+            op["rev"] = revision;
+        } else {
+            op["t"] = "list";
+            op["limit"] = {{ C_LIST_PAGE_SIZE }};
+        }
+        j["ops"].push_back(op);
+    }
+
+    nlohmann::json j2;
+    Send(j, [&j2](nlohmann::json &reply) { j2 = std::move(reply); });
+    Wait();
+
+    std::vector<Subscriber *> pending;
+    pending.swap(m_Pending);
+
+    if(j2["status"] != "ok") {
+        if(std::find(resumed.begin(), resumed.end(), true) == resumed.end())
+            // TODO: Needs a custom exception
+            throw "list command failed";
+
+        // CPDKd can't tell what has changed, most likely because its change log is disabled. The managers which
+        // saved their objects list them instead, and the others are fetched again in a batch of their own.
+        for(size_t x = 0; x < pending.size(); x++) {
+            if(resumed[x])
+                pending[x]->ResumeSnapshot(j2);
+            else
+                m_Pending.push_back(pending[x]);
+        }
+        Start();
+        return;
+    }
+
+    uint64_t revision = j2["revision"];
+    for(size_t x = 0; x < pending.size(); x++) {
+        if(resumed[x])
+            pending[x]->ResumeSnapshot(j2["results"][x]);
+        else
+            pending[x]->LoadSnapshot(j2["results"][x], revision);
+    }
+} // end of Runtime::Start()
+
+inline void Runtime::Cleanup(void) {
+    if(m_ZMQContext == NULL)
+        return;
+
+    // Don't lose any writes which haven't been applied yet
+    Wait();
+
+    zmq_close(m_ZMQPubSubSocket);
+    zmq_close(m_ZMQClientSocket);
+    zmq_ctx_destroy(m_ZMQContext);
+    m_ZMQPubSubSocket = m_ZMQClientSocket = m_ZMQContext = NULL;
+    m_Subscribers.clear();
+    m_Pending.clear();
+    m_InFlight.clear();
+} // end of Runtime::Cleanup()
+
+inline nlohmann::json Runtime::Request(nlohmann::json &j) {
+    // Send a request, and wait for its reply. Anything queued was written first, so it's sent first.
+    Flush();
+
+    PendingRequest request;
+    request.sync = true;
+    uint64_t id = SendRequest(j, request);
+
+    // Replies to asynchronous requests sent earlier are handled while waiting
+    RequestMap::iterator it;
+    while(!(it = m_InFlight.find(id))->second.done)
+        ReceiveReply(0);
+
+    nlohmann::json jResponse = it->second.reply;
+    m_InFlight.erase(it);
+    if(jResponse["status"] != "ok")
+        // TODO: Needs a custom exception
+        throw "list command failed";
+
+    return jResponse;
+} // end of Runtime::Request()
+
+inline void Runtime::Send(nlohmann::json &j, Callback cb) {
+    // Send a request without waiting for its reply. The callback is called with the reply, from
+    // ProcessMessageQueue(), Wait() or Request(), whichever is called once the reply has arrived.
+    PendingRequest request;
+    request.callbacks.push_back(cb);
+    SendRequest(j, request);
+} // end of Runtime::Send()
+
+inline void Runtime::Queue(nlohmann::json &op, Callback cb) {
+    // Add an operation to the next batch. Batches are sent by Flush(), or as soon as they're full.
+    m_Batch.push_back(op);
+    m_BatchCallbacks.push_back(cb);
+    if(m_BatchCallbacks.size() >= {{ C_WRITE_BATCH_SIZE }})
+        Flush();
+} // end of Runtime::Queue()
+
+inline void Runtime::Flush(void) {
+    // Send the queued operations as a single batch, without waiting for the reply. CPDKd applies the batch in one
+    // transaction: if any of its operations fails, none of them are applied, and every callback gets the error.
+    if(m_BatchCallbacks.empty())
+        return;
+
+    nlohmann::json j;
+    j["t"] = "batch";
+    j["ops"] = nlohmann::json::array();
+    j["ops"].swap(m_Batch);
+
+    PendingRequest request;
+    request.batch = true;
+    request.callbacks.swap(m_BatchCallbacks);
+    SendRequest(j, request);
+} // end of Runtime::Flush()
+
+inline void Runtime::Wait(void) {
+    // Flush the queued operations, and wait for the replies to every asynchronous request
+    Flush();
+    while(IsBusy())
+        ReceiveReply(0);
+} // end of Runtime::Wait()
+
+inline bool Runtime::IsBusy(void) {
+    for(auto &it : m_InFlight) {
+        if(!it.second.done)
+            return true;
+    }
+    return false;
+} // end of Runtime::IsBusy()
+
+inline uint64_t Runtime::SendRequest(nlohmann::json &j, PendingRequest &request) {
+    // CPDKd drops the replies a client doesn't read, so don't let more than {{ C_MAX_IN_FLIGHT }} requests pile up
+    while(m_InFlight.size() >= {{ C_MAX_IN_FLIGHT }})
+        ReceiveReply(0);
+
+    // MessagePack messages may contain NUL bytes, so always go by the length
+    std::string j_msg = Encode(j, {{ ZMQ_CLIENT_SERVER_ENCODING }});
+
+    // The request ID goes ahead of the empty delimiter frame. CPDKd sends these frames back with the reply.
+    uint64_t id = m_NextRequestId++;
+    zmq_send(m_ZMQClientSocket, &id, sizeof(id), ZMQ_SNDMORE);
+    zmq_send(m_ZMQClientSocket, "", 0, ZMQ_SNDMORE);
+    zmq_send(m_ZMQClientSocket, j_msg.data(), j_msg.size(), 0);
+
+    m_InFlight[id] = std::move(request);
+    return id;
+} // end of Runtime::SendRequest()
+
+inline bool Runtime::ReceiveReply(int flags) {
+    // Receive a single reply, and hand it to whatever is waiting for it. Returns false if there was nothing to
+    // receive without blocking.
+    uint64_t id = 0;
+    int idLen = zmq_recv(m_ZMQClientSocket, &id, sizeof(id), flags);
+    if(idLen == -1) {
+        if(flags & ZMQ_DONTWAIT)
+            return false;
+        // TODO: Something more meaningful
+        throw "oops";
+    }
+
+    // The reply is the last frame, after the delimiter
+    zmq_msg_t msg;
+    zmq_msg_init(&msg);
+    int msgLen;
+    do {
+        msgLen = zmq_recvmsg(m_ZMQClientSocket, &msg, 0);
+    } while(msgLen != -1 && zmq_msg_more(&msg));
+    if(msgLen == -1) {
+        zmq_msg_close(&msg);
+        throw "oops";
+    }
+
+    RequestMap::iterator it = m_InFlight.find(id);
+    if(idLen != sizeof(id) || it == m_InFlight.end()) {
+        zmq_msg_close(&msg);
+        return true;
+    }
+
+    nlohmann::json reply = Decode((char *)zmq_msg_data(&msg), msgLen);
+    zmq_msg_close(&msg);
+
+    nlohmann::json::iterator epoch = reply.find("epoch");
+    if(epoch != reply.end())
+        m_Epoch = epoch->get<std::string>();
+
+    if(it->second.sync) {
+        it->second.reply = reply;
+        it->second.done = true;
+        return true;
+    }
+
+    // The callbacks may send requests of their own, so they're called once the request is out of the map
+    PendingRequest request = std::move(it->second);
+    m_InFlight.erase(it);
+
+    bool ok = reply["status"] == "ok";
+    for(size_t x = 0; x < request.callbacks.size(); x++) {
+        if(!request.callbacks[x])
+            continue;
+        if(request.batch && ok)
+            request.callbacks[x](reply["results"][x]);
+        else
+            request.callbacks[x](reply);
+    }
+    return true;
+} // end of Runtime::ReceiveReply()
+
+inline int Runtime::ProcessMessageQueue(int budget) {
+    // Apply up to 'budget' of the queued PUB-SUB events, of every model, so a burst of them can't stall the rest of
+    // the daemon's main loop. A budget of 0 applies everything that's queued. Returns the number of events taken off
+    // the queue. The replies to asynchronous requests which have arrived are handled first.
+    while(ReceiveReply(ZMQ_DONTWAIT))
+        ;
+
+    int processed = 0;
+    while(budget <= 0 || processed < budget) {
+        zmq_msg_t msg;
+        zmq_msg_init(&msg);
+
+        // The first frame is the topic, which starts with the name of the model
+        int msg_len = zmq_recvmsg(m_ZMQPubSubSocket, &msg, ZMQ_DONTWAIT);
+        if(msg_len == -1) {
+            zmq_msg_close(&msg);
+            break;
+        }
+        processed++;
+
+        const char *pTopic = (const char *)zmq_msg_data(&msg);
+        SubscriberMap::iterator it = m_Subscribers.find(std::string(pTopic, strnlen(pTopic, msg_len)));
+
+        int more = zmq_msg_more(&msg);
+        if(more)
+            msg_len = zmq_recvmsg(m_ZMQPubSubSocket, &msg, 0);
+        if(!more || msg_len == -1 || it == m_Subscribers.end()) {
+            zmq_msg_close(&msg);
+            continue;
+        }
+
+        nlohmann::json data = Decode((char *)zmq_msg_data(&msg), msg_len);
+        zmq_msg_close(&msg);
+
+        it->second->OnEvent(data);
+    }
+    return processed;
+} // end of Runtime::ProcessMessageQueue()
+
+inline int Runtime::GetFD(void) {
+    // The descriptor of the PUB-SUB socket, for the daemon's own poll() or epoll loop. It only becomes readable when
+    // new events arrive, so check HasPending() before waiting on it: events left over from a call that ran out of
+    // budget won't wake the loop up again.
+    int fd = -1;
+    size_t fd_len = sizeof(fd);
+    zmq_getsockopt(m_ZMQPubSubSocket, ZMQ_FD, &fd, &fd_len);
+    return fd;
+} // end of Runtime::GetFD()
+
+inline int Runtime::GetReplyFD(void) {
+    // The descriptor of the request socket, which becomes readable when replies to asynchronous requests arrive
+    int fd = -1;
+    size_t fd_len = sizeof(fd);
+    zmq_getsockopt(m_ZMQClientSocket, ZMQ_FD, &fd, &fd_len);
+    return fd;
+} // end of Runtime::GetReplyFD()
+
+inline bool Runtime::HasPending(void) {
+    // True if there are events, or replies, waiting to be handled
+    int events = 0;
+    size_t events_len = sizeof(events);
+    zmq_getsockopt(m_ZMQPubSubSocket, ZMQ_EVENTS, &events, &events_len);
+    if(events & ZMQ_POLLIN)
+        return true;
+
+    zmq_getsockopt(m_ZMQClientSocket, ZMQ_EVENTS, &events, &events_len);
+    return (events & ZMQ_POLLIN) != 0;
+} // end of Runtime::HasPending()
+
+} // namespace cpdk
+
+#endif // CPDK_RUNTIME_H
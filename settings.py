@@ -7,6 +7,17 @@ DB_TYPE = 'sqlite'
 # Name of the database (not required for SQLite
 DB_NAME = 'cpdk.db'
 
+# Database connection pool used by CPDKd
+DB_POOL_SIZE = 5
+DB_POOL_MAX_OVERFLOW = 10
+
+# SQLite tuning (None keeps the SQLite default). WAL journaling with NORMAL synchronous only syncs at checkpoints,
+# so a power failure can lose the most recent commits, but never corrupts the database. Use FULL if that matters more
+# than write throughput. Negative cache sizes are in KiB.
+DB_JOURNAL_MODE = 'WAL'
+DB_SYNCHRONOUS = 'NORMAL'
+DB_CACHE_SIZE = -16000
+
 # Name of the directory to parse for models
 MODELS_DIR = 'models'
 
@@ -14,6 +25,20 @@ MODELS_DIR = 'models'
 C_SRC_DIR = 'c_src'
 C_TEMPLATE_FILE = 'template.h'
 
+# Number of objects the generated C++ managers fetch per list request during Init()
+C_LIST_PAGE_SIZE = 1000
+
+# Default number of PUB-SUB events the generated C++ managers apply per ProcessMessageQueue() call. 0 applies all of
+# the queued events.
+C_EVENT_BUDGET = 1000
+
+# Number of writes the generated C++ managers' *Async() methods queue up before sending them to CPDKd as a batch
+C_WRITE_BATCH_SIZE = 1000
+
+# Number of asynchronous requests the generated C++ managers send before waiting for replies. CPDKd drops replies
+# which pile up unread, so keep this below ZMQ's high water mark (1000 messages by default).
+C_MAX_IN_FLIGHT = 100
+
 # Shell settings
 SHELL_SCHEMA_FILE = 'redshell_schema.py'
 SHELL_LOGIN_BANNER = 'Welcome To RedShell!'
@@ -24,3 +49,47 @@ ZMQ_SHELL_PORT = 6990
 ZMQ_PUBSUB_PORT = 5744
 ZMQ_CLIENT_SERVER_PORT = 5279
 
+# Wire encoding used on each ZMQ channel: 'json' or 'msgpack' (needs msgpack-python). CPDKd answers each request in
+# the encoding it was sent with, so these only pick what RedShell and the generated C++ managers send, and what CPDKd
+# publishes. Daemons have to be generated again after changing them.
+ZMQ_SHELL_ENCODING = 'json'
+ZMQ_CLIENT_SERVER_ENCODING = 'json'
+ZMQ_PUBSUB_ENCODING = 'json'
+
+# How long (in milliseconds) CPDKd waits for a request before re-checking if it should shut down
+CPDKD_POLL_TIMEOUT = 250
+
+# Number of objects CPDKd keeps in its in-memory object cache (0 disables the cache)
+CPDKD_CACHE_SIZE = 0
+
+# Load every object into the cache when CPDKd starts, rather than as they're requested
+CPDKD_CACHE_PRELOAD = False
+
+# Number of threads CPDKd uses to process read-only requests (get, list) in parallel. Requests which write are always
+# processed one at a time by the main thread. 0 processes everything in the main thread.
+CPDKD_WORKER_THREADS = 4
+
+# Largest page CPDKd returns for a list request which asks for a limit
+CPDKD_LIST_MAX_PAGE_SIZE = 5000
+
+# Number of committed changes CPDKd keeps for 'changes_since' requests. Daemons which fall further behind than this
+# have to reload everything.
+CPDKD_CHANGELOG_SIZE = 10000
+
+# How long CPDKd holds back updates to fields declared with info={'conflate': True}, in milliseconds. Only the latest
+# value of each field is committed and published once the interval is up. 0 commits every update as it comes in.
+CPDKD_CONFLATE_INTERVAL = 1000
+
+# Record request counts, latencies and SQL statements per message type, and events published per model. They're
+# returned by 'stats' requests. The overhead is a few microseconds per request.
+CPDKD_METRICS = True
+
+# File CPDKd writes the stats to every CPDKD_STATS_INTERVAL seconds, and on exit. None only answers 'stats' requests.
+CPDKD_STATS_FILE = None
+CPDKD_STATS_INTERVAL = 60
+
+# Directory profiles are written to, by the --profile options and CPDKd's 'profile' message
+PROFILE_DIR = 'profiles'
+
+# CPDKd profiles one in every this many requests, when request profiling is started without a sample rate
+CPDKD_PROFILE_SAMPLE = 100
@@ -1,11 +1,14 @@
 // 3rd party requirements
 #include "zmq.h"
 #include "json.hpp"
+#include "cpdk_codec.h"
+#include "cpdk_runtime.h"
 
 // Standard libraries
 #include <stdio.h>
 #include <string.h>
 #include <cassert>
+#include <algorithm>
 #include <unordered_map>
 
 using json = nlohmann::json;
@@ -16,6 +19,7 @@ using json = nlohmann::json;
 #define MSG_TYPE_ADD_REF 4
 #define MSG_TYPE_DELETE_REF 5
 #define MSG_TYPE_DELETE_ALL 6
+#define MSG_TYPE_RELOAD 7
 
 {{ TEMPLATE_FORWARD_DECLS }}
 
@@ -24,6 +28,8 @@ public:
     {{ TEMPLATE_BASE }}(std::string name){m_Name = name;}
     virtual ~{{ TEMPLATE_BASE }}(){}
 
+    {{ TEMPLATE_FIELD_IDS }}
+
     {{ TEMPLATE_REFERENCE_FIELDS }}
 
     {{ TEMPLATE_BASE_FIELDS }}
@@ -36,7 +42,7 @@ private:
 typedef {{ TEMPLATE_BASE }} * (*{{ TEMPLATE_BASE }}_Create)(std::string name, void *pData);
 typedef void (*{{ TEMPLATE_BASE }}_Delete)({{ TEMPLATE_BASE }} *pObj, void *pData);
 
-class {{ TEMPLATE_MGR }} {
+class {{ TEMPLATE_MGR }} : public cpdk::Subscriber {
 public:
 
     static {{ TEMPLATE_MGR }} & GetInstance() {
@@ -44,12 +50,20 @@ public:
         return s_Instance;
     }
 
+    void Register({{ TEMPLATE_BASE }}_Create create_cb, {{ TEMPLATE_BASE }}_Delete delete_cb, void *pData);
     void Init({{ TEMPLATE_BASE }}_Create create_cb, {{ TEMPLATE_BASE }}_Delete delete_cb, void *pData);
     void Cleanup(void);
-    void ProcessMessageQueue(void);
+    int ProcessMessageQueue(int budget = {{ C_EVENT_BUDGET }});
+    int GetFD(void);
+    bool HasPending(void);
     {{ TEMPLATE_BASE }} * GetObj(std::string name){ return m_InstanceMap[name];}
 
-    // Methods for object management
+    // Keep the objects in a local file as well, so the next run only has to fetch what changed in between. Set it
+    // before the objects are fetched. The file is written by SaveSnapshot(), and by Cleanup().
+    void SetSnapshotFile(std::string path) { m_SnapshotFile = path; }
+    bool SaveSnapshot(void);
+
+    // Methods for object management. They wait for CPDKd to apply the change.
     void DeleteAll(void);
     void Create(std::string objectName);
     void UpdateField(std::string objectName, std::string fieldName, std::string val);
@@ -57,11 +71,15 @@ public:
     void UpdateField(std::string objectName, std::string fieldName, bool val);
     // TODO: Add more data types to UpdateField()
 
-private:
-    void * m_ZMQPubSubSocket;
-    void * m_ZMQClientSocket;
-    void * m_ZMQContext;
+    // The same, without waiting. Changes are queued, and sent as a single CPDKd batch by cpdk::Runtime::Flush(), or
+    // once C_WRITE_BATCH_SIZE of them are queued. The callback gets the result once the batch has been applied.
+    void DeleteAllAsync(cpdk::Callback cb = nullptr);
+    void CreateAsync(std::string objectName, cpdk::Callback cb = nullptr);
+    void UpdateFieldAsync(std::string objectName, std::string fieldName, std::string val, cpdk::Callback cb = nullptr);
+    void UpdateFieldAsync(std::string objectName, std::string fieldName, uint64_t val, cpdk::Callback cb = nullptr);
+    void UpdateFieldAsync(std::string objectName, std::string fieldName, bool val, cpdk::Callback cb = nullptr);
 
+private:
     {{ TEMPLATE_BASE }}_Create m_CreateCallback;
     {{ TEMPLATE_BASE }}_Delete m_DeleteCallback;
     void * m_pCallbackData;
@@ -69,60 +87,100 @@ private:
     typedef std::unordered_map<std::string, {{ TEMPLATE_BASE }} *> ObjMap;
     ObjMap m_InstanceMap;
 
+    // Revision of the last change applied to m_InstanceMap, and the epoch of the database it belongs to
+    uint64_t m_Revision;
+    std::string m_Epoch;
+
+    // The objects as CPDKd lists them, for SaveSnapshot(). Only kept when there's a snapshot file.
+    typedef std::unordered_map<std::string, json> StateMap;
+    StateMap m_State;
+    std::string m_SnapshotFile;
+
     json SendClientMessage(json &j);
+    json DeleteAllMessage(void);
+    json CreateMessage(std::string objectName);
+    template<typename T> json ModifyMessage(std::string objectName, std::string fieldName, T val);
+    void LoadAll(void);
+    void LoadObjects(json &objects);
+    void Resync(void);
+    void ApplyEvent(json &data);
+    void RecordEvent(json &data);
+    const char * ReferenceKey(uint32_t fid);
+
+    // cpdk::Subscriber
+    const char * ModelName(void) { return "{{ TEMPLATE_BASE }}"; }
+    void LoadSnapshot(json &page, uint64_t revision);
+    void OnEvent(json &data);
+    uint64_t ReadSnapshot(void);
+    void ResumeSnapshot(json &changes);
 
 protected:
     // Constructors (hidden for singleton-only access)
-    {{ TEMPLATE_MGR }}() {};
+    {{ TEMPLATE_MGR }}() : m_Revision(0) {};
     {{ TEMPLATE_MGR }}({{ TEMPLATE_MGR }} const &);
     void operator=({{ TEMPLATE_MGR }} const&);
 };
 
-void {{ TEMPLATE_MGR }}::Init({{ TEMPLATE_BASE }}_Create create_cb, {{ TEMPLATE_BASE }}_Delete delete_cb, void *pData) {
+void {{ TEMPLATE_MGR }}::Register({{ TEMPLATE_BASE }}_Create create_cb, {{ TEMPLATE_BASE }}_Delete delete_cb,
+                                  void *pData) {
 
     m_CreateCallback = create_cb;
     m_DeleteCallback = delete_cb;
     m_pCallbackData = pData;
 
-    m_ZMQContext = zmq_ctx_new();
-    m_ZMQPubSubSocket = zmq_socket(m_ZMQContext, ZMQ_SUB);
+    // Subscribe to the {{ TEMPLATE_BASE }} PUB-SUB channel. The objects are fetched by cpdk::Runtime::Start(), along
+    // with those of every other registered manager.
+    cpdk::Runtime::GetInstance().Register(this);
+
+} // end of {{ TEMPLATE_MGR }}::Register()
+
+void {{ TEMPLATE_MGR }}::Init({{ TEMPLATE_BASE }}_Create create_cb, {{ TEMPLATE_BASE }}_Delete delete_cb, void *pData) {
+
+    Register(create_cb, delete_cb, pData);
 
-    // Subscribe to the {{ TEMPLATE_BASE }} PUB-SUB channel
-    zmq_setsockopt(m_ZMQPubSubSocket, ZMQ_SUBSCRIBE, "[\"{{ TEMPLATE_BASE }}\"", strlen("[\"{{ TEMPLATE_BASE }}\""));
-    zmq_connect(m_ZMQPubSubSocket, "tcp://localhost:{{ ZMQ_PUBSUB_PORT }}");
+    // Fetch all of the objects this manager cares about, and those of any manager registered before it
+    cpdk::Runtime::GetInstance().Start();
 
-    // Subscribe to the client-server socket
-    m_ZMQClientSocket = zmq_socket(m_ZMQContext, ZMQ_REQ);
-    zmq_connect(m_ZMQClientSocket, "tcp://localhost:{{ ZMQ_CLIENT_SERVER_PORT }}");
+} // end of {{ TEMPLATE_MGR }}::Init()
 
-    // Fetch all of the objects this manager cares about
+void {{ TEMPLATE_MGR }}::LoadAll(void) {
     json j;
     j["t"] = "list";
     j["o"] = "{{ TEMPLATE_BASE }}";
-    std::string j_msg = j.dump();
-    zmq_send(m_ZMQClientSocket, j_msg.c_str(), strlen(j_msg.c_str()), 0);
-
-    zmq_msg_t msg;
-    zmq_msg_init(&msg);
+    j["limit"] = {{ C_LIST_PAGE_SIZE }};
 
-    int msgLen = zmq_recvmsg(m_ZMQClientSocket, &msg, 0);
-    if(msgLen == -1)
-        // TODO: Something more meaningful
-        throw "oops";
+    json j2 = SendClientMessage(j);
+    LoadSnapshot(j2, j2["revision"]);
+} // end of {{ TEMPLATE_MGR }}::LoadAll()
 
-    std::string recvBuffer((char *)zmq_msg_data(&msg), msgLen);
-    json j2 = json::parse(recvBuffer.c_str());
+void {{ TEMPLATE_MGR }}::LoadSnapshot(json &page, uint64_t revision) {
+    // Changes committed while paging may already be included, and will be applied again when they're published
+    m_Revision = revision;
+    m_Epoch = cpdk::Runtime::GetInstance().GetEpoch();
+    LoadObjects(page["result"]);
 
-    if(j2["status"] != "ok")
-        // TODO: Needs a custom exception
-        throw "list command failed";
+    // Fetch the rest of the objects one page at a time. The last page comes without a cursor.
+    json j;
+    j["t"] = "list";
+    j["o"] = "{{ TEMPLATE_BASE }}";
+    j["limit"] = {{ C_LIST_PAGE_SIZE }};
+
+    json cursor = page.find("cursor") != page.end() ? page["cursor"] : json();
+    while(!cursor.is_null()) {
+        j["cursor"] = cursor;
+        json j2 = SendClientMessage(j);
+        LoadObjects(j2["result"]);
+        cursor = j2.find("cursor") != j2.end() ? j2["cursor"] : json();
+    }
+} // end of {{ TEMPLATE_MGR }}::LoadSnapshot()
 
-    for(auto &obj : j2["result"]) {
+void {{ TEMPLATE_MGR }}::LoadObjects(json &objects) {
+    for(auto &obj : objects) {
         {{ TEMPLATE_BASE }} *pObj = m_CreateCallback(obj["name"], m_pCallbackData);
         m_InstanceMap[obj["name"]] = pObj;
 
         for (json::iterator it = obj.begin(); it != obj.end(); ++it) {
-            std::string field = it.key();
+            uint32_t fid = cpdk::FieldId(it.key());
             auto value = it.value();
 
             if(value.is_null())
@@ -130,21 +188,103 @@ void {{ TEMPLATE_MGR }}::Init({{ TEMPLATE_BASE }}_Create create_cb, {{ TEMPLATE_
 {{ TEMPLATE_BASE_MODIFY_LOGIC }}
 {{ TEMPLATE_BASE_REF_INIT_LOGIC }}
         }
+
+        if(!m_SnapshotFile.empty()) {
+            std::string name = obj["name"];
+            m_State[name] = std::move(obj);
+        }
+    }
+} // end of {{ TEMPLATE_MGR }}::LoadObjects()
+
+uint64_t {{ TEMPLATE_MGR }}::ReadSnapshot(void) {
+    json snapshot;
+    if(m_SnapshotFile.empty() || !cpdk::ReadSnapshotFile(m_SnapshotFile, snapshot))
+        return 0;
+
+    // Snapshots written by a header generated from another model, template or settings can't be trusted
+    if(snapshot["tag"] != "{{ TEMPLATE_SNAPSHOT_TAG }}" || !snapshot["revision"].is_number_unsigned())
+        return 0;
+
+    m_Revision = snapshot["revision"];
+    m_Epoch = snapshot["epoch"].is_string() ? snapshot["epoch"].get<std::string>() : "";
+    for(auto &obj : snapshot["objects"]) {
+        std::string name = obj["name"];
+        m_State[name] = std::move(obj);
+    }
+    return m_Revision;
+} // end of {{ TEMPLATE_MGR }}::ReadSnapshot()
+
+void {{ TEMPLATE_MGR }}::ResumeSnapshot(json &changes) {
+    // The saved objects are only any use if CPDKd still has every change made to the same database since
+    if(changes["status"] != "ok" || changes.find("resync") != changes.end() ||
+       m_Epoch != cpdk::Runtime::GetInstance().GetEpoch()) {
+        m_State.clear();
+        LoadAll();
+        return;
     }
 
+    json objects = json::array();
+    for(auto &it : m_State)
+        objects.push_back(std::move(it.second));
+    m_State.clear();
+    LoadObjects(objects);
 
-} // end of {{ TEMPLATE_MGR }}::Init()
+    for(auto &change : changes["changes"]) {
+        ApplyEvent(change.at(1));
+    }
+    m_Revision = std::max(m_Revision, changes["revision"].get<uint64_t>());
+} // end of {{ TEMPLATE_MGR }}::ResumeSnapshot()
+
+bool {{ TEMPLATE_MGR }}::SaveSnapshot(void) {
+    if(m_SnapshotFile.empty() || m_Epoch.empty())
+        return false;
+
+    json snapshot;
+    snapshot["tag"] = "{{ TEMPLATE_SNAPSHOT_TAG }}";
+    snapshot["epoch"] = m_Epoch;
+    snapshot["revision"] = m_Revision;
+    snapshot["objects"] = json::array();
+    for(auto &it : m_State)
+        snapshot["objects"].push_back(it.second);
+
+    return cpdk::WriteSnapshotFile(m_SnapshotFile, snapshot);
+} // end of {{ TEMPLATE_MGR }}::SaveSnapshot()
+
+void {{ TEMPLATE_MGR }}::Resync(void) {
+    // Catch up on the changes committed since the last one applied
+    json j;
+    j["t"] = "changes_since";
+    j["o"] = "{{ TEMPLATE_BASE }}";
+    j["rev"] = m_Revision;
+    json j2 = SendClientMessage(j);
+
+    if(j2.find("resync") != j2.end()) {
+        // CPDKd no longer has all of the changes, so start over
+        for(auto &it : m_InstanceMap) {
+            m_DeleteCallback(it.second, NULL);
+        }
+        m_InstanceMap.clear();
+        m_State.clear();
+        LoadAll();
+        return;
+    }
+
+    for(auto &change : j2["changes"]) {
+        ApplyEvent(change.at(1));
+    }
+    m_Revision = std::max(m_Revision, j2["revision"].get<uint64_t>());
+} // end of {{ TEMPLATE_MGR }}::Resync()
 
 void {{ TEMPLATE_MGR }}::Cleanup(void) {
-    zmq_close(m_ZMQPubSubSocket);
-    zmq_close(m_ZMQClientSocket);
-    zmq_ctx_destroy(m_ZMQContext);
+    // Save the objects for the next run, if there's a snapshot file
+    SaveSnapshot();
+
+    // The shared sockets are closed along with the last manager
+    cpdk::Runtime::GetInstance().Unregister(this);
 } // end of {{ TEMPLATE_MGR }}::Cleanup()
 
 void {{ TEMPLATE_MGR }}::DeleteAll(void) {
-    json j;
-    j["t"] = "delete_all";
-    j["o"] = "{{ TEMPLATE_BASE }}";
+    json j = DeleteAllMessage();
     SendClientMessage(j);
 
     // Note: No actual deletes will occur here.
@@ -152,11 +292,7 @@ void {{ TEMPLATE_MGR }}::DeleteAll(void) {
 } // end of void {{ TEMPLATE_MGR }}::DeleteAll()
 
 void {{ TEMPLATE_MGR }}::Create(std::string objectName) {
-    json j;
-    j["t"] = "create";
-    j["o"] = "{{ TEMPLATE_BASE }}";
-    j["on"] = objectName;
-
+    json j = CreateMessage(objectName);
     SendClientMessage(j);
 
     // Note: No actual creates will occur here.
@@ -164,86 +300,124 @@ void {{ TEMPLATE_MGR }}::Create(std::string objectName) {
 
 } // end of {{ TEMPLATE_MGR }}::Create()
 
-json {{ TEMPLATE_MGR }}::SendClientMessage(json &j) {
+void {{ TEMPLATE_MGR }}::DeleteAllAsync(cpdk::Callback cb) {
+    json j = DeleteAllMessage();
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of {{ TEMPLATE_MGR }}::DeleteAllAsync()
 
-    int msgLen;
-    zmq_msg_t msg;
-    json jResponse;
-    std::string j_msg;
+void {{ TEMPLATE_MGR }}::CreateAsync(std::string objectName, cpdk::Callback cb) {
+    json j = CreateMessage(objectName);
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of {{ TEMPLATE_MGR }}::CreateAsync()
 
-    j_msg = j.dump();
-    zmq_msg_init(&msg);
-
-    zmq_send(m_ZMQClientSocket, j_msg.c_str(), strlen(j_msg.c_str()), 0);
-    msgLen = zmq_recvmsg(m_ZMQClientSocket, &msg, 0);
-    if(msgLen == -1)
-        // TODO: Something more meaningful
-        throw "oops";
+json {{ TEMPLATE_MGR }}::DeleteAllMessage(void) {
+    json j;
+    j["t"] = "delete_all";
+    j["o"] = "{{ TEMPLATE_BASE }}";
+    return j;
+} // end of {{ TEMPLATE_MGR }}::DeleteAllMessage()
 
-    std::string recvBuffer((char *)zmq_msg_data(&msg), msgLen);
-    jResponse = json::parse(recvBuffer.c_str());
-    if(jResponse["status"] != "ok")
-        // TODO: Needs a custom exception
-        throw "list command failed";
+json {{ TEMPLATE_MGR }}::CreateMessage(std::string objectName) {
+    json j;
+    j["t"] = "create";
+    j["o"] = "{{ TEMPLATE_BASE }}";
+    j["on"] = objectName;
+    return j;
+} // end of {{ TEMPLATE_MGR }}::CreateMessage()
 
-    return jResponse;
+json {{ TEMPLATE_MGR }}::SendClientMessage(json &j) {
+    return cpdk::Runtime::GetInstance().Request(j);
 } // end of {{ TEMPLATE_MGR }}::SendClientMessage()
 
-void {{ TEMPLATE_MGR }}::UpdateField(std::string objectName, std::string fieldName, std::string val) {
+template<typename T> json {{ TEMPLATE_MGR }}::ModifyMessage(std::string objectName, std::string fieldName, T val) {
     json j;
     j["t"] = "modify";
     j["o"] = "{{ TEMPLATE_BASE }}";
     j["on"] = objectName;
     j["f"] = fieldName;
     j["fv"] = val;
+    return j;
+} // end of {{ TEMPLATE_MGR }}::ModifyMessage()
 
+void {{ TEMPLATE_MGR }}::UpdateField(std::string objectName, std::string fieldName, std::string val) {
+    json j = ModifyMessage(objectName, fieldName, val);
     SendClientMessage(j);
 } // end of {{ TEMPLATE_MGR }}::UpdateField()
 
 void {{ TEMPLATE_MGR }}::UpdateField(std::string objectName, std::string fieldName, uint64_t val) {
-    json j;
-    j["t"] = "modify";
-    j["o"] = "{{ TEMPLATE_BASE }}";
-    j["on"] = objectName;
-    j["f"] = fieldName;
-    j["fv"] = val;
-
+    json j = ModifyMessage(objectName, fieldName, val);
     SendClientMessage(j);
 } // end of {{ TEMPLATE_MGR }}::UpdateField()
 
 void {{ TEMPLATE_MGR }}::UpdateField(std::string objectName, std::string fieldName, bool val) {
-    json j;
-    j["t"] = "modify";
-    j["o"] = "{{ TEMPLATE_BASE }}";
-    j["on"] = objectName;
-    j["f"] = fieldName;
-    j["fv"] = val;
-
+    json j = ModifyMessage(objectName, fieldName, val);
     SendClientMessage(j);
 } // end of {{ TEMPLATE_MGR }}::UpdateField()
 
+void {{ TEMPLATE_MGR }}::UpdateFieldAsync(std::string objectName, std::string fieldName, std::string val,
+                                          cpdk::Callback cb) {
+    json j = ModifyMessage(objectName, fieldName, val);
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of {{ TEMPLATE_MGR }}::UpdateFieldAsync()
+
+void {{ TEMPLATE_MGR }}::UpdateFieldAsync(std::string objectName, std::string fieldName, uint64_t val,
+                                          cpdk::Callback cb) {
+    json j = ModifyMessage(objectName, fieldName, val);
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of {{ TEMPLATE_MGR }}::UpdateFieldAsync()
+
+void {{ TEMPLATE_MGR }}::UpdateFieldAsync(std::string objectName, std::string fieldName, bool val,
+                                          cpdk::Callback cb) {
+    json j = ModifyMessage(objectName, fieldName, val);
+    cpdk::Runtime::GetInstance().Queue(j, cb);
+} // end of {{ TEMPLATE_MGR }}::UpdateFieldAsync()
+
+int {{ TEMPLATE_MGR }}::ProcessMessageQueue(int budget) {
+    // The events of every model arrive on the same socket, so this applies those of the other managers too
+    return cpdk::Runtime::GetInstance().ProcessMessageQueue(budget);
+} // end of {{ TEMPLATE_MGR }}::ProcessMessageQueue()
+
+int {{ TEMPLATE_MGR }}::GetFD(void) {
+    return cpdk::Runtime::GetInstance().GetFD();
+} // end of {{ TEMPLATE_MGR }}::GetFD()
+
+bool {{ TEMPLATE_MGR }}::HasPending(void) {
+    return cpdk::Runtime::GetInstance().HasPending();
+} // end of {{ TEMPLATE_MGR }}::HasPending()
+
+void {{ TEMPLATE_MGR }}::OnEvent(json &data) {
+    uint64_t revision = data["rev"];
+    uint64_t previous = data["prev"];
+
+    // Already applied, either from the initial fetch or a resync
+    if(revision <= m_Revision)
+        return;
 
-void {{ TEMPLATE_MGR }}::ProcessMessageQueue(void) {
-    zmq_msg_t msg;
-    zmq_msg_init(&msg);
-
-    // Process any messages from the PUB-SUB socket
-    int msg_len = zmq_recvmsg(m_ZMQPubSubSocket, &msg, ZMQ_DONTWAIT);
-    if( msg_len == -1)
+    // The previous change to this model never arrived. Resync() fetches it, along with this one.
+    if(previous > m_Revision) {
+        Resync();
         return;
+    }
 
-    std::string recvBuffer((char *)zmq_msg_data(&msg), msg_len);
-    json j = json::parse((char *)recvBuffer.c_str());
-    json data = j.at(1);
+    // A reload fetches every object again, at a newer revision than its own
+    ApplyEvent(data);
+    m_Revision = std::max(m_Revision, revision);
+} // end of {{ TEMPLATE_MGR }}::OnEvent()
 
+void {{ TEMPLATE_MGR }}::ApplyEvent(json &data) {
     std::string objName = "";
     if(data.find("obj") != data.end())   // Optional for messages like "DELETE_ALL"
         objName = data["obj"];
 
     int id = data["type"];
 
+    if(!m_SnapshotFile.empty())
+        RecordEvent(data);
+
     switch(id) {
         case MSG_TYPE_CREATE: {
+            if(m_InstanceMap.find(objName) != m_InstanceMap.end())
+                break;  // Already fetched
             m_InstanceMap[objName] = m_CreateCallback(objName, NULL);
         } break;
         case MSG_TYPE_DELETE: {
@@ -260,13 +434,21 @@ void {{ TEMPLATE_MGR }}::ProcessMessageQueue(void) {
             }
             m_InstanceMap.clear();
         } break;
+        case MSG_TYPE_RELOAD: {
+            // Every object was replaced at once, so fetch them all again
+            for(auto &it : m_InstanceMap) {
+                m_DeleteCallback(it.second, NULL);
+            }
+            m_InstanceMap.clear();
+            LoadAll();
+        } break;
         case MSG_TYPE_MODIFY: {
             ObjMap::iterator it = m_InstanceMap.find(objName);
             if(it == m_InstanceMap.end())
                 break;
 
             {{ TEMPLATE_BASE }} *pObj = m_InstanceMap[objName];
-            std::string field = data["field"];
+            uint32_t fid = cpdk::EventFieldId(data);
             auto value = data["value"];
 
 {{ TEMPLATE_BASE_MODIFY_LOGIC }}
@@ -276,7 +458,7 @@ void {{ TEMPLATE_MGR }}::ProcessMessageQueue(void) {
             assert(it != m_InstanceMap.end());
 
             {{ TEMPLATE_BASE }} *pObj = it->second;
-            std::string field = data["field"];
+            uint32_t fid = cpdk::EventFieldId(data);
             auto value = data["value"];
 
             {{ TEMPLATE_BASE_REF_ADD_LOGIC }}
@@ -287,7 +469,7 @@ void {{ TEMPLATE_MGR }}::ProcessMessageQueue(void) {
             assert(it != m_InstanceMap.end());
 
             {{ TEMPLATE_BASE }} *pObj = it->second;
-            std::string field = data["field"];
+            uint32_t fid = cpdk::EventFieldId(data);
             auto value = data["value"];
 
             {{ TEMPLATE_BASE_REF_DELETE_LOGIC }}
@@ -296,4 +478,52 @@ void {{ TEMPLATE_MGR }}::ProcessMessageQueue(void) {
         default:
         throw "Unknown message type";
     }
-} // end of {{ TEMPLATE_MGR }}::ProcessMessageQueue()
\ No newline at end of file
+} // end of {{ TEMPLATE_MGR }}::ApplyEvent()
+
+void {{ TEMPLATE_MGR }}::RecordEvent(json &data) {
+    // Keep m_State the same as what CPDKd would list now
+    std::string objName = data.find("obj") != data.end() ? data["obj"].get<std::string>() : "";
+
+    switch(data["type"].get<int>()) {
+        case MSG_TYPE_CREATE: {
+            if(m_State.find(objName) == m_State.end())
+                m_State[objName]["name"] = objName;
+        } break;
+        case MSG_TYPE_DELETE:
+            m_State.erase(objName);
+            break;
+        case MSG_TYPE_DELETE_ALL:
+        case MSG_TYPE_RELOAD:
+            // Reloads list every object again
+            m_State.clear();
+            break;
+        case MSG_TYPE_MODIFY: {
+            StateMap::iterator it = m_State.find(objName);
+            if(it != m_State.end())
+                it->second[data["field"].get<std::string>()] = data["value"];
+        } break;
+        case MSG_TYPE_ADD_REF:
+        case MSG_TYPE_DELETE_REF: {
+            StateMap::iterator it = m_State.find(objName);
+            const char *key = ReferenceKey(cpdk::EventFieldId(data));
+            if(it == m_State.end() || key == NULL)
+                break;
+
+            // The same change may be applied twice, once from a snapshot and once when it's published
+            json &names = it->second[key];
+            if(!names.is_array())
+                names = json::array();
+            json::iterator name = std::find(names.begin(), names.end(), data["value"]);
+            if(data["type"] == MSG_TYPE_DELETE_REF && name != names.end())
+                names.erase(name);
+            else if(data["type"] == MSG_TYPE_ADD_REF && name == names.end())
+                names.push_back(data["value"]);
+        } break;
+    }
+} // end of {{ TEMPLATE_MGR }}::RecordEvent()
+
+const char * {{ TEMPLATE_MGR }}::ReferenceKey(uint32_t fid) {
+    // Reference events name the referenced class, the objects are listed with the name of the relationship
+{{ TEMPLATE_REFERENCE_KEYS }}
+    return NULL;
+} // end of {{ TEMPLATE_MGR }}::ReferenceKey()
@@ -0,0 +1,75 @@
+from unittest import TestCase
+from cpdk_cache import ObjectCache
+
+
+class ObjectCacheTest(TestCase):
+
+    def test_lru_eviction(self):
+        """
+        Verify the least recently used objects are evicted once the cache is full
+        """
+        cache = ObjectCache(2)
+        cache.put('Server', 'a', {'id': 1, 'name': 'a'})
+        cache.put('Server', 'b', {'id': 2, 'name': 'b'})
+
+        # Touch 'a' so that 'b' becomes the least recently used object
+        self.assertEqual(cache.get('Server', 'a')['id'], 1)
+        cache.put('Server', 'c', {'id': 3, 'name': 'c'})
+
+        self.assertIsNone(cache.get('Server', 'b'))
+        self.assertIsNotNone(cache.get('Server', 'c'))
+
+        stats = cache.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_complete_models(self):
+        """
+        Verify a model can only be listed from the cache while all of its objects are cached
+        """
+        cache = ObjectCache(3)
+        cache.put_model('Server', [{'id': 2, 'name': 'b'}, {'id': 1, 'name': 'a'}])
+        self.assertEqual([e['name'] for e in cache.list('Server')], ['a', 'b'])
+
+        cache.clear_model('VirtualServer')
+        self.assertEqual(cache.list('VirtualServer'), [])
+
+        # Evicting one of the servers means they can no longer be listed from the cache
+        cache.put('Interface', 'eth0', {'id': 1, 'name': 'eth0'})
+        cache.put('Interface', 'eth1', {'id': 2, 'name': 'eth1'})
+        self.assertIsNone(cache.list('Server'))
+
+    def test_list_order(self):
+        """
+        Verify a model is listed in the order of the ids, whatever order its objects were cached in
+        """
+        cache = ObjectCache(10)
+        cache.put_model('Server', [{'id': 1, 'name': 'a'}, {'id': 3, 'name': 'c'}])
+        cache.put('Interface', 'eth0', {'id': 2, 'name': 'eth0'})
+        cache.put('Server', 'b', {'id': 2, 'name': 'b'})
+        cache.put('Server', 'a', {'id': 1, 'name': 'a', 'port': 80})
+        self.assertEqual([e['name'] for e in cache.list('Server')], ['a', 'b', 'c'])
+        self.assertEqual(cache.list('Server')[0]['port'], 80)
+
+        # A renamed object keeps its id
+        cache.pop('Server', 'a')
+        cache.put('Server', 'z', {'id': 1, 'name': 'z'})
+        cache.put('Server', 'd', {'id': 4, 'name': 'd'})
+        self.assertEqual([e['name'] for e in cache.list('Server')], ['z', 'b', 'c', 'd'])
+
+        cache.clear_model('Server')
+        self.assertEqual(cache.list('Server'), [])
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_references(self):
+        """
+        Verify references to deleted objects are removed from cached relationships
+        """
+        cache = ObjectCache(10)
+        cache.put('VirtualServer', 'vip', {'id': 1, 'name': 'vip', 'servers': ['a', 'b']})
+        cache.remove_reference('VirtualServer', 'servers', 'a')
+        self.assertEqual(cache.get('VirtualServer', 'vip')['servers'], ['b'])
+        cache.remove_reference('VirtualServer', 'servers')
+        self.assertEqual(cache.get('VirtualServer', 'vip')['servers'], [])
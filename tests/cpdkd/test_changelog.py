@@ -0,0 +1,84 @@
+from unittest import TestCase
+from cpdk_changelog import ChangeLog, replace_epoch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class ChangeLogTest(TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.changelog = ChangeLog(3)
+        self.changelog.load(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+
+    def commit(self, events):
+        """
+        Stamp and commit a transaction's events, the way CPDKd does
+        """
+        model_revisions = self.changelog.stamp(self.session, events)
+        self.session.commit()
+        self.changelog.advance(model_revisions)
+        return events
+
+    def test_revisions(self):
+        """
+        Verify revisions count up across models, and each event points at the previous one for its model
+        """
+        events = self.commit([('Server', {'type': 1, 'obj': 'a'}),
+                              ('VirtualServer', {'type': 1, 'obj': 'b'}),
+                              ('Server', {'type': 3, 'obj': 'a', 'field': 'port', 'value': 80})])
+
+        self.assertEqual([e['rev'] for m, e in events], [1, 2, 3])
+        self.assertEqual([e['prev'] for m, e in events], [0, 0, 1])
+        self.assertEqual(self.changelog.revision, 3)
+
+        changes, revision = self.changelog.changes_since(self.session, 1, 'Server')
+        self.assertEqual(revision, 3)
+        self.assertEqual([e['rev'] for m, e in changes], [3])
+
+        # A fresh change log picks up where the database left off
+        changelog = ChangeLog(3)
+        changelog.load(self.engine)
+        self.assertEqual(changelog.revision, 3)
+        self.assertEqual(changelog.model_revisions, {'Server': 3, 'VirtualServer': 2})
+        self.assertEqual(changelog.epoch, self.changelog.epoch)
+
+        # Another database has an epoch of its own
+        changelog = ChangeLog(3)
+        changelog.load(create_engine('sqlite://'))
+        self.assertNotEqual(changelog.epoch, self.changelog.epoch)
+
+    def test_replace_epoch(self):
+        """
+        Verify a replaced epoch is picked up, by a fresh change log as well as a running one
+        """
+        epoch = replace_epoch(self.session)
+        self.session.commit()
+        self.assertNotEqual(epoch, self.changelog.epoch)
+
+        changelog = ChangeLog(3)
+        changelog.load(self.engine)
+        self.assertEqual(changelog.epoch, epoch)
+
+        self.changelog.refresh_epoch(self.session)
+        self.assertEqual(self.changelog.epoch, epoch)
+
+    def test_trimming(self):
+        """
+        Verify only the last changes are kept, and callers further behind have to reload everything
+        """
+        for x in range(5):
+            self.commit([('Server', {'type': 3, 'obj': 'a', 'field': 'port', 'value': x})])
+
+        changes, revision = self.changelog.changes_since(self.session, 2)
+        self.assertEqual([e['value'] for m, e in changes], [2, 3, 4])
+        self.assertEqual(revision, 5)
+
+        changes, revision = self.changelog.changes_since(self.session, 1)
+        self.assertIsNone(changes)
+        self.assertEqual(revision, 5)
@@ -0,0 +1,47 @@
+from unittest import TestCase
+from cpdk_conflate import Conflator
+
+
+class ConflatorTest(TestCase):
+
+    def setUp(self):
+        self.conflator = Conflator(1000)
+
+    def test_coalesce(self):
+        """
+        Verify only the latest value of each field is kept, in the order the fields were first updated
+        """
+        self.assertIsNone(self.conflator.due_in())
+
+        self.conflator.accept('Interface', 'eth0', 'packets_in', 1)
+        self.conflator.accept('Interface', 'eth1', 'packets_in', 2)
+        self.conflator.accept('Interface', 'eth0', 'packets_in', 3)
+        self.assertGreater(self.conflator.due_in(), 0)
+
+        self.assertEqual(self.conflator.take(), [(('Interface', 'eth0', 'packets_in'), 3),
+                                                 (('Interface', 'eth1', 'packets_in'), 2)])
+        self.assertEqual(self.conflator.take(), [])
+        self.assertIsNone(self.conflator.due_in())
+
+        stats = self.conflator.stats()
+        self.assertEqual((stats['accepted'], stats['coalesced'], stats['pending']), (3, 1, 0))
+
+    def test_discard(self):
+        """
+        Verify pending updates can be thrown away by field, object and model
+        """
+        self.conflator.accept('Interface', 'eth0', 'packets_in', 1)
+        self.conflator.accept('Interface', 'eth0', 'packets_out', 1)
+        self.conflator.accept('Interface', 'eth1', 'packets_in', 1)
+        self.conflator.accept('Interface', 'eth2', 'packets_in', 1)
+
+        self.conflator.discard('Interface', 'eth0', 'packets_out')
+        self.conflator.discard('Interface', 'eth1')
+        self.conflator.discard('Server')
+        self.assertEqual([key for key, value in self.conflator.take()],
+                         [('Interface', 'eth0', 'packets_in'), ('Interface', 'eth2', 'packets_in')])
+
+        self.conflator.accept('Interface', 'eth0', 'packets_in', 1)
+        self.conflator.discard('Interface')
+        self.assertIsNone(self.conflator.due_in())
+        self.assertEqual(self.conflator.stats()['dropped'], 3)
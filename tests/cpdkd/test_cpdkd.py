@@ -0,0 +1,512 @@
+import os
+import zmq
+import json
+import msgpack
+import time
+import signal
+import pexpect
+import subprocess
+from unittest import TestCase
+from examples.basic import settings
+from cpdk_codec import field_id
+
+
+class CPDKdTest(TestCase):
+
+    cpdkd_process = None
+
+    def setUp(self):
+
+        # Make sure the database schema is in place
+        pexpect.run('python cpdk-util.py --settings examples.basic.settings --syncdb')
+
+        # Start CPDKd
+        self.cpdkd_process = subprocess.Popen('python CPDKd.py --settings examples.basic.settings',
+                                              stdout=subprocess.PIPE,
+                                              shell=True, preexec_fn=os.setsid)
+
+        self.context = zmq.Context()
+        self.req_socket = self.context.socket(zmq.REQ)
+        self.req_socket.setsockopt(zmq.RCVTIMEO, 5000)
+        self.req_socket.setsockopt(zmq.LINGER, 0)
+        self.req_socket.connect('tcp://localhost:%d' % settings.ZMQ_CLIENT_SERVER_PORT)
+
+        self.sub_socket = self.context.socket(zmq.SUB)
+        self.sub_socket.setsockopt(zmq.RCVTIMEO, 1000)
+        self.sub_socket.setsockopt(zmq.LINGER, 0)
+        self.sub_socket.setsockopt(zmq.SUBSCRIBE, '')
+        self.sub_socket.connect('tcp://localhost:%d' % settings.ZMQ_PUBSUB_PORT)
+
+        # Wait for CPDKd to get started up
+        time.sleep(3)
+        self.assertIsNone(self.cpdkd_process.poll())
+
+        # Start every test from an empty set of servers and virtual servers
+        self.request({'t': 'delete_all', 'o': 'Server'})
+        self.request({'t': 'delete_all', 'o': 'VirtualServer'})
+        self.events()
+
+    def tearDown(self):
+        self.req_socket.close()
+        self.sub_socket.close()
+        self.context.term()
+
+        # Stop CPDKd
+        os.killpg(os.getpgid(self.cpdkd_process.pid), signal.SIGTERM)
+
+    def request(self, msg):
+        """
+        Send a request to CPDKd and wait for the reply
+        """
+        self.req_socket.send_json(msg)
+        return self.req_socket.recv_json()
+
+    def events(self):
+        """
+        Collect all of the PUB-SUB messages published so far
+        """
+        events = []
+        try:
+            while True:
+                topic, payload = self.sub_socket.recv_multipart()
+                events.append([topic.split('\0')[0], json.loads(payload)])
+        except zmq.Again:
+            return events
+
+    def test_batch(self):
+        """
+        Verify that a batch is applied as a whole and events are published once it has been committed
+        """
+        reply = self.request({'t': 'batch', 'ops': [
+            {'t': 'create', 'o': 'Server', 'on': 'web1'},
+            {'t': 'modify', 'o': 'Server', 'on': 'web1', 'f': 'port', 'fv': 80},
+            {'t': 'create', 'o': 'VirtualServer', 'on': 'vip1'},
+            {'t': 'add_ref', 'o': 'VirtualServer', 'on': 'vip1', 'f': 'Server', 'fv': 'web1', 'rv': 'servers'},
+        ]})
+        self.assertEqual(reply['status'], 'ok')
+        self.assertEqual(len(reply['results']), 4)
+        self.assertIn('id', reply['results'][0])
+
+        events = self.events()
+        self.assertEqual([e[1]['type'] for e in events], [1, 3, 1, 4])
+        self.assertEqual(events[1][0], 'Server')
+        self.assertDictContainsSubset({'type': 3, 'obj': 'web1', 'field': 'port', 'value': 80}, events[1][1])
+
+        reply = self.request({'t': 'list', 'o': 'VirtualServer', 'on': 'vip1'})
+        self.assertEqual(reply['result'][0]['servers'], ['web1'])
+
+    def test_batch_rollback(self):
+        """
+        Verify that a failing operation undoes the whole batch, and nothing is published
+        """
+        reply = self.request({'t': 'batch', 'ops': [
+            {'t': 'create', 'o': 'Server', 'on': 'web2'},
+            {'t': 'modify', 'o': 'Server', 'on': 'missing', 'f': 'port', 'fv': 80},
+            {'t': 'create', 'o': 'Server', 'on': 'web3'},
+        ]})
+        self.assertEqual(reply['status'], 'error')
+        self.assertEqual(reply['index'], 1)
+        self.assertEqual(len(reply['results']), 2)
+
+        self.assertEqual(self.events(), [])
+        self.assertEqual(self.request({'t': 'get', 'o': 'Server', 'on': 'web2'})['status'], 'error')
+
+        reply = self.request({'t': 'batch', 'ops': [{'t': 'create', 'o': 'NoSuchModel', 'on': 'x'}]})
+        self.assertEqual(reply['status'], 'error')
+
+    def test_malformed_messages(self):
+        """
+        Verify that malformed messages are answered with an error, and leave CPDKd running
+        """
+        for msg in [{'t': 'batch', 'ops': 5}, {'t': 'batch', 'ops': None}, {'t': 'batch', 'ops': [1]},
+                    {'t': 'batch', 'ops': [{'t': 'get', 'o': 'Server', 'on': 'web1'}, 'get']}, {'o': 'Server'}, [1]]:
+            self.assertEqual(self.request(msg)['status'], 'error')
+
+        self.req_socket.send('{not json')
+        self.assertEqual(self.req_socket.recv_json()['status'], 'error')
+
+        self.assertIsNone(self.cpdkd_process.poll())
+        self.assertEqual(self.request({'t': 'create', 'o': 'Server', 'on': 'web1'})['status'], 'ok')
+
+    def test_unique_names(self):
+        """
+        Verify that object names are unique within a model, and deleting by name works
+        """
+        self.assertEqual(self.request({'t': 'create', 'o': 'Server', 'on': 'web4'})['status'], 'ok')
+        reply = self.request({'t': 'create', 'o': 'Server', 'on': 'web4'})
+        self.assertEqual(reply['status'], 'error')
+        self.assertEqual(reply['message'], 'Server web4 already exists')
+
+        # The same name can still be used by a different model
+        self.assertEqual(self.request({'t': 'create', 'o': 'VirtualServer', 'on': 'web4'})['status'], 'ok')
+
+        self.assertEqual(self.request({'t': 'delete', 'o': 'Server', 'on': 'web4'})['status'], 'ok')
+        self.assertEqual(self.request({'t': 'delete', 'o': 'Server', 'on': 'web4'})['status'], 'error')
+        self.assertEqual(self.request({'t': 'get', 'o': 'VirtualServer', 'on': 'web4'})['status'], 'ok')
+
+    def test_cache_consistency(self):
+        """
+        Verify reads stay consistent with committed changes when they are served by the object cache
+        """
+        self.request({'t': 'create', 'o': 'Server', 'on': 'web5'})
+        self.request({'t': 'create', 'o': 'VirtualServer', 'on': 'vip5'})
+        self.request({'t': 'list', 'o': 'VirtualServer', 'on': 'vip5'})
+
+        self.request({'t': 'add_ref', 'o': 'VirtualServer', 'on': 'vip5', 'f': 'Server', 'fv': 'web5', 'rv': 'servers'})
+        self.request({'t': 'modify', 'o': 'VirtualServer', 'on': 'vip5', 'f': 'port', 'fv': 443})
+        reply = self.request({'t': 'list', 'o': 'VirtualServer', 'on': 'vip5'})
+        self.assertEqual(reply['result'][0]['servers'], ['web5'])
+        self.assertEqual(reply['result'][0]['port'], 443)
+
+        self.request({'t': 'delete', 'o': 'Server', 'on': 'web5'})
+        reply = self.request({'t': 'list', 'o': 'VirtualServer'})
+        self.assertEqual([(r['name'], r['servers']) for r in reply['result']], [('vip5', [])])
+        self.assertEqual(self.request({'t': 'list', 'o': 'Server'})['result'], [])
+
+        stats = self.request({'t': 'cache_stats'})['result']
+        self.assertGreater(stats['hits'], 0)
+
+    def test_cache_modify(self):
+        """
+        Verify the object cache holds what was committed, rather than what the client sent, and follows renames
+        """
+        self.request({'t': 'create', 'o': 'Server', 'on': 'web7'})
+        self.request({'t': 'create', 'o': 'VirtualServer', 'on': 'vip7'})
+        self.request({'t': 'add_ref', 'o': 'VirtualServer', 'on': 'vip7', 'f': 'Server', 'fv': 'web7', 'rv': 'servers'})
+        self.request({'t': 'list', 'o': 'Server', 'on': 'web7'})
+        self.request({'t': 'list', 'o': 'VirtualServer', 'on': 'vip7'})
+
+        self.request({'t': 'modify', 'o': 'Server', 'on': 'web7', 'f': 'port', 'fv': '80'})
+        self.assertEqual(self.request({'t': 'list', 'o': 'Server', 'on': 'web7'})['result'][0]['port'], 80)
+        self.assertEqual(self.request({'t': 'list', 'o': 'Server'})['result'][0]['port'], 80)
+
+        # Numeric columns come back as numbers, whichever encoding is used
+        self.request({'t': 'modify', 'o': 'Server', 'on': 'web7', 'f': 'weight', 'fv': '1.25'})
+        self.assertEqual(self.request({'t': 'list', 'o': 'Server', 'on': 'web7'})['result'][0]['weight'], 1.25)
+        self.req_socket.send(msgpack.packb({'t': 'list', 'o': 'Server', 'on': 'web7'}))
+        self.assertEqual(msgpack.unpackb(self.req_socket.recv())['result'][0]['weight'], 1.25)
+
+        self.request({'t': 'modify', 'o': 'Server', 'on': 'web7', 'f': 'name', 'fv': 'web7b'})
+        self.assertEqual(self.request({'t': 'get', 'o': 'Server', 'on': 'web7'})['status'], 'error')
+        self.assertEqual(self.request({'t': 'get', 'o': 'Server', 'on': 'web7b'})['status'], 'ok')
+        self.assertEqual([obj['name'] for obj in self.request({'t': 'list', 'o': 'Server'})['result']], ['web7b'])
+        reply = self.request({'t': 'list', 'o': 'VirtualServer', 'on': 'vip7'})
+        self.assertEqual(reply['result'][0]['servers'], ['web7b'])
+
+    def test_list_paging(self):
+        """
+        Verify that lists can be paged through, projected and filtered on indexed columns
+        """
+        ops = []
+        for i in range(5):
+            ops.append({'t': 'create', 'o': 'Server', 'on': 'page%d' % i})
+            ops.append({'t': 'modify', 'o': 'Server', 'on': 'page%d' % i, 'f': 'address', 'fv': '10.0.0.%d' % (i % 2)})
+        self.assertEqual(self.request({'t': 'batch', 'ops': ops})['status'], 'ok')
+
+        # Walk all of the pages, the last one comes without a cursor
+        names = []
+        msg = {'t': 'list', 'o': 'Server', 'limit': 2}
+        while True:
+            reply = self.request(msg)
+            self.assertEqual(reply['status'], 'ok')
+            self.assertLessEqual(len(reply['result']), 2)
+            names += [obj['name'] for obj in reply['result']]
+            if 'cursor' not in reply:
+                break
+            msg['cursor'] = reply['cursor']
+        self.assertEqual(names, ['page%d' % i for i in range(5)])
+
+        # Only the requested fields are returned, along with the id and name
+        reply = self.request({'t': 'list', 'o': 'Server', 'fields': ['port'], 'limit': 1})
+        self.assertEqual(sorted(reply['result'][0].keys()), ['id', 'name', 'port'])
+
+        reply = self.request({'t': 'list', 'o': 'Server', 'include_refs': False, 'limit': 1})
+        self.assertNotIn('virtual_servers', reply['result'][0])
+
+        reply = self.request({'t': 'list', 'o': 'Server', 'filter': {'address': '10.0.0.1'}})
+        self.assertEqual([obj['name'] for obj in reply['result']], ['page1', 'page3'])
+
+        reply = self.request({'t': 'list', 'o': 'Server', 'filter': {'name': 'page4'}})
+        self.assertEqual([obj['name'] for obj in reply['result']], ['page4'])
+
+        # Columns without an index can't be filtered on
+        reply = self.request({'t': 'list', 'o': 'Server', 'filter': {'port': 80}})
+        self.assertEqual(reply['status'], 'error')
+
+        reply = self.request({'t': 'list', 'o': 'Server', 'fields': ['nonexistent']})
+        self.assertEqual(reply['status'], 'error')
+
+    def test_changes_since(self):
+        """
+        Verify that changes are revisioned, chained per model, and can be fetched again after they were published
+        """
+        revision = self.request({'t': 'list', 'o': 'Server'})['revision']
+
+        self.request({'t': 'create', 'o': 'Server', 'on': 'web6'})
+        self.request({'t': 'create', 'o': 'VirtualServer', 'on': 'vip6'})
+        reply = self.request({'t': 'modify', 'o': 'Server', 'on': 'web6', 'f': 'port', 'fv': 8080})
+        events = self.events()
+
+        # Revisions count up across models, and each event points at the previous one for the same model
+        self.assertEqual([e[1]['rev'] for e in events], [revision + 1, revision + 2, revision + 3])
+        self.assertEqual(events[2][1]['prev'], revision + 1)
+        self.assertEqual(reply['revision'], revision + 3)
+
+        # Events about a field carry its ID along with its name
+        self.assertEqual(events[2][1]['fid'], field_id('port'))
+        self.assertNotIn('fid', events[0][1])
+
+        reply = self.request({'t': 'changes_since', 'o': 'Server', 'rev': revision})
+        self.assertEqual(reply['revision'], revision + 3)
+        self.assertEqual(reply['changes'], [events[0], events[2]])
+
+        reply = self.request({'t': 'changes_since', 'rev': revision + 1})
+        self.assertEqual(reply['changes'], events[1:])
+
+        reply = self.request({'t': 'changes_since', 'rev': revision + 3})
+        self.assertEqual(reply['changes'], [])
+
+        # Revisions only mean something along with the epoch of the database they belong to
+        epoch = self.request({'t': 'list', 'o': 'Server'})['epoch']
+        self.assertEqual(reply['epoch'], epoch)
+
+        # Daemons catch up on several models in one round trip
+        reply = self.request({'t': 'batch', 'ops': [{'t': 'changes_since', 'o': 'Server', 'rev': revision},
+                                                    {'t': 'list', 'o': 'VirtualServer', 'on': 'vip6'}]})
+        self.assertEqual(reply['status'], 'ok')
+        self.assertEqual(reply['epoch'], epoch)
+        self.assertEqual(reply['results'][0]['changes'], [events[0], events[2]])
+        self.assertEqual(reply['results'][1]['result'][0]['name'], 'vip6')
+
+        # A revision the log never got to means the database was replaced, so everything has to be reloaded
+        reply = self.request({'t': 'changes_since', 'rev': revision + 1000})
+        self.assertTrue(reply['resync'])
+
+        self.assertEqual(self.request({'t': 'changes_since'})['status'], 'error')
+
+    def test_msgpack(self):
+        """
+        Verify requests sent as MessagePack are answered in MessagePack, by the writer and the worker threads alike
+        """
+        for msg in [{'t': 'create', 'o': 'Server', 'on': 'web8'}, {'t': 'list', 'o': 'Server', 'on': 'web8'}]:
+            self.req_socket.send(msgpack.packb(msg))
+            reply = self.req_socket.recv()
+            self.assertGreaterEqual(ord(reply[0]), 0x80)
+            self.assertEqual(msgpack.unpackb(reply)['status'], 'ok')
+
+        self.req_socket.send(msgpack.packb({'t': 'list', 'o': 'Server', 'on': 'web8'}))
+        self.assertEqual(msgpack.unpackb(self.req_socket.recv())['result'][0]['name'], 'web8')
+
+    def test_topics(self):
+        """
+        Verify subscribers only get the events of the models and objects they subscribed to
+        """
+        sub_socket = self.context.socket(zmq.SUB)
+        sub_socket.setsockopt(zmq.RCVTIMEO, 1000)
+        sub_socket.setsockopt(zmq.LINGER, 0)
+        sub_socket.setsockopt(zmq.SUBSCRIBE, 'Server\0web9\0')
+        sub_socket.setsockopt(zmq.SUBSCRIBE, 'VirtualServer\0')
+        sub_socket.connect('tcp://localhost:%d' % settings.ZMQ_PUBSUB_PORT)
+        time.sleep(0.5)
+
+        self.request({'t': 'batch', 'ops': [
+            {'t': 'create', 'o': 'Server', 'on': 'web9'},
+            {'t': 'create', 'o': 'Server', 'on': 'web10'},
+            {'t': 'create', 'o': 'VirtualServer', 'on': 'vip9'},
+            {'t': 'delete_all', 'o': 'VirtualServer'},
+        ]})
+
+        topics = []
+        try:
+            while True:
+                topics.append(sub_socket.recv_multipart()[0])
+        except zmq.Again:
+            sub_socket.close()
+
+        self.assertEqual(topics, ['Server\0web9\0', 'VirtualServer\0vip9\0', 'VirtualServer\0'])
+
+    def test_conflation(self):
+        """
+        Verify rapid updates of a conflated field are committed and published once, with the latest value
+        """
+        self.request({'t': 'delete_all', 'o': 'Interface'})
+        self.request({'t': 'create', 'o': 'Interface', 'on': 'eth0'})
+        self.events()
+        before = self.request({'t': 'conflate_stats'})['result']
+
+        for count in range(100):
+            reply = self.request({'t': 'modify', 'o': 'Interface', 'on': 'eth0', 'f': 'packets_in', 'fv': count})
+            self.assertTrue(reply['conflated'])
+
+        time.sleep(settings.CPDKD_CONFLATE_INTERVAL / 1000.0 + 0.5)
+        events = self.events()
+        self.assertEqual(len(events), 1)
+        self.assertDictContainsSubset({'obj': 'eth0', 'field': 'packets_in', 'value': 99}, events[0][1])
+
+        reply = self.request({'t': 'list', 'o': 'Interface', 'on': 'eth0'})
+        self.assertEqual(reply['result'][0]['packets_in'], 99)
+
+        after = self.request({'t': 'conflate_stats'})['result']
+        self.assertEqual(after['coalesced'] - before['coalesced'], 99)
+        self.assertEqual(after['flushed'] - before['flushed'], 1)
+
+        # Pending updates of a deleted object are dropped
+        self.request({'t': 'modify', 'o': 'Interface', 'on': 'eth0', 'f': 'packets_in', 'fv': 100})
+        self.request({'t': 'delete', 'o': 'Interface', 'on': 'eth0'})
+        time.sleep(settings.CPDKD_CONFLATE_INTERVAL / 1000.0 + 0.5)
+        self.assertEqual([e[1]['type'] for e in self.events()], [2])
+        self.assertEqual(self.request({'t': 'conflate_stats'})['result']['dropped'] - after['dropped'], 1)
+
+        # An update with a bad object name is refused, and a value the database rejects only loses that update
+        reply = self.request({'t': 'modify', 'o': 'Interface', 'on': ['eth0'], 'f': 'packets_in', 'fv': 1})
+        self.assertEqual(reply['status'], 'error')
+        self.request({'t': 'create', 'o': 'Interface', 'on': 'eth2'})
+        self.request({'t': 'create', 'o': 'Interface', 'on': 'eth3'})
+        self.events()
+        self.request({'t': 'modify', 'o': 'Interface', 'on': 'eth2', 'f': 'packets_in', 'fv': {'bad': 1}})
+        self.request({'t': 'modify', 'o': 'Interface', 'on': 'eth3', 'f': 'packets_in', 'fv': 5})
+        time.sleep(settings.CPDKD_CONFLATE_INTERVAL / 1000.0 + 0.5)
+        events = self.events()
+        self.assertEqual(len(events), 1)
+        self.assertDictContainsSubset({'obj': 'eth3', 'field': 'packets_in', 'value': 5}, events[0][1])
+        self.assertEqual(self.request({'t': 'list', 'o': 'Interface', 'on': 'eth3'})['result'][0]['packets_in'], 5)
+        self.assertIsNone(self.cpdkd_process.poll())
+
+    def test_batch_conflation(self):
+        """
+        Verify conflated updates in a batch are handed to the conflator once the rest of the batch has been committed
+        """
+        self.request({'t': 'delete_all', 'o': 'Interface'})
+        self.events()
+
+        reply = self.request({'t': 'batch', 'ops': [
+            {'t': 'create', 'o': 'Interface', 'on': 'eth1'},
+            {'t': 'modify', 'o': 'Interface', 'on': 'eth1', 'f': 'packets_in', 'fv': 1},
+            {'t': 'modify', 'o': 'Interface', 'on': 'eth1', 'f': 'packets_in', 'fv': 2},
+        ]})
+        self.assertEqual(reply['status'], 'ok')
+        self.assertEqual([result.get('conflated') for result in reply['results']], [None, True, True])
+
+        time.sleep(settings.CPDKD_CONFLATE_INTERVAL / 1000.0 + 0.5)
+        events = self.events()
+        self.assertEqual([e[1]['type'] for e in events], [1, 3])
+        self.assertDictContainsSubset({'obj': 'eth1', 'field': 'packets_in', 'value': 2}, events[1][1])
+
+        # Malformed updates of a model with conflated fields fail like any other operation
+        for op in [{'t': 'modify', 'o': 'Interface', 'on': 'eth1', 'fv': 1},
+                   {'t': 'modify', 'o': 'Interface', 'on': 'eth1', 'f': ['packets_in'], 'fv': 1},
+                   {'t': 'modify', 'o': 'Interface', 'on': ['eth1'], 'f': 'packets_in', 'fv': 1}]:
+            reply = self.request({'t': 'batch', 'ops': [op]})
+            self.assertEqual(reply['status'], 'error')
+            self.assertEqual(reply['index'], 0)
+            self.assertEqual(self.request(op)['status'], 'error')
+
+        # A bad conflated update fails the batch before anything is committed
+        reply = self.request({'t': 'batch', 'ops': [
+            {'t': 'create', 'o': 'Interface', 'on': 'eth4'},
+            {'t': 'modify', 'o': 'Interface', 'on': {'name': 'eth4'}, 'f': 'packets_in', 'fv': 1},
+        ]})
+        self.assertEqual(reply['index'], 1)
+        self.assertEqual(self.request({'t': 'get', 'o': 'Interface', 'on': 'eth4'})['status'], 'error')
+
+        # Nothing is handed over when the batch fails
+        before = self.request({'t': 'conflate_stats'})['result']
+        reply = self.request({'t': 'batch', 'ops': [
+            {'t': 'modify', 'o': 'Interface', 'on': 'eth1', 'f': 'packets_in', 'fv': 3},
+            {'t': 'create', 'o': 'NoSuchModel', 'on': 'x'},
+        ]})
+        self.assertEqual(reply['status'], 'error')
+        time.sleep(settings.CPDKD_CONFLATE_INTERVAL / 1000.0 + 0.5)
+        self.assertEqual(self.events(), [])
+        self.assertEqual(self.request({'t': 'conflate_stats'})['result'], before)
+
+    def test_stats(self):
+        """
+        Verify requests and published events show up in the stats
+        """
+        before = self.request({'t': 'stats'})['result']
+        self.request({'t': 'create', 'o': 'Server', 'on': 'web11'})
+        self.request({'t': 'get', 'o': 'Server', 'on': 'web11'})
+        self.request({'t': 'get', 'o': 'Server', 'on': 'web12'})
+        after = self.request({'t': 'stats'})['result']
+
+        self.assertEqual(after['requests']['create']['count'] - before['requests'].get('create', {}).get('count', 0), 1)
+        self.assertEqual(after['requests']['get']['count'] - before['requests'].get('get', {}).get('count', 0), 2)
+        self.assertGreaterEqual(after['requests']['get']['errors'], 1)
+        self.assertGreater(after['requests']['create']['sql_statements'], 0)
+        self.assertGreater(after['published']['Server']['events'], before['published']['Server']['events'])
+        self.assertEqual(after['revision'], self.request({'t': 'list', 'o': 'Server'})['revision'])
+
+    def test_profile(self):
+        """
+        Verify request profiling can be turned on and off at runtime, and writes a profile per message type
+        """
+        reply = self.request({'t': 'profile', 'action': 'start', 'sample': 1})
+        self.assertEqual(reply['status'], 'ok')
+        self.assertEqual(self.request({'t': 'profile', 'action': 'start'})['status'], 'error')
+
+        self.request({'t': 'create', 'o': 'Server', 'on': 'web13'})
+        self.request({'t': 'get', 'o': 'Server', 'on': 'web13'})
+        self.assertEqual(self.request({'t': 'profile'})['result']['sampled'], 2)
+
+        reply = self.request({'t': 'profile', 'action': 'stop'})
+        self.assertEqual(reply['status'], 'ok')
+        try:
+            self.assertEqual(len(reply['files']), 5)
+            self.assertTrue(any(f.endswith('-create.prof') for f in reply['files']))
+            with open([f for f in reply['files'] if f.endswith('-sql.txt')][0]) as f:
+                self.assertIn('INSERT INTO server', f.read())
+        finally:
+            for f in reply['files']:
+                os.remove(f)
+            if not os.listdir(settings.PROFILE_DIR):
+                os.rmdir(settings.PROFILE_DIR)
+
+        self.assertEqual(self.request({'t': 'profile', 'action': 'stop'})['status'], 'error')
+
+    def test_dump_load(self):
+        """
+        Verify a dump can be loaded back, and CPDKd publishes the reload
+        """
+        self.request({'t': 'create', 'o': 'Server', 'on': 'web14'})
+        self.request({'t': 'modify', 'o': 'Server', 'on': 'web14', 'f': 'port', 'fv': 8014})
+        self.request({'t': 'modify', 'o': 'Server', 'on': 'web14', 'f': 'weight', 'fv': 2.5})
+        self.request({'t': 'create', 'o': 'VirtualServer', 'on': 'vip14'})
+        self.request({'t': 'add_ref', 'o': 'Server', 'on': 'web14', 'f': 'VirtualServer', 'fv': 'vip14',
+                      'rv': 'virtual_servers'})
+        reply = self.request({'t': 'list', 'o': 'Server', 'on': 'web14'})
+        before, epoch = reply['result'][0], reply['epoch']
+        self.events()
+
+        dump_file = 'examples/basic/cpdk_dump.jsonl.gz'
+        try:
+            subprocess.check_call('python cpdk-util.py --settings examples.basic.settings --dump %s' % dump_file,
+                                  shell=True, stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+            subprocess.check_call('python cpdk-util.py --settings examples.basic.settings --load %s --replace'
+                                  % dump_file, shell=True, stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+            events = self.events()
+            self.assertEqual(sorted(e[0] for e in events), ['Interface', 'Server', 'VirtualServer'])
+            self.assertEqual(set(e[1]['type'] for e in events), set([7]))
+
+            # Revisions handed out before the load no longer apply
+            reply = self.request({'t': 'list', 'o': 'Server', 'on': 'web14'})
+            after = reply['result'][0]
+            self.assertNotEqual(reply['epoch'], epoch)
+            del before['id'], after['id']
+            self.assertEqual(before, after)
+            self.assertEqual(after['weight'], 2.5)
+
+            # For older daemons, every object can be published as if it had just been created
+            subprocess.check_call('python cpdk-util.py --settings examples.basic.settings --load %s --replace '
+                                  '--reload-events' % dump_file,
+                                  shell=True, stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+            events = [e[1] for e in self.events() if e[0] == 'Server']
+            self.assertEqual(events[0]['type'], 6)
+            self.assertIn({'type': 3, 'obj': 'web14', 'field': 'port', 'fid': field_id('port'), 'value': 8014},
+                          [dict((k, e[k]) for k in e if k not in ('rev', 'prev')) for e in events])
+            self.assertIn({'type': 4, 'obj': 'web14', 'field': 'VirtualServer', 'fid': field_id('VirtualServer'),
+                           'value': 'vip14'},
+                          [dict((k, e[k]) for k in e if k not in ('rev', 'prev')) for e in events])
+        finally:
+            if os.path.exists(dump_file):
+                os.remove(dump_file)
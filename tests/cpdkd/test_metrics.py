@@ -0,0 +1,51 @@
+from unittest import TestCase
+from cpdk_metrics import Histogram, Metrics
+
+from sqlalchemy import create_engine
+
+
+class MetricsTest(TestCase):
+
+    def test_histogram(self):
+        """
+        Verify percentiles are estimated from the bucket they fall in
+        """
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(0.5))
+
+        for value in [0.05] * 90 + [7] * 9 + [20000]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.percentile(0.5), 0.1)
+        self.assertEqual(histogram.percentile(0.99), 10)
+        self.assertEqual(histogram.percentile(1), 20000)
+
+        stats = histogram.stats()
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['buckets'][0], [0.1, 90])
+        self.assertEqual(stats['buckets'][-1], [None, 1])
+
+    def test_requests(self):
+        """
+        Verify requests are counted by type, along with their errors and SQL statements
+        """
+        engine = create_engine('sqlite://')
+        metrics = Metrics()
+        metrics.instrument_engine(engine)
+
+        # The first connection runs a few statements of its own
+        engine.execute('SELECT 0')
+
+        started = metrics.start_request()
+        engine.execute('SELECT 1')
+        engine.execute('SELECT 2')
+        metrics.end_request('get', started, True)
+        metrics.end_request('get', metrics.start_request(), False)
+        metrics.published('Server', 40)
+        metrics.published('Server', 60)
+
+        stats = metrics.stats()
+        self.assertEqual(stats['requests']['get']['count'], 2)
+        self.assertEqual(stats['requests']['get']['errors'], 1)
+        self.assertEqual(stats['requests']['get']['sql_statements'], 2)
+        self.assertEqual(stats['published'], {'Server': {'events': 2, 'bytes': 100}})
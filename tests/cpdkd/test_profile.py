@@ -0,0 +1,18 @@
+from unittest import TestCase
+from cpdk_profile import SQLTimer
+
+
+class SQLTimerTest(TestCase):
+
+    def test_started_mid_statement(self):
+        """
+        Verify a statement which was already running when the timer was started is skipped, rather than failing
+        """
+        timer = SQLTimer()
+        timer.after_cursor_execute(None, None, 'SELECT 1', (), None, False)
+        self.assertEqual(timer.statements, {})
+
+        timer.before_cursor_execute(None, None, 'SELECT 1', (), None, False)
+        timer.after_cursor_execute(None, None, 'SELECT 1', (), None, False)
+        timer.after_cursor_execute(None, None, 'SELECT 1', (), None, False)
+        self.assertEqual(timer.statements['SELECT 1'][0], 1)
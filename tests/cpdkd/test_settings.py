@@ -0,0 +1,27 @@
+import types
+import settings
+from unittest import TestCase
+from cpdk_settings import DEFAULTS, apply_defaults
+
+
+class SettingsTest(TestCase):
+
+    def test_defaults(self):
+        """
+        Verify a settings module written before the newer settings gets their defaults, and keeps its own values
+        """
+        old_settings = types.ModuleType('old_settings')
+        old_settings.DB_NAME = 'old.db'
+        old_settings.CPDKD_CACHE_SIZE = 500
+        apply_defaults(old_settings)
+
+        self.assertEqual(old_settings.DB_NAME, 'old.db')
+        self.assertEqual(old_settings.CPDKD_CACHE_SIZE, 500)
+        self.assertEqual(old_settings.CPDKD_WORKER_THREADS, DEFAULTS['CPDKD_WORKER_THREADS'])
+
+    def test_settings_file(self):
+        """
+        Verify the defaults match the documented settings file
+        """
+        for name, value in DEFAULTS.iteritems():
+            self.assertEqual(getattr(settings, name), value, name)
@@ -0,0 +1,119 @@
+import time
+import json
+import threading
+from unittest import TestCase
+
+import CPDKd
+
+
+class WorkerPoolTest(TestCase):
+    """
+    Exercises the WorkerPool on its own. Messages are handled by handle_message() below rather than CPDKd's own
+    handler, so the tests control how long each one takes, and which fail.
+    """
+
+    def setUp(self):
+        self.handle_config_msg = CPDKd.handle_config_msg
+        CPDKd.handle_config_msg = self.handle_message
+        CPDKd.is_running = True
+
+        # Messages of type 'wait' are held up until their event is set
+        self.events = {}
+
+        self.pool = CPDKd.WorkerPool(2)
+        self.wait_for(lambda: len(self.pool.idle_workers) == 2)
+
+    def tearDown(self):
+        for event in self.events.itervalues():
+            event.set()
+        CPDKd.is_running = False
+        if not self.pool.zmq_socket.closed:
+            self.pool.join()
+        CPDKd.handle_config_msg = self.handle_config_msg
+        CPDKd.is_running = True
+
+    def handle_message(self, msg, zmq_pub_socket):
+        """
+        Stand-in for CPDKd.handle_config_msg()
+        """
+        if msg['t'] == 'wait':
+            self.events[msg['n']].wait(5)
+        elif msg['t'] == 'fail':
+            raise RuntimeError('failed on purpose')
+        return {'status': 'ok', 'n': msg['n'], 'thread': threading.current_thread().name}
+
+    def wait_for(self, condition, replies=None):
+        """
+        Hand out the replies of the workers, until a condition is met
+        :param condition: Function returning True once done
+        :param replies: List the replies are appended to, as (front end name, envelope, decoded reply) tuples
+        """
+        deadline = time.time() + 5
+        while not condition():
+            self.assertLess(time.time(), deadline, 'timed out waiting for the workers')
+            if self.pool.zmq_socket.poll(50):
+                for frontend_name, envelope, reply in self.pool.drain_replies():
+                    replies.append((frontend_name, envelope, json.loads(reply)))
+
+    def dispatch(self, frontend_name, envelope, msg):
+        if msg['t'] == 'wait':
+            self.events[msg['n']] = threading.Event()
+        self.pool.dispatch(frontend_name, envelope, json.dumps(msg))
+
+    def test_queueing(self):
+        """
+        Verify requests are queued while every worker is busy, and handed out as the workers become idle
+        """
+        self.dispatch('cli', ['a'], {'t': 'wait', 'n': 1})
+        self.dispatch('cli', ['b'], {'t': 'wait', 'n': 2})
+        self.dispatch('cli', ['c'], {'t': 'get', 'n': 3})
+        self.assertEqual(len(self.pool.idle_workers), 0)
+        self.assertEqual(len(self.pool.pending), 1)
+
+        # The queued request goes to the first worker done
+        replies = []
+        self.events[2].set()
+        self.wait_for(lambda: len(replies) == 2, replies)
+        self.assertEqual([reply['n'] for frontend_name, envelope, reply in replies], [2, 3])
+        self.assertEqual(replies[0][2]['thread'], replies[1][2]['thread'])
+        self.assertEqual(len(self.pool.pending), 0)
+
+        self.events[1].set()
+        self.wait_for(lambda: len(replies) == 3, replies)
+        self.assertEqual(len(self.pool.idle_workers), 2)
+
+    def test_routing(self):
+        """
+        Verify every reply is sent back with the front end and routing frames of its request
+        """
+        self.dispatch('cli', ['client1'], {'t': 'get', 'n': 1})
+        self.dispatch('daemon', ['client2', 'hop'], {'t': 'get', 'n': 2})
+        self.dispatch('daemon', ['client3'], {'t': 'get', 'n': 3})
+
+        replies = []
+        self.wait_for(lambda: len(replies) == 3, replies)
+        self.assertEqual(sorted((reply['n'], frontend_name, envelope) for frontend_name, envelope, reply in replies),
+                         [(1, 'cli', ['client1']), (2, 'daemon', ['client2', 'hop']), (3, 'daemon', ['client3'])])
+
+    def test_worker_exception(self):
+        """
+        Verify a request which raises is answered with an error, and the worker carries on
+        """
+        self.dispatch('cli', ['a'], {'t': 'fail', 'n': 1})
+        replies = []
+        self.wait_for(lambda: len(replies) == 1, replies)
+        self.assertEqual(replies[0][2]['status'], 'error')
+        self.assertIn('failed on purpose', replies[0][2]['message'])
+
+        for n in range(2, 6):
+            self.dispatch('cli', ['a'], {'t': 'get', 'n': n})
+        self.wait_for(lambda: len(replies) == 5, replies)
+        self.assertEqual(len(self.pool.idle_workers), 2)
+
+    def test_join(self):
+        """
+        Verify the workers exit once CPDKd stops running
+        """
+        CPDKd.is_running = False
+        self.pool.join()
+        self.assertFalse(any(thread.is_alive() for thread in self.pool.threads))
@@ -1,5 +1,5 @@
 import os
-from subprocess import call
+from subprocess import call, check_output
 from unittest import TestCase
 
 
@@ -20,7 +20,8 @@ class BasicExample(TestCase):
         # Verify the generated files exist
         for f in ['./examples/basic/c_src/Interface.h',
                   './examples/basic/c_src/Server.h',
-                  './examples/basic/c_src/VirtualServer.h']:
+                  './examples/basic/c_src/VirtualServer.h',
+                  './examples/basic/c_src/cpdk_runtime.h']:
             self.assertTrue(os.path.exists(f))
 
         # Validate the example compiles
@@ -29,3 +30,37 @@ class BasicExample(TestCase):
 
         # Clean up any files left around
         call(['cd ./examples/basic/c_src; make clean'], shell=True)
+
+    def test_exportcpp_incremental(self):
+        """
+        Validate cpdk-util.py only rewrites the headers which are out of date.
+        """
+        headers = ['./examples/basic/c_src/Interface.h',
+                   './examples/basic/c_src/Server.h',
+                   './examples/basic/c_src/VirtualServer.h',
+                   './examples/basic/c_src/cpdk_runtime.h']
+
+        ret = call(['python', 'cpdk-util.py', '--settings', 'examples.basic.settings', '--exportcpp'])
+        self.assertEqual(ret, 0)
+        mtimes = [os.stat(f).st_mtime for f in headers]
+
+        # Nothing changed, so nothing is written
+        output = check_output(['python', 'cpdk-util.py', '--settings', 'examples.basic.settings', '--exportcpp'])
+        self.assertIn('Regenerated 0 of 3 headers', output)
+        self.assertNotIn('Regenerated cpdk_runtime.h', output)
+        self.assertEqual([os.stat(f).st_mtime for f in headers], mtimes)
+
+        # A header whose fingerprint doesn't match is generated again, and ends up the same as before
+        with open(headers[1], 'r') as fh:
+            original = fh.read()
+        with open(headers[1], 'w') as fh:
+            fh.write(original.replace('Fingerprint: ', 'Fingerprint: stale', 1))
+
+        output = check_output(['python', 'cpdk-util.py', '--settings', 'examples.basic.settings', '--exportcpp'])
+        self.assertIn('Regenerated Server.h', output)
+        self.assertIn('Regenerated 1 of 3 headers', output)
+        with open(headers[1], 'r') as fh:
+            self.assertEqual(fh.read(), original)
+        self.assertEqual(os.stat(headers[0]).st_mtime, mtimes[0])
+        self.assertEqual(os.stat(headers[2]).st_mtime, mtimes[2])
+        self.assertEqual(os.stat(headers[3]).st_mtime, mtimes[3])
@@ -0,0 +1,53 @@
+from unittest import TestCase
+from sqlalchemy import Boolean, Integer, BigInteger, SmallInteger, Float, Numeric, String, Text, Unicode, Enum
+from sqlalchemy import DateTime
+from cpdk_template import Template, cpp_type
+
+
+class TemplateTest(TestCase):
+
+    def test_render(self):
+        """
+        Verify placeholders are filled in wherever they appear, and everything else is left alone
+        """
+        template = Template('class {{ NAME }} {\n    int x[2] = {{1, 2}};\n};\n// end of {{ NAME }}{{ SUFFIX }}')
+        self.assertEqual(template.placeholders(), set(['NAME', 'SUFFIX']))
+        self.assertEqual(template.render({'NAME': 'Server', 'SUFFIX': ''}),
+                         'class Server {\n    int x[2] = {{1, 2}};\n};\n// end of Server')
+
+        # Templates are reusable
+        self.assertEqual(template.render({'NAME': 'Interface', 'SUFFIX': '!'}),
+                         'class Interface {\n    int x[2] = {{1, 2}};\n};\n// end of Interface!')
+
+    def test_render_missing(self):
+        """
+        Verify rendering fails if a placeholder has no value
+        """
+        with self.assertRaises(KeyError):
+            Template('{{ NAME }}').render({})
+
+    def test_no_placeholders(self):
+        """
+        Verify a template without placeholders renders as itself
+        """
+        self.assertEqual(Template('').render({}), '')
+        self.assertEqual(Template('plain').render({}), 'plain')
+
+    def test_cpp_types(self):
+        """
+        Verify column types map to C++ types, including the ones only matched by their base classes
+        """
+        self.assertEqual(cpp_type(Boolean()), 'bool')
+        self.assertEqual(cpp_type(Integer()), 'int')
+        self.assertEqual(cpp_type(SmallInteger()), 'int')
+        self.assertEqual(cpp_type(BigInteger()), 'uint64_t')
+        self.assertEqual(cpp_type(Float()), 'double')
+        self.assertEqual(cpp_type(Numeric()), 'double')
+        self.assertEqual(cpp_type(String(32)), 'std::string')
+        self.assertEqual(cpp_type(Text()), 'std::string')
+        self.assertEqual(cpp_type(Unicode()), 'std::string')
+        self.assertEqual(cpp_type(Enum('up', 'down')), 'std::string')
+        self.assertEqual(cpp_type(Float), 'double')
+
+        with self.assertRaises(NotImplementedError):
+            cpp_type(DateTime())
@@ -0,0 +1,36 @@
+import os
+import settings
+import tempfile
+from unittest import TestCase
+from sqlalchemy import create_engine
+from sqlalchemy.inspection import inspect as sql_inspect
+from cpdk_db import import_user_models, create_db
+
+
+class TestCreateMissingIndexes(TestCase):
+    def test_existing_table(self):
+        """
+        Verify that create_db() indexes a table laid down before the indexes were declared, once it has no duplicates
+        :return: None
+        """
+        settings.MODELS_DIR = 'tests/model_import/models/single_file/'
+        import_user_models(settings.MODELS_DIR)
+
+        handle, db_name = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        try:
+            engine = create_engine('sqlite:///' + db_name)
+            engine.execute('CREATE TABLE testmodel (id INTEGER PRIMARY KEY, name TEXT, string VARCHAR, '
+                           'integer INTEGER, boolean BOOLEAN, floating_point FLOAT)')
+            engine.execute("INSERT INTO testmodel (name) VALUES ('a'), ('b'), ('b')")
+
+            # The duplicate names have to be sorted out first
+            self.assertEqual(create_db(db_name, False), {'ix_testmodel_name': ['b']})
+            self.assertEqual(sql_inspect(engine).get_indexes('testmodel'), [])
+
+            engine.execute("DELETE FROM testmodel WHERE id = 3")
+            self.assertEqual(create_db(db_name, False), {})
+            indexes = sql_inspect(engine).get_indexes('testmodel')
+            self.assertEqual([(index['name'], index['unique']) for index in indexes], [('ix_testmodel_name', 1)])
+        finally:
+            os.remove(db_name)
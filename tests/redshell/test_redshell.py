@@ -1,10 +1,14 @@
 import os
+import imp
 import sys
 import time
+import shutil
 import signal
 import pexpect
+import tempfile
 import subprocess
 from unittest import TestCase
+from cpdk_cli import build_cli
 
 
 class RedShellTest(TestCase):
@@ -67,6 +71,89 @@ class RedShellTest(TestCase):
         c.sendline('exit')
         c.close()
 
+    def test_references(self):
+        """
+        Verify references can be added and removed, and objects deleted, through the shared commands
+        """
+        c = pexpect.spawn('python redshell.py --settings examples.basic.settings')
+        c.logfile = sys.stdout
+        c.expect('Global>')
+        c.sendline('virtual Vippy')
+        c.expect('virtual-Vippy>')
+        c.sendline('exit')
+        c.expect('Global>')
+
+        c.sendline('server Serv')
+        c.expect('server-Serv>')
+        c.sendline('add VirtualServer Vippy')
+        c.expect('server-Serv>')
+        c.sendline('add Interface eth0')
+        c.expect('server-Serv>')
+        self.assertIn('Interface can not be referenced', c.before)
+        c.sendline('show virtual Vippy')
+        c.expect('server-Serv>')
+        self.assertIn('Servers:', c.before)
+
+        c.sendline('remove VirtualServer Vippy')
+        c.expect('server-Serv>')
+        c.sendline('show virtual Vippy')
+        c.expect('server-Serv>')
+        self.assertNotIn('Servers:', c.before)
+        c.sendline('exit')
+        c.expect('Global>')
+
+        # Daemon managed objects can't be deleted, everything else can
+        c.sendline('delete port eth0')
+        c.expect('Global>')
+        self.assertIn('port objects can not be deleted', c.before)
+        c.sendline('delete server Serv')
+        c.expect('Global>')
+        c.sendline('show server')
+        c.expect('Global>')
+        self.assertNotIn('Serv', c.before.replace('show server', ''))
+        c.sendline('show bogus')
+        c.expect('Global>')
+        self.assertIn('unknown mode bogus', c.before)
+        c.sendline('exit')
+        c.close()
+
 
+class SchemaTest(TestCase):
 
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        build_cli('examples/basic/models', os.path.join(self.tmp_dir, 'schema.py'))
+        self.schema = imp.load_source('test_schema', os.path.join(self.tmp_dir, 'schema.py'))
 
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lazy_models(self):
+        """
+        Verify the models are only imported to display objects of models which format themselves
+        """
+        imported = []
+
+        def import_models():
+            from cpdk_db import import_user_models
+            imported.append(True)
+            return import_user_models('examples/basic/models')
+
+        Global = self.schema.Global
+        Global.import_models = staticmethod(import_models)
+        Global.models = None
+
+        # Interface doesn't override __str__, so the schema formats it
+        self.assertFalse(self.schema.Interface.custom_display)
+        output = Global().display(self.schema.Interface, {'id': 1, 'name': 'eth0', 'enabled': True,
+                                                          'packets_in': 0, 'packets_out': 7})
+        self.assertEqual(output, 'eth0\n===================\nid: 1\nname: eth0\nenabled: True\npackets_out: 7\n')
+        self.assertEqual(imported, [])
+
+        # Server does, so the models are imported, once
+        self.assertTrue(self.schema.Server.custom_display)
+        for x in range(2):
+            output = Global().display(self.schema.Server, {'id': 1, 'name': 'web', 'address': '1.1.1.1', 'port': 80,
+                                                           'enabled': False})
+            self.assertIn('Address: 1.1.1.1', output)
+        self.assertEqual(imported, [True])